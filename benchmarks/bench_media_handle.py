@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""media_handle 重命名流程的基准测试
+
+在 tmpfs 中生成模拟的下载目录 (剧集、动漫合集、电影、电影合集、字幕和垃圾文件)，
+使用假的 TMDB 和可注入延迟的文件系统钩子 (模拟 rclone 挂载) 运行
+handle_tvshow/handle_movie，统计 文件/秒、每个文件的系统调用次数和 TMDB 调用次数。
+不需要网络，STRM、扫描请求等外部操作均被关闭。
+
+用法:
+    python benchmarks/bench_media_handle.py --shows 300 --episodes 10000
+    python benchmarks/bench_media_handle.py --latency-ms 2 --tmdb-latency-ms 200
+"""
+
+import argparse
+import builtins
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import library_index  # noqa: E402
+import media_handle  # noqa: E402
+import rename_journal  # noqa: E402
+from log import logger  # noqa: E402
+
+WORDS = (
+    "alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo lima "
+    "mike november oscar papa quebec romeo sierra tango uniform victor whiskey "
+    "xray yankee zulu"
+).split()
+GROUPS = ["NTb", "FLUX", "CMCTV", "HHWEB", "playWEB"]
+ANIME_GROUPS = ["SubsPlease", "ANi", "Nekomoe kissaten", "LoliHouse"]
+JUNK_FILES = ["RARBG.txt", "www.example.com.url", "poster.jpg", "tvshow.nfo"]
+
+# 被钩子统计的文件系统调用, 均为 os 模块中的函数
+FS_CALLS = [
+    "stat",
+    "lstat",
+    "scandir",
+    "listdir",
+    "rename",
+    "remove",
+    "unlink",
+    "mkdir",
+    "rmdir",
+]
+
+
+def normalize_title(name: str) -> str:
+    name = re.sub(r"\[.*?\]", " ", os.path.basename(name))
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", name.lower()).split())
+
+
+class FakeTMDB:
+    """替代 tmdb.TMDB, 从生成目录时记录的条目中返回结果"""
+
+    catalog: dict = {}
+    calls: Counter = Counter()
+    latency: float = 0
+
+    def __init__(self, movie=True, *args, **kwargs):
+        self.is_movie = movie
+
+    @classmethod
+    def reset(cls, catalog: dict, latency: float = 0):
+        cls.catalog = catalog
+        cls.latency = latency
+        cls.calls = Counter()
+
+    def _call(self, name):
+        FakeTMDB.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_info_from_tmdb(self, query_dict: dict, year_deviation: int = 0) -> dict:
+        self._call("search")
+        key = normalize_title(query_dict.get("query", ""))
+        for tmdb_id, entry in self.catalog.items():
+            if entry["key"] == key:
+                return {"tmdb_id": tmdb_id}
+        return {}
+
+    def get_info_from_tmdb_by_id(self, tmdb_id: str) -> dict:
+        self._call("details")
+        entry = self.catalog[str(tmdb_id)]
+        return {
+            "tmdb_name": f"{entry['title']} ({entry['year']}) {{tmdb-{tmdb_id}}}",
+            "title": entry["title"],
+            "year": entry["year"],
+            "month": entry["month"],
+            "country": "US",
+            "is_anime": entry["anime"],
+            "is_documentary": False,
+            "is_variety": False,
+            "is_nc17": False,
+        }
+
+
+class FsShim:
+    """统计 (并可延迟) os 模块的文件系统调用, 用于模拟 rclone 挂载"""
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.calls = Counter()
+        self._originals = {}
+
+    def _wrap(self, name, func):
+        def wrapper(*args, **kwargs):
+            self.calls[name] += 1
+            if self.latency:
+                time.sleep(self.latency)
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    def __enter__(self):
+        for name in FS_CALLS:
+            self._originals[name] = getattr(os, name)
+            setattr(os, name, self._wrap(name, self._originals[name]))
+        self._originals["open"] = builtins.open
+        builtins.open = self._wrap("open", builtins.open)
+        return self
+
+    def __exit__(self, *exc):
+        builtins.open = self._originals.pop("open")
+        for name, func in self._originals.items():
+            setattr(os, name, func)
+        self._originals = {}
+
+
+def _title(rnd: random.Random, words=3) -> str:
+    return " ".join(w.capitalize() for w in rnd.sample(WORDS, words))
+
+
+def _touch(path: Path, size=0):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        if size:
+            f.truncate(size)
+
+
+def generate_tree(
+    root: Path, shows: int, episodes: int, anime: int, movies: int, seed: int = 0
+) -> tuple[list, dict]:
+    """生成模拟的下载目录, 返回 (任务列表, TMDB 条目)
+
+    任务: (handler, 资源路径, 媒体类型)
+    """
+    rnd = random.Random(seed)
+    catalog, tasks = {}, []
+    next_id = 1000
+
+    def add_entry(title, year, is_anime=False) -> str:
+        nonlocal next_id
+        next_id += 1
+        catalog[str(next_id)] = {
+            "title": title,
+            "key": normalize_title(title),
+            "year": str(year),
+            "month": f"{rnd.randint(1, 12):02d}",
+            "anime": is_anime,
+        }
+        return str(next_id)
+
+    # 剧集: 每部剧 1-3 季, 每集带字幕, 部分目录带垃圾文件和 Sample
+    per_show = max(1, episodes // max(shows, 1))
+    for i in range(shows):
+        title = f"{_title(rnd)} {i}"
+        year = rnd.randint(1990, 2024)
+        add_entry(title, year)
+        group = rnd.choice(GROUPS)
+        seasons = rnd.randint(1, 3)
+        for season in range(1, seasons + 1):
+            name = f"{title.replace(' ', '.')}.{year}.S{season:02d}.1080p.WEB-DL.H264-{group}"
+            folder = root / "tv" / name
+            for ep in range(1, per_show // seasons + 1):
+                stem = f"{title.replace(' ', '.')}.S{season:02d}E{ep:02d}.1080p.WEB-DL.H264-{group}"
+                _touch(folder / f"{stem}.mkv", size=rnd.randint(1, 64) * 1024)
+                if rnd.random() < 0.5:
+                    _touch(folder / f"{stem}.chs.ass")
+            for junk in rnd.sample(JUNK_FILES, rnd.randint(0, 2)):
+                _touch(folder / junk)
+            tasks.append(("tv", folder, "tv"))
+
+    # 动漫合集: 单季 12-26 集
+    for i in range(anime):
+        title = f"{_title(rnd, 2)} Anime {i}"
+        year = rnd.randint(2000, 2024)
+        add_entry(title, year, is_anime=True)
+        group = rnd.choice(ANIME_GROUPS)
+        folder = root / "anime" / f"[{group}] {title} {year} S1 [1080p]"
+        for ep in range(1, rnd.randint(12, 26) + 1):
+            _touch(folder / f"[{group}] {title} - {ep:02d} [1080p].mkv", size=1024)
+            _touch(folder / f"[{group}] {title} - {ep:02d} [1080p].sc.ass")
+        tasks.append(("tv", folder, "anime"))
+
+    # 电影: 单部电影目录和电影合集
+    remaining = movies
+    while remaining > 0:
+        count = 1 if rnd.random() < 0.8 else min(rnd.randint(2, 6), remaining)
+        collection = root / "movies" / f"{_title(rnd, 2)} Collection {remaining}"
+        for _ in range(count):
+            title = f"{_title(rnd)} {remaining}"
+            year = rnd.randint(1970, 2024)
+            add_entry(title, year)
+            stem = f"{title.replace(' ', '.')}.{year}.1080p.BluRay.x264-{rnd.choice(GROUPS)}"
+            folder = collection / stem if count == 1 else collection
+            _touch(folder / f"{stem}.mkv", size=rnd.randint(1, 64) * 1024)
+            if rnd.random() < 0.3:
+                _touch(folder / "Sample" / f"{stem}.sample.mkv")
+            if rnd.random() < 0.5:
+                _touch(folder / f"{stem}.srt")
+            remaining -= 1
+        tasks.append(("movie", collection if count > 1 else folder, "movie"))
+
+    return tasks, catalog
+
+
+@contextmanager
+def isolated_environment(work_dir: Path):
+    """关闭外部操作, 并将索引、日志等状态文件放到临时目录"""
+    patches = [
+        (media_handle, "TMDB", FakeTMDB),
+        (media_handle, "CREATE_STRM_FILE", False),
+        (media_handle, "EMBY_STRM_ASSISTANT_MEDIAINFO", str(work_dir / "mediainfo")),
+        (media_handle, "EMBY_STRM_ASSISTANT_MEDIAINFO_ASYNC", False),
+        (library_index, "LIBRARY_INDEX_DB", work_dir / "library_index.db"),
+        (rename_journal, "JOURNAL_DIR", work_dir / "journal"),
+    ]
+    originals = [(obj, name, getattr(obj, name)) for obj, name, _ in patches]
+    for obj, name, value in patches:
+        setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        for obj, name, value in originals:
+            setattr(obj, name, value)
+
+
+def count_files(path: Path) -> int:
+    if path.is_file():
+        return 1
+    return sum(len(files) for _, _, files in os.walk(path))
+
+
+def run(tasks: list, dst: Path, fs_latency: float) -> dict:
+    results = {}
+    for kind in ("tv", "anime", "movie"):
+        selected = [task for task in tasks if task[2] == kind]
+        if not selected:
+            continue
+        files = sum(count_files(path) for _, path, _ in selected)
+        FakeTMDB.calls = Counter()
+        failed = 0
+        with FsShim(latency=fs_latency) as shim:
+            start = time.perf_counter()
+            for handler, path, media_type in selected:
+                try:
+                    if handler == "tv":
+                        media_handle.handle_tvshow(
+                            str(path),
+                            tmdb_id=None,
+                            media_type=media_type,
+                            dst_path=str(dst / kind),
+                        )
+                    else:
+                        media_handle.handle_movie(
+                            str(path), tmdb_id=None, dst_path=str(dst / kind)
+                        )
+                except Exception as e:
+                    failed += 1
+                    logger.warning(f"{path} failed: {e}")
+            elapsed = time.perf_counter() - start
+        results[kind] = {
+            "folders": len(selected),
+            "failed": failed,
+            "files": files,
+            "seconds": elapsed,
+            "syscalls": dict(shim.calls),
+            "tmdb": dict(FakeTMDB.calls),
+        }
+    return results
+
+
+def report(results: dict):
+    print(
+        f"{'type':<7}{'folders':>8}{'failed':>8}{'files':>8}{'seconds':>10}"
+        f"{'files/s':>10}{'syscalls/file':>15}{'tmdb/file':>11}"
+    )
+    for kind, result in results.items():
+        files = max(result["files"], 1)
+        print(
+            f"{kind:<7}{result['folders']:>8}{result['failed']:>8}{result['files']:>8}"
+            f"{result['seconds']:>10.2f}{result['files'] / result['seconds']:>10.1f}"
+            f"{sum(result['syscalls'].values()) / files:>15.1f}"
+            f"{sum(result['tmdb'].values()) / files:>11.3f}"
+        )
+    print()
+    for kind, result in results.items():
+        syscalls = ", ".join(
+            f"{name}={count}"
+            for name, count in sorted(result["syscalls"].items(), key=lambda x: -x[1])
+        )
+        tmdb = ", ".join(f"{name}={count}" for name, count in result["tmdb"].items())
+        print(f"{kind}: {syscalls}; tmdb: {tmdb}")
+
+
+def parse():
+    parser = argparse.ArgumentParser(description="Benchmark media rename pipeline")
+    parser.add_argument("--shows", type=int, default=300, help="Number of TV shows")
+    parser.add_argument(
+        "--episodes", type=int, default=10000, help="Total number of episodes"
+    )
+    parser.add_argument("--anime", type=int, default=30, help="Number of anime batches")
+    parser.add_argument("--movies", type=int, default=500, help="Number of movies")
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0,
+        help="Latency injected into every filesystem call, simulates a rclone mount",
+    )
+    parser.add_argument(
+        "--tmdb-latency-ms",
+        type=float,
+        default=0,
+        help="Latency injected into every TMDB call",
+    )
+    parser.add_argument(
+        "--root",
+        default="/dev/shm" if os.path.isdir("/dev/shm") else None,
+        help="Where to create the synthetic tree, tmpfs by default",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the generated tree after running"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show logs")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse()
+    if not args.verbose:
+        logger.setLevel("ERROR")
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_media_handle_", dir=args.root))
+    try:
+        start = time.perf_counter()
+        tasks, catalog = generate_tree(
+            work_dir / "inbox",
+            shows=args.shows,
+            episodes=args.episodes,
+            anime=args.anime,
+            movies=args.movies,
+            seed=args.seed,
+        )
+        print(
+            f"Generated {len(tasks)} folders in {work_dir} "
+            f"({time.perf_counter() - start:.1f}s)"
+        )
+        FakeTMDB.reset(catalog, latency=args.tmdb_latency_ms / 1000)
+        with isolated_environment(work_dir):
+            results = run(
+                tasks, work_dir / "library", fs_latency=args.latency_ms / 1000
+            )
+        report(results)
+    finally:
+        if args.keep:
+            print(f"Kept {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
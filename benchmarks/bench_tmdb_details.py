@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""TMDB 详情请求次数的基准测试
+
+对比 旧流程 (details 默认附带全部内容 + 单独请求 release_dates) 与
+TMDB._get_info_from_tmdb_by_id (一次请求附带 translations/release_dates) 的
+HTTP 请求次数、响应大小和耗时。HTTP 请求由本地桩代替，可注入延迟，不需要网络。
+
+用法:
+    python benchmarks/bench_tmdb_details.py --titles 200 --latency-ms 150
+"""
+
+import argparse
+import json
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from log import logger  # noqa: E402
+from tmdb import TMDB  # noqa: E402
+
+# 旧流程 details 默认附带的内容
+LEGACY_MOVIE_APPEND = "videos,trailers,images,casts,translations,keywords,release_dates"
+LEGACY_TV_APPEND = "videos,trailers,images,credits,translations"
+
+# 附带内容的模拟大小, 接近真实响应
+APPEND_PAYLOADS = {
+    "videos": {"results": [{"key": "x" * 11, "site": "YouTube"}] * 20},
+    "trailers": {"youtube": [{"source": "x" * 11}] * 10},
+    "images": {"backdrops": [{"file_path": "/x.jpg"}] * 80, "posters": []},
+    "casts": {"cast": [{"name": "Actor", "character": "Role"}] * 60},
+    "credits": {"cast": [{"name": "Actor", "character": "Role"}] * 60},
+    "keywords": {"keywords": [{"id": 1, "name": "keyword"}] * 20},
+    "translations": {
+        "translations": [
+            {
+                "iso_3166_1": "SG",
+                "iso_639_1": "zh",
+                "data": {"title": "标题", "name": "标题"},
+            }
+        ]
+    },
+    "release_dates": {
+        "results": [{"iso_3166_1": "US", "release_dates": [{"certification": "R"}]}]
+    },
+}
+
+
+class FakeResponse:
+    def __init__(self, payload: dict):
+        self.text = json.dumps(payload)
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeTransport:
+    """代替 requests 发送 TMDB 请求, 统计请求次数和响应大小"""
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.calls = Counter()
+        self.bytes = 0
+
+    def request(self, method, url, data=None, proxies=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        parsed = urlparse(url)
+        parts = parsed.path.strip("/").split("/")
+        query = parse_qs(parsed.query)
+        if parts[-1] == "release_dates":
+            self.calls["release_dates"] += 1
+            payload = {"id": int(parts[-2]), **APPEND_PAYLOADS["release_dates"]}
+        else:
+            self.calls["details"] += 1
+            payload = self._details(parts[1], int(parts[2]))
+            for append in query.get("append_to_response", [""])[0].split(","):
+                if append in APPEND_PAYLOADS:
+                    payload[append] = APPEND_PAYLOADS[append]
+        response = FakeResponse(payload)
+        self.bytes += len(response.text)
+        return response
+
+    @staticmethod
+    def _details(media_type: str, tmdb_id: int) -> dict:
+        payload = {
+            "id": tmdb_id,
+            "original_language": "en",
+            "origin_country": ["US"],
+            "overview": "x" * 600,
+            "genres": [{"id": 18, "name": "Drama"}],
+        }
+        if media_type == "movie":
+            payload.update(
+                release_date="2020-05-01",
+                title=f"Movie {tmdb_id}",
+                original_title=f"Movie {tmdb_id}",
+            )
+        else:
+            payload.update(
+                first_air_date="2020-05-01",
+                name=f"Show {tmdb_id}",
+                original_name=f"Show {tmdb_id}",
+                type="Scripted",
+            )
+        return payload
+
+
+def legacy_flow(tmdb: TMDB, tmdb_id: int):
+    """旧流程: details 附带默认内容, 电影再单独请求 release_dates"""
+    if tmdb.is_movie:
+        tmdb.tmdb_media.details(tmdb_id, append_to_response=LEGACY_MOVIE_APPEND)
+        tmdb.tmdb_media.release_dates(tmdb_id)
+    else:
+        tmdb.tmdb_media.details(tmdb_id, append_to_response=LEGACY_TV_APPEND)
+
+
+def current_flow(tmdb: TMDB, tmdb_id: int):
+    tmdb.tmdb_id = str(tmdb_id)
+    tmdb._get_info_from_tmdb_by_id()
+
+
+def run(flow, is_movie: bool, ids: range, latency: float) -> dict:
+    transport = FakeTransport(latency=latency)
+    tmdb = TMDB(movie=is_movie, api_key="benchmark")
+    # 关闭 tmdbv3api 的进程内请求缓存, 每次调用都发出请求
+    tmdb.tmdb.cache = False
+    tmdb.tmdb_media._session.request = transport.request
+    start = time.perf_counter()
+    for tmdb_id in ids:
+        flow(tmdb, tmdb_id)
+    return {
+        "seconds": time.perf_counter() - start,
+        "requests": sum(transport.calls.values()),
+        "bytes": transport.bytes,
+    }
+
+
+def parse():
+    parser = argparse.ArgumentParser(description="Benchmark TMDB details requests")
+    parser.add_argument("--titles", type=int, default=200, help="Titles per type")
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=100,
+        help="Latency injected into every HTTP request",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse()
+    logger.setLevel("ERROR")
+
+    print(
+        f"{'type':<7}{'flow':<9}{'requests/title':>16}{'KiB/title':>11}"
+        f"{'ms/title':>10}"
+    )
+    for is_movie in (True, False):
+        ids = range(1, args.titles + 1)
+        for name, flow in (("legacy", legacy_flow), ("current", current_flow)):
+            result = run(flow, is_movie, ids, args.latency_ms / 1000)
+            print(
+                f"{'movie' if is_movie else 'tv':<7}{name:<9}"
+                f"{result['requests'] / args.titles:>16.2f}"
+                f"{result['bytes'] / 1024 / args.titles:>11.1f}"
+                f"{result['seconds'] * 1000 / args.titles:>10.1f}"
+            )
@@ -3,12 +3,17 @@
 import json
 import os
 import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from time import sleep
-from typing import Dict, List, Optional, Sequence, Union
+from typing import Dict, Iterator, List, Optional, Sequence, Union
 
 import requests
+from emby_client import session
 from log import logger
+from path_index import PathPrefixIndex
 try:
     import settings as _cfg
 except Exception:  # pragma: no cover
@@ -19,12 +24,26 @@ EMBY_API_TOKEN = getattr(_cfg, "EMBY_API_TOKEN", os.environ.get("EMBY_API_TOKEN"
 EMBY_BASE_URL = getattr(_cfg, "EMBY_BASE_URL", os.environ.get("EMBY_BASE_URL", ""))
 # 兼容历史字段：优先 STRM_FILE_PATH；没有则退回 EMBY_STRM_ASSISTANT_MEDIAINFO；再退回临时目录
 STRM_FILE_PATH = getattr(_cfg, "STRM_FILE_PATH", getattr(_cfg, "EMBY_STRM_ASSISTANT_MEDIAINFO", os.environ.get("STRM_FILE_PATH", "/tmp/strm")))
+# 新增配置项，兼容未更新的 settings.py
+EMBY_LIBRARY_CACHE_TTL = getattr(_cfg, "EMBY_LIBRARY_CACHE_TTL", 3600)
+EMBY_ITEMS_PAGE_SIZE = getattr(_cfg, "EMBY_ITEMS_PAGE_SIZE", 1000)
+# 增量创建 strm 文件的水位 (各媒体库已处理的最新 DateCreated)
+STRM_WATERMARK_FILE = Path(__file__).parent / "emby_strm_watermark.json"
+DEFAULT_ITEM_TYPES = "Movie,Episode,Series,Audio,Music,Game,Book,MusicVideo,BoxSet"
+# 对应实际媒体文件的项目类型
+MEDIA_FILE_ITEM_TYPES = "Movie,Episode,Audio,MusicVideo,Video"
+# 路径未命中时重新获取媒体库的最短间隔 (s)，避免不属于任何媒体库的路径反复请求
+LIBRARY_REFRESH_MIN_INTERVAL = 30
 from strm import create_strm_file
 
 
 class Emby:
     "Emby Class"
 
+    # 各服务器的媒体库目录索引: base_url -> (索引, 建立时间)
+    _location_indexes: Dict[str, tuple] = {}
+    _location_indexes_lock = threading.Lock()
+
     def __init__(
         self, base_url: str = EMBY_BASE_URL, token: str = EMBY_API_TOKEN
     ) -> None:
@@ -33,7 +52,7 @@ class Emby:
 
     @property
     def libraries(self) -> List[Dict[str, str]]:
-        res = requests.get(
+        res = session.get(
             f"{self.base_url}/Library/SelectableMediaFolders?api_key={self.token}"
         )
         if res.status_code != requests.codes.ok:
@@ -49,17 +68,133 @@ class Emby:
                 _libraries.append({"library": name, "path": path, "id": _id})
         return _libraries
 
-    def get_library_by_location(self, path: str) -> Optional[str]:
-        """通过路径获取库"""
+    def _build_location_index(self) -> PathPrefixIndex:
+        index = PathPrefixIndex()
         for lib in self.libraries:
-            if path.startswith(lib.get("path")):
-                return lib.get("library")
-        return None
+            index.insert(lib.get("path"), lib.get("library"))
+        logger.debug(f"Built library location index with {len(index)} folders")
+        return index
+
+    def get_library_by_location(self, path: str) -> Optional[str]:
+        """通过路径获取库
+
+        媒体库目录索引在进程内缓存 EMBY_LIBRARY_CACHE_TTL 秒, 过期或未命中时重新获取
+        """
+        with self._location_indexes_lock:
+            index, built_at = self._location_indexes.get(self.base_url, (None, 0))
+            age = time.time() - built_at
+            if index is None or age > EMBY_LIBRARY_CACHE_TTL:
+                index, age = self._build_location_index(), 0
+                self._location_indexes[self.base_url] = (index, time.time())
+            library = index.lookup(path)
+            # 可能是新添加的媒体库
+            if library is None and age > LIBRARY_REFRESH_MIN_INTERVAL:
+                index = self._build_location_index()
+                self._location_indexes[self.base_url] = (index, time.time())
+                library = index.lookup(path)
+        return library
+
+    def iter_items(
+        self,
+        parent_id=None,
+        item_types=DEFAULT_ITEM_TYPES,
+        recursive=True,
+        fields="Path,MediaSources",
+        params: Optional[dict] = None,
+        page_size: int = EMBY_ITEMS_PAGE_SIZE,
+        prefetch: int = 2,
+    ) -> Iterator[dict]:
+        """
+        分页获取媒体项目, 内存占用与媒体库大小无关
+
+        Args:
+            parent_id: 父级ID (媒体库ID)
+            item_types: 项目类型
+            recursive: 是否递归查询
+            fields: 需要返回的额外字段, 只请求调用方需要的字段
+            params: 其他查询参数, 如 SortBy/SortOrder; 未指定排序时按 SortName,Id
+                排序, 保证各页之间的顺序一致
+            page_size: 每页数量
+            prefetch: 并发预取的页数
+        """
+        url = f"{self.base_url}/Items"
+        base_params = {
+            "api_key": self.token,
+            "Recursive": str(recursive).lower(),
+            "IncludeItemTypes": item_types,
+            "Fields": fields,
+            "Limit": page_size,
+            "SortBy": "SortName,Id",
+            "SortOrder": "Ascending",
+            **(params or {}),
+        }
+        if parent_id:
+            base_params["ParentId"] = parent_id
+
+        def _get_page(start_index: int, total_count: bool = False) -> dict:
+            response = session.get(
+                url,
+                params={
+                    **base_params,
+                    "StartIndex": start_index,
+                    "EnableTotalRecordCount": str(total_count).lower(),
+                },
+            )
+            response.raise_for_status()
+            return response.json()
+
+        # 分页期间有项目增删时相邻页可能重复返回同一项目, 只与上一页比较 Id 去重,
+        # 内存占用不随媒体库增长
+        last_page_ids = set()
+
+        def _unseen(items: list) -> Iterator[dict]:
+            nonlocal last_page_ids
+            seen, last_page_ids = last_page_ids, {item.get("Id") for item in items}
+            for item in items:
+                if item.get("Id") not in seen:
+                    yield item
+
+        # 第一页同时获取总数, 之后的页并发预取, 最多同时持有 prefetch 页
+        data = _get_page(0, total_count=True)
+        total = data.get("TotalRecordCount", 0)
+        yield from _unseen(data.get("Items", []))
+        del data
+        with ThreadPoolExecutor(max(prefetch, 1)) as executor:
+            pages = deque()
+            next_index = page_size
+            while pages or next_index < total:
+                while next_index < total and len(pages) < max(prefetch, 1):
+                    pages.append(executor.submit(_get_page, next_index))
+                    next_index += page_size
+                items = pages.popleft().result().get("Items", [])
+                # 总数可能在遍历期间变化, 没有更多项目时结束
+                if not items:
+                    for page in pages:
+                        page.cancel()
+                    break
+                yield from _unseen(items)
+
+    def count_items(
+        self, parent_id=None, item_types=DEFAULT_ITEM_TYPES, recursive=True
+    ) -> int:
+        """获取媒体项目的总数, 不返回项目"""
+        params = {
+            "api_key": self.token,
+            "Recursive": str(recursive).lower(),
+            "IncludeItemTypes": item_types,
+            "Limit": 0,
+            "EnableTotalRecordCount": "true",
+        }
+        if parent_id:
+            params["ParentId"] = parent_id
+        response = session.get(f"{self.base_url}/Items", params=params)
+        response.raise_for_status()
+        return response.json().get("TotalRecordCount", 0)
 
     def get_items(
         self,
         parent_id=None,
-        item_types="Movie,Episode,Series,Audio,Music,Game,Book,MusicVideo,BoxSet",
+        item_types=DEFAULT_ITEM_TYPES,
         recursive=True,
     ):
         """
@@ -71,38 +206,22 @@ class Emby:
             recursive: 是否递归查询
         """
         try:
-            url = f"{self.base_url}/Items"
-            params = {
-                "api_key": self.token,
-                "Recursive": str(recursive).lower(),
-                "IncludeItemTypes": item_types,
-                "Fields": "Path,MediaSources",
-                "EnableTotalRecordCount": "false",
-            }
-
-            if parent_id:
-                params["ParentId"] = parent_id
-
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-
-            data = response.json()
-            return data.get("Items", [])
-
+            return list(
+                self.iter_items(
+                    parent_id=parent_id, item_types=item_types, recursive=recursive
+                )
+            )
         except Exception as e:
             logger.info(f"获取媒体项目失败: {e}")
             return []
 
-    def get_all_items(self, filter=None):
-        """获取所有视频信息"""
-        logger.info("获取媒体库...")
+    def iter_all_items(
+        self, filter=None, item_types=DEFAULT_ITEM_TYPES, fields="Path,MediaSources"
+    ) -> Iterator[dict]:
+        """逐个返回媒体库中的视频信息, 未请求 MediaSources 时不按其过滤"""
         if filter is None:
             filter = []
-        libraries = self.libraries
-
-        all_items = []
-
-        for library in libraries:
+        for library in self.libraries:
             lib_name = library.get("library")
             lib_id = library.get("id")
             if filter and lib_name not in filter:
@@ -111,37 +230,183 @@ class Emby:
 
             logger.info(f"处理媒体库: {lib_name}, Subfolder ID: {lib_id}")
 
-            # 获取该库中的所有视频项目
-            items = self.get_items(parent_id=lib_id)
-
-            for item in items:
-                if item.get("Path") and item.get("MediaSources"):
-                    all_items.append(
-                        {
-                            "id": item["Id"],
-                            "name": item.get("Name", ""),
-                            "path": item["Path"],
-                            "type": item.get("Type", ""),
-                            "library": lib_name,
-                            "media_sources": item.get("MediaSources", []),
-                        }
-                    )
+            try:
+                items = self.iter_items(
+                    parent_id=lib_id, item_types=item_types, fields=fields
+                )
+                for item in items:
+                    if not item.get("Path"):
+                        continue
+                    if "MediaSources" in fields and not item.get("MediaSources"):
+                        continue
+                    yield {
+                        "id": item["Id"],
+                        "name": item.get("Name", ""),
+                        "path": item["Path"],
+                        "type": item.get("Type", ""),
+                        "library": lib_name,
+                        "media_sources": item.get("MediaSources", []),
+                    }
+            except Exception as e:
+                logger.info(f"获取媒体项目失败: {e}")
 
+    def get_all_items(self, filter=None):
+        """获取所有视频信息"""
+        logger.info("获取媒体库...")
+        all_items = list(self.iter_all_items(filter=filter))
         logger.info(f"找到 {len(all_items)} 个视频文件")
         return all_items
 
-    def create_strm_file_for_existed_items(self, filter=None):
-        items = self.get_all_items(filter=filter)
-        for item in items:
-            file_path: str = item.get("path")
-            # 跳过 strm 文件
-            if file_path.endswith(".strm"):
-                continue
-            file_path = file_path.replace("/Media2", "/Media")
-            strm_path = Path(STRM_FILE_PATH) / (
-                re.sub(r"/M\d{2}", "", file_path).removeprefix("/Media/") + ".strm"
+    @staticmethod
+    def get_strm_path(file_path: str) -> Path:
+        """媒体文件 (或目录) 对应的 .strm 文件路径, 去除 /Media2 和月份目录"""
+        file_path = file_path.replace("/Media2", "/Media")
+        return Path(STRM_FILE_PATH) / (
+            re.sub(r"/M\d{2}", "", file_path).removeprefix("/Media/") + ".strm"
+        )
+
+    def _load_strm_watermarks(self) -> dict:
+        try:
+            with open(STRM_WATERMARK_FILE, encoding="utf-8") as f:
+                return json.load(f).get(self.base_url, {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_strm_watermarks(self, watermarks: dict):
+        try:
+            with open(STRM_WATERMARK_FILE, encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {}
+        data[self.base_url] = watermarks
+        tmp = f"{STRM_WATERMARK_FILE}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, STRM_WATERMARK_FILE)
+
+    def _create_strm_file_for_item(self, file_path: str) -> Optional[Path]:
+        # 跳过 strm 文件
+        if file_path.endswith(".strm"):
+            return None
+        strm_path = self.get_strm_path(file_path)
+        create_strm_file(
+            Path(file_path.replace("/Media2", "/Media")), strm_file_path=strm_path
+        )
+        return strm_path
+
+    def create_strm_file_for_existed_items(
+        self, filter=None, incremental: bool = False, prune: bool = False
+    ):
+        """为已入库的媒体文件创建 .strm 文件
+
+        Args:
+            filter: 只处理这些媒体库
+            incremental: 只处理上次运行后新加入的项目 (按 DateCreated 记录水位)
+            prune: 删除媒体库中已不存在的项目对应的 .strm 文件, 需要遍历全部项目,
+                不使用也不更新水位
+        """
+        libraries = [
+            library
+            for library in self.libraries
+            if not filter or library.get("library") in filter
+        ]
+        if not incremental or prune:
+            # 获取失败时直接抛出异常, 避免按不完整的列表删除 strm 文件
+            strm_paths = set()
+            prunable = []
+            for library in libraries:
+                listed, strm_backed = 0, False
+                # 只需要路径, 不请求体积很大的 MediaSources
+                items = self.iter_items(
+                    parent_id=library.get("id"),
+                    item_types=MEDIA_FILE_ITEM_TYPES,
+                    fields="Path",
+                )
+                for item in items:
+                    listed += 1
+                    if not item.get("Path"):
+                        continue
+                    # 项目本身是 .strm 的媒体库, strm 目录可能就是媒体库目录
+                    strm_backed = strm_backed or item["Path"].endswith(".strm")
+                    strm_paths.add(self._create_strm_file_for_item(item["Path"]))
+                if not prune:
+                    continue
+                name = library.get("library")
+                if strm_backed:
+                    logger.info(f"媒体库 {name} 的项目为 .strm 文件, 不清理")
+                    continue
+                # 分页期间项目有变化时列表可能不完整
+                total = self.count_items(
+                    parent_id=library.get("id"), item_types=MEDIA_FILE_ITEM_TYPES
+                )
+                if listed < total:
+                    logger.warning(
+                        f"媒体库 {name} 只获取到 {listed}/{total} 个项目, 不清理"
+                    )
+                    continue
+                prunable.append(library)
+            if prune:
+                self._prune_strm_files(prunable, strm_paths)
+            return
+
+        watermarks = self._load_strm_watermarks()
+        count = 0
+        for library in libraries:
+            lib_id = library.get("id")
+            watermark = watermarks.get(lib_id)
+            latest = watermark
+            # 按加入时间倒序, 遇到早于水位的项目即停止, 不再请求后续分页
+            items = self.iter_items(
+                parent_id=lib_id,
+                item_types=MEDIA_FILE_ITEM_TYPES,
+                fields="Path,DateCreated",
+                params={"SortBy": "DateCreated,Id", "SortOrder": "Descending"},
             )
-            create_strm_file(Path(file_path), strm_file_path=strm_path)
+            for item in items:
+                date_created = item.get("DateCreated") or ""
+                # 与水位相同的项目可能未处理完, 重新处理, 内容相同时不会写入
+                if watermark and date_created < watermark:
+                    items.close()
+                    break
+                latest = max(latest or "", date_created)
+                if item.get("Path"):
+                    self._create_strm_file_for_item(item["Path"])
+                    count += 1
+            # 媒体库处理完成后才更新水位, 中断后重新运行会重新处理
+            if latest:
+                watermarks[lib_id] = latest
+                self._save_strm_watermarks(watermarks)
+        logger.info(f"增量处理了 {count} 个项目")
+
+    def _prune_strm_files(self, libraries: list, strm_paths: set):
+        """删除媒体库目录对应的 strm 目录中多余的 .strm 文件
+
+        只清理位于 STRM_FILE_PATH 之内的目录, 不在 /Media 下的媒体库对应的路径
+        可能是任意目录
+        """
+        strm_root = Path(STRM_FILE_PATH).resolve()
+        roots = set()
+        for library in libraries:
+            root = self.get_strm_path(library.get("path").rstrip("/")).with_suffix("")
+            resolved = root.resolve()
+            if resolved == strm_root or not resolved.is_relative_to(strm_root):
+                logger.warning(
+                    f"{root} 不在 {STRM_FILE_PATH} 中, 不清理媒体库 {library.get('library')}"
+                )
+                continue
+            roots.add(root)
+        removed = 0
+        for root in roots:
+            for dirpath, _, filenames in os.walk(root, topdown=False):
+                for filename in filenames:
+                    path = Path(dirpath) / filename
+                    if filename.endswith(".strm") and path not in strm_paths:
+                        path.unlink()
+                        removed += 1
+                        logger.info(f"删除已不存在的项目的 strm 文件: {path}")
+                if dirpath != str(root) and not os.listdir(dirpath):
+                    os.rmdir(dirpath)
+        logger.info(f"删除了 {removed} 个 strm 文件")
 
     def scan(self, path: Union[str, Sequence]) -> None:
         """发送扫描请求"""
@@ -160,25 +425,18 @@ class Emby:
 
         headers = {"Content-Type": "application/json"}
 
-        while True:
-            try:
-                res = requests.post(
-                    url=f"{self.base_url}/Library/Media/Updated?api_key={self.token}",
-                    data=json.dumps(payload),
-                    headers=headers,
-                )
-                res.raise_for_status()
-            except (requests.Timeout, requests.ConnectionError) as e:
-                logger.error(e)
-                sleep(10)
-                continue
-            except requests.HTTPError:
-                logger.error(f"Error: {res.status_code}, {res.text}")
-                sleep(10)
-                continue
-            else:
-                logger.info(f"Sent scan request successfully: {_path}")
-                break
+        # 连接失败由 session 重试, 其余失败抛出异常, 由扫描队列退避后重新发送
+        try:
+            res = session.post(
+                url=f"{self.base_url}/Library/Media/Updated?api_key={self.token}",
+                data=json.dumps(payload),
+                headers=headers,
+            )
+            res.raise_for_status()
+        except requests.RequestException as e:
+            logger.error(f"Error: fail to send scan request: {e}")
+            raise
+        logger.info(f"Sent scan request successfully: {_path}")
 
 
     # ---------------- Emby 用户管理（注册/密码/策略/删除）----------------
@@ -226,7 +484,7 @@ class Emby:
         # 1) 创建用户
         url_new = f"{self.base_url}/Users/New"
         headers = {"Content-Type": "application/json", "X-Emby-Token": self.token}
-        resp = requests.post(url_new, headers=headers, params={"api_key": self.token}, json={"Name": username})
+        resp = session.post(url_new, headers=headers, params={"api_key": self.token}, json={"Name": username})
         if resp.status_code >= 300:
             logger.error(f"Create user failed: {resp.status_code} {resp.text}")
             resp.raise_for_status()
@@ -254,7 +512,7 @@ class Emby:
         headers = {"Content-Type": "application/json", "X-Emby-Token": self.token}
 
         def _post(payload: dict):
-            return requests.post(url, headers=headers, params={"api_key": self.token}, json=payload)
+            return session.post(url, headers=headers, params={"api_key": self.token}, json=payload)
 
         # 先试 NewPw
         r1 = _post({"ResetPassword": True, "NewPw": new_password, "CurrentPw": ""})
@@ -273,7 +531,7 @@ class Emby:
         """
         url = f"{self.base_url}/Users/{user_id}/Policy"
         headers = {"Content-Type": "application/json", "X-Emby-Token": self.token}
-        resp = requests.post(url, headers=headers, params={"api_key": self.token}, json=policy)
+        resp = session.post(url, headers=headers, params={"api_key": self.token}, json=policy)
         if resp.status_code >= 300:
             logger.error(f"set_policy failed: {resp.status_code} {resp.text}")
             resp.raise_for_status()
@@ -282,7 +540,7 @@ class Emby:
         try:
             url_cfg = f"{self.base_url}/Users/{user_id}/Configuration"
             cfg = {"EnableLocalPassword": True}
-            resp2 = requests.post(url_cfg, headers=headers, params={"api_key": self.token}, json=cfg)
+            resp2 = session.post(url_cfg, headers=headers, params={"api_key": self.token}, json=cfg)
             if resp2.status_code >= 300:
                 logger.info(f"set policy config warn: {resp2.status_code} {resp2.text}")
         except Exception as e:
@@ -294,12 +552,31 @@ class Emby:
         """
         url = f"{self.base_url}/Users/{user_id}"
         headers = {"X-Emby-Token": self.token}
-        resp = requests.delete(url, headers=headers, params={"api_key": self.token})
+        resp = session.delete(url, headers=headers, params={"api_key": self.token})
         if resp.status_code >= 300:
             logger.error(f"delete_user failed: {resp.status_code} {resp.text}")
             resp.raise_for_status()
 
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Create strm files for Emby items")
+    parser.add_argument(
+        "-l", "--library", nargs="+", default=["TV Shows"], help="Libraries to handle"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only handle items added since the last incremental run",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Remove strm files of items no longer in the libraries",
+    )
+    args = parser.parse_args()
     e = Emby()
-    e.create_strm_file_for_existed_items(filter=["TV Shows"])
+    e.create_strm_file_for_existed_items(
+        filter=args.library, incremental=args.incremental, prune=args.prune
+    )
@@ -3,11 +3,11 @@ from datetime import datetime, timedelta
 import secrets
 from typing import Optional
 
-import requests
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
+from emby_client import session as emby_session
 from emby_admin_models import SessionLocal, init_db, UserAccount, RenewalCode, AuditLog, Settings, DonationStat, WatchStat
 from log import logger
 from settings import EMBY_BASE_URL, EMBY_API_TOKEN, ADMIN_BEARER_TOKEN
@@ -42,7 +42,7 @@ def emby_create_user(username: str) -> dict:
     if exists:
         raise HTTPException(status_code=400, detail=f"User already exists: {username}")
     url = f"{EMBY_BASE_URL}/Users/New"
-    resp = requests.post(
+    resp = emby_session.post(
         url,
         headers=HEADERS,
         params={"api_key": EMBY_API_TOKEN},
@@ -60,7 +60,7 @@ def emby_set_password(user_id: str, new_password: str) -> None:
     # 兼容不同版本的字段命名，首次尝试 NewPw/CurrentPw，若未生效再尝试 NewPassword/CurrentPassword
     url = f"{EMBY_BASE_URL}/Users/{user_id}/Password"
     def _post_pwd(payload: dict):
-        return requests.post(url, headers=HEADERS, params={"api_key": EMBY_API_TOKEN}, json=payload)
+        return emby_session.post(url, headers=HEADERS, params={"api_key": EMBY_API_TOKEN}, json=payload)
 
     # 第一次尝试
     resp = _post_pwd({"ResetPassword": True, "NewPw": new_password, "CurrentPw": ""})
@@ -114,7 +114,7 @@ def emby_set_disabled(user_id: str, is_disabled: bool) -> None:
     # Emby: POST /Users/{id}/Policy with body containing "IsDisabled"
     url = f"{EMBY_BASE_URL}/Users/{user_id}/Policy"
     payload = {"IsDisabled": is_disabled}
-    resp = requests.post(url, headers=HEADERS, params={"api_key": EMBY_API_TOKEN}, json=payload)
+    resp = emby_session.post(url, headers=HEADERS, params={"api_key": EMBY_API_TOKEN}, json=payload)
     if resp.status_code >= 300:
         txt = resp.text
         logger.error(txt)
@@ -139,7 +139,7 @@ def emby_test_login(username: str, password: str, *, use_password_field: bool=Fa
             # 一些 Emby 版本需要此头才允许用户名密码认证
             "X-Emby-Authorization": 'MediaBrowser Client="PMSAuto", Device="Server", DeviceId="pmsauto", Version="1.0"',
         }
-        resp = requests.post(url, headers=headers, json=body)
+        resp = emby_session.post(url, headers=headers, json=body)
         if resp.status_code == 200:
             return True
         else:
@@ -156,7 +156,7 @@ def emby_enable_local_password(user_id: str) -> None:
     """
     url = f"{EMBY_BASE_URL}/Users/{user_id}/Policy"
     payload = {"EnableUserLocalPassword": True, "IsDisabled": False}
-    resp = requests.post(url, headers=HEADERS, params={"api_key": EMBY_API_TOKEN}, json=payload)
+    resp = emby_session.post(url, headers=HEADERS, params={"api_key": EMBY_API_TOKEN}, json=payload)
     if resp.status_code >= 300:
         txt = resp.text
         logger.error("enable_local_password failed: %s", txt)
@@ -176,7 +176,7 @@ def emby_enable_local_password_config(user_id: str) -> None:
     conf.setdefault("EnableLocalPassword", True)
     conf["EnableLocalPassword"] = True
     url = f"{EMBY_BASE_URL}/Users/{user_id}/Configuration"
-    resp = requests.post(url, headers=HEADERS, params={"api_key": EMBY_API_TOKEN}, json=conf)
+    resp = emby_session.post(url, headers=HEADERS, params={"api_key": EMBY_API_TOKEN}, json=conf)
     if resp.status_code >= 300:
         txt = resp.text
         logger.error("enable_local_password_config failed: %s", txt)
@@ -189,7 +189,7 @@ def emby_find_user_by_name(username: str) -> dict | None:
     """
     try:
         url = f"{EMBY_BASE_URL}/Users"
-        resp = requests.get(url, headers=HEADERS, params={"api_key": EMBY_API_TOKEN})
+        resp = emby_session.get(url, headers=HEADERS, params={"api_key": EMBY_API_TOKEN})
         if resp.status_code >= 300:
             logger.warning("List users failed: %s", resp.text)
             return None
@@ -210,7 +210,7 @@ def emby_get_user(user_id: str) -> dict | None:
     """获取指定 Emby 用户，成功返回 JSON，否则返回 None。"""
     try:
         url = f"{EMBY_BASE_URL}/Users/{user_id}"
-        resp = requests.get(url, headers=HEADERS, params={"api_key": EMBY_API_TOKEN})
+        resp = emby_session.get(url, headers=HEADERS, params={"api_key": EMBY_API_TOKEN})
         if resp.status_code == 200:
             return resp.json()
         logger.warning("Get user %s failed: %s %s", user_id, resp.status_code, resp.text)
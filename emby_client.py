@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Emby 请求的共享连接池、超时、重试和熔断
+
+emby.Emby 和 emby_admin_service 共用一个保持连接的 requests.Session，每个请求都有
+默认超时；连接失败、超时和 5xx 按指数退避重试有限次数；连续失败达到阈值后熔断，
+冷却期内的请求直接失败，不再占用扫描、注册等流程的时间。
+"""
+
+import threading
+import time
+from typing import Optional
+
+import requests
+from log import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import settings as _cfg
+except Exception:  # pragma: no cover
+    _cfg = object()
+
+# 新增配置项，兼容未更新的 settings.py
+EMBY_TIMEOUT = getattr(_cfg, "EMBY_TIMEOUT", 10)
+EMBY_MAX_RETRIES = getattr(_cfg, "EMBY_MAX_RETRIES", 3)
+EMBY_CIRCUIT_BREAKER_THRESHOLD = getattr(_cfg, "EMBY_CIRCUIT_BREAKER_THRESHOLD", 5)
+EMBY_CIRCUIT_BREAKER_COOLDOWN = getattr(_cfg, "EMBY_CIRCUIT_BREAKER_COOLDOWN", 60)
+
+# 重试退避的基数 (s)
+BACKOFF_FACTOR = 1
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """熔断期间的请求, 继承 ConnectionError 以便沿用已有的异常处理"""
+
+
+class CircuitBreaker:
+    """连续失败 threshold 次后熔断 cooldown 秒, 冷却后放行一个试探请求"""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.cooldown - time.time()
+            if remaining > 0:
+                raise CircuitOpenError(
+                    f"Emby circuit breaker is open, retry in {remaining:.0f}s"
+                )
+            # 半开状态: 放行当前请求, 失败后重新计时
+            self.opened_at = time.time()
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("Emby circuit breaker closed")
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.error(
+                        f"Emby circuit breaker opened after {self.failures} failures"
+                    )
+                self.opened_at = time.time()
+
+
+class EmbySession(requests.Session):
+    """带连接池、默认超时、重试和熔断的 Session
+
+    重试只在这一层进行: 幂等请求 (GET/DELETE 等) 由 urllib3 重试; POST 只重试
+    连接失败, 其他失败由调用方决定是否稍后重新发送, 避免多层重试叠加
+    """
+
+    def __init__(self, breaker: CircuitBreaker, timeout: float = EMBY_TIMEOUT):
+        super().__init__()
+        self.breaker = breaker
+        self.timeout = timeout
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=10,
+            max_retries=Retry(
+                total=EMBY_MAX_RETRIES,
+                backoff_factor=BACKOFF_FACTOR,
+                status_forcelist=[429, 500, 502, 503, 504],
+                raise_on_status=False,
+            ),
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        self.breaker.before_request()
+        try:
+            res = super().request(method, url, *args, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            self.breaker.record_failure()
+            raise
+        if res.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return res
+
+
+circuit_breaker = CircuitBreaker(
+    EMBY_CIRCUIT_BREAKER_THRESHOLD, EMBY_CIRCUIT_BREAKER_COOLDOWN
+)
+session = EmbySession(circuit_breaker)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""Emby 媒体项目的本地 SQLite 镜像
+
+保存各项目的 id、路径、类型、父级、DateCreated 和 tmdb id，按路径前缀和 tmdb id
+建立索引，判断文件/目录是否已入库、按 tmdb id 查找项目时不再请求完整的 /Items。
+
+全量同步会删除 Emby 中已不存在的项目；增量同步按 DateCreated 倒序只获取上次同步后
+新加入的项目，不处理删除。
+
+用法:
+    python emby_mirror.py sync [--full]
+    python emby_mirror.py path /Media/TVShows/xxx
+    python emby_mirror.py tmdb 1438 -t Series
+"""
+
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+from emby import Emby
+from log import logger
+
+EMBY_MIRROR_DB = Path(__file__).parent / "emby_mirror.db"
+
+# 需要镜像的项目类型, 包括有路径的目录类项目
+MIRROR_ITEM_TYPES = (
+    "Movie,Episode,Series,Season,Audio,MusicAlbum,MusicVideo,Video,Folder"
+)
+MIRROR_FIELDS = "Path,ParentId,DateCreated,ProviderIds"
+
+COLUMNS = ("id", "path", "type", "parent_id", "date_created", "tmdb_id")
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(EMBY_MIRROR_DB, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS emby_items (
+            server TEXT NOT NULL,
+            id TEXT NOT NULL,
+            path TEXT,
+            type TEXT NOT NULL,
+            parent_id TEXT,
+            date_created TEXT,
+            tmdb_id TEXT,
+            synced_at REAL NOT NULL,
+            PRIMARY KEY (server, id)
+        );
+        CREATE INDEX IF NOT EXISTS emby_items_path ON emby_items (server, path);
+        CREATE INDEX IF NOT EXISTS emby_items_tmdb_id ON emby_items (server, tmdb_id);
+        CREATE TABLE IF NOT EXISTS emby_mirror_state (
+            server TEXT PRIMARY KEY,
+            watermark TEXT,
+            full_synced_at REAL,
+            synced_at REAL NOT NULL
+        );
+        """
+    )
+    return conn
+
+
+def _to_row(server: str, item: dict, now: float) -> tuple:
+    provider_ids = {k.lower(): v for k, v in (item.get("ProviderIds") or {}).items()}
+    return (
+        server,
+        item["Id"],
+        item.get("Path"),
+        item.get("Type", ""),
+        item.get("ParentId"),
+        item.get("DateCreated"),
+        provider_ids.get("tmdb"),
+        now,
+    )
+
+
+class EmbyMirror:
+    def __init__(self, emby: Optional[Emby] = None):
+        self.emby = emby or Emby()
+        self.server = self.emby.base_url
+
+    def _get_state(self, conn: sqlite3.Connection) -> tuple:
+        row = conn.execute(
+            "SELECT watermark, full_synced_at FROM emby_mirror_state WHERE server = ?",
+            (self.server,),
+        ).fetchone()
+        return row or (None, None)
+
+    def sync(self, full: bool = False) -> int:
+        """同步镜像, 返回写入的项目数量; 从未全量同步过时执行全量同步"""
+        now = time.time()
+        conn = _connect()
+        try:
+            watermark, full_synced_at = self._get_state(conn)
+            full = full or not full_synced_at
+            params = None
+            if not full:
+                params = {"SortBy": "DateCreated,Id", "SortOrder": "Descending"}
+            items = self.emby.iter_items(
+                item_types=MIRROR_ITEM_TYPES, fields=MIRROR_FIELDS, params=params
+            )
+            count = 0
+            latest = watermark or ""
+            batch = []
+            for item in items:
+                date_created = item.get("DateCreated") or ""
+                if not full and watermark and date_created < watermark:
+                    items.close()
+                    break
+                latest = max(latest, date_created)
+                batch.append(_to_row(self.server, item, now))
+                if len(batch) >= 1000:
+                    with conn:
+                        conn.executemany(
+                            "INSERT OR REPLACE INTO emby_items VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            batch,
+                        )
+                    count += len(batch)
+                    batch = []
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO emby_items VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    batch,
+                )
+                count += len(batch)
+                deleted = 0
+                if full:
+                    # 本次全量同步中没有出现的项目已被删除
+                    deleted = conn.execute(
+                        "DELETE FROM emby_items WHERE server = ? AND synced_at < ?",
+                        (self.server, now),
+                    ).rowcount
+                    full_synced_at = now
+                conn.execute(
+                    "INSERT OR REPLACE INTO emby_mirror_state VALUES (?, ?, ?, ?)",
+                    (self.server, latest or None, full_synced_at, now),
+                )
+        finally:
+            conn.close()
+        logger.info(
+            f"Synced {count} Emby items ({'full' if full else 'incremental'}), "
+            f"deleted {deleted}"
+        )
+        return count
+
+    def is_synced(self) -> bool:
+        """是否已全量同步过"""
+        conn = _connect()
+        try:
+            return bool(self._get_state(conn)[1])
+        finally:
+            conn.close()
+
+    def upsert_item(self, item: dict):
+        """写入单个项目, 如 webhook 通知的新增项目"""
+        if not item.get("Id"):
+            return
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO emby_items VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    _to_row(self.server, item, time.time()),
+                )
+        finally:
+            conn.close()
+
+    def _query(self, where: str, params: tuple) -> list:
+        conn = _connect()
+        try:
+            rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM emby_items "
+                f"WHERE server = ? AND {where}",
+                (self.server, *params),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def get_item_by_path(self, path: str) -> Optional[dict]:
+        items = self._query("path = ?", (path.rstrip("/"),))
+        return items[0] if items else None
+
+    def iter_items_under(self, prefix: str) -> Iterator[dict]:
+        """路径等于 prefix 或位于 prefix 目录下的项目"""
+        prefix = prefix.rstrip("/")
+        # "0" 是 "/" 的下一个字符, 范围查询可以使用路径索引
+        yield from self._query(
+            "(path = ? OR (path >= ? AND path < ?))",
+            (prefix, prefix + "/", prefix + "0"),
+        )
+
+    def exists(self, path: str) -> bool:
+        """文件或目录 (含其中的文件) 是否已入库"""
+        prefix = path.rstrip("/")
+        return bool(
+            self._query(
+                "(path = ? OR (path >= ? AND path < ?)) LIMIT 1",
+                (prefix, prefix + "/", prefix + "0"),
+            )
+        )
+
+    def get_items_by_tmdb_id(self, tmdb_id, item_type: Optional[str] = None) -> list:
+        if item_type:
+            return self._query("tmdb_id = ? AND type = ?", (str(tmdb_id), item_type))
+        return self._query("tmdb_id = ?", (str(tmdb_id),))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local mirror of Emby items")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="Sync the mirror")
+    sync_parser.add_argument(
+        "--full", action="store_true", help="Full sync, also removes deleted items"
+    )
+    path_parser = subparsers.add_parser("path", help="Query items under a path")
+    path_parser.add_argument("path")
+    tmdb_parser = subparsers.add_parser("tmdb", help="Query items by tmdb id")
+    tmdb_parser.add_argument("tmdb_id")
+    tmdb_parser.add_argument("-t", "--type", default=None, help="Item type")
+    args = parser.parse_args()
+
+    mirror = EmbyMirror()
+    if args.command == "sync":
+        mirror.sync(full=args.full)
+    elif args.command == "path":
+        for _item in mirror.iter_items_under(args.path):
+            print(f"{_item['id']:>10}  {_item['type']:<8} {_item['path']}")
+    else:
+        for _item in mirror.get_items_by_tmdb_id(args.tmdb_id, item_type=args.type):
+            print(f"{_item['id']:>10}  {_item['type']:<8} {_item['path']}")
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""目标媒体库索引: tmdb id -> 已存在的影视文件夹
+
+媒体库的目录结构为 {root}/{Aired|Released}_{year}/M{month}/{tmdb_name} 或
+{root}/{tmdb_name}，首次查询某个媒体库时遍历一次并持久化，之后由处理流程的
+移动操作增量更新，查询时不再访问挂载点。
+"""
+
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+import filelock
+from log import logger
+
+LIBRARY_INDEX_DB = Path(__file__).parent / "library_index.db"
+
+build_lock = filelock.FileLock("/tmp/library_index.build.lock")
+
+TMDB_ID_RE = re.compile(r"\{tmdb-(\d+)\}")
+DATE_FOLDER_RE = re.compile(r"^(Aired|Released)_\d{4}$")
+MONTH_FOLDER_RE = re.compile(r"^M\d{2}$")
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(LIBRARY_INDEX_DB, timeout=30)
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS library_index (
+            root TEXT NOT NULL,
+            tmdb_id TEXT NOT NULL,
+            path TEXT NOT NULL,
+            PRIMARY KEY (root, tmdb_id)
+        );
+        CREATE TABLE IF NOT EXISTS library_roots (
+            root TEXT PRIMARY KEY,
+            built_at REAL NOT NULL
+        );
+        """
+    )
+    return conn
+
+
+def _scandir_dirs(path: str) -> Iterator[os.DirEntry]:
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    yield entry
+    except FileNotFoundError:
+        return
+
+
+def iter_title_folders(root: str) -> Iterator[tuple[str, str]]:
+    """遍历媒体库中的影视文件夹, 返回 (tmdb_id, path)"""
+    for entry in _scandir_dirs(root):
+        tmdb_match = TMDB_ID_RE.search(entry.name)
+        if tmdb_match:
+            yield tmdb_match.group(1), entry.path
+        elif DATE_FOLDER_RE.match(entry.name):
+            for month in _scandir_dirs(entry.path):
+                if not MONTH_FOLDER_RE.match(month.name):
+                    continue
+                for title in _scandir_dirs(month.path):
+                    tmdb_match = TMDB_ID_RE.search(title.name)
+                    if tmdb_match:
+                        yield tmdb_match.group(1), title.path
+
+
+def build_library_index(root: str) -> int:
+    """重新建立媒体库索引, 返回索引的文件夹数量"""
+    root = os.path.normpath(root)
+    logger.info(f"Building library index for {root}")
+    count = 0
+    batch = []
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM library_roots WHERE root = ?", (root,))
+            conn.execute("DELETE FROM library_index WHERE root = ?", (root,))
+        # 分批提交, 遍历期间不长时间占用写锁
+        for tmdb_id, path in iter_title_folders(root):
+            batch.append((root, tmdb_id, path))
+            if len(batch) >= 1000:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO library_index VALUES (?, ?, ?)", batch
+                    )
+                count += len(batch)
+                batch = []
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO library_index VALUES (?, ?, ?)", batch
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO library_roots VALUES (?, ?)",
+                (root, time.time()),
+            )
+        count += len(batch)
+    finally:
+        conn.close()
+    logger.info(f"Indexed {count} folders in {root}")
+    return count
+
+
+def _is_indexed(conn: sqlite3.Connection, root: str) -> bool:
+    return bool(
+        conn.execute("SELECT 1 FROM library_roots WHERE root = ?", (root,)).fetchone()
+    )
+
+
+def lookup_title_folder(root: str, tmdb_id: str) -> Optional[str]:
+    """查询 tmdb id 在媒体库中对应的文件夹, 媒体库未建立索引时先建立索引
+
+    文件夹已被手动重命名或删除时删除该记录并返回 None
+    """
+    root = os.path.normpath(root)
+    conn = _connect()
+    try:
+        if not _is_indexed(conn, root):
+            with build_lock:
+                # 可能已由其他进程建立
+                if not _is_indexed(conn, root):
+                    build_library_index(root)
+        row = conn.execute(
+            "SELECT path FROM library_index WHERE root = ? AND tmdb_id = ?",
+            (root, str(tmdb_id)),
+        ).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    if not os.path.isdir(row[0]):
+        logger.info(f"{row[0]} no longer exists, removing it from library index")
+        remove_title_folder(root, tmdb_id)
+        return None
+    return row[0]
+
+
+def update_title_folder(root: str, tmdb_id: str, path: str):
+    """记录影视文件夹的位置"""
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO library_index VALUES (?, ?, ?)",
+                (os.path.normpath(root), str(tmdb_id), os.path.normpath(path)),
+            )
+    finally:
+        conn.close()
+
+
+def remove_title_folder(root: str, tmdb_id: str):
+    """删除影视文件夹的记录"""
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "DELETE FROM library_index WHERE root = ? AND tmdb_id = ?",
+                (os.path.normpath(root), str(tmdb_id)),
+            )
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build library index")
+    parser.add_argument("root", nargs="+", help="Root folder of the library")
+    args = parser.parse_args()
+    for _root in args.root:
+        build_library_index(_root)
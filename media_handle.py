@@ -1,20 +1,30 @@
 import argparse
-import datetime
 import os
 import re
 import shutil
 import textwrap
+import threading
 import traceback
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from copy import deepcopy
 from pathlib import Path
 from time import sleep
-from typing import Union
+from typing import Optional, Union
 
 import anitopy
+import settings as _cfg
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
-from emby import Emby
+from library_index import lookup_title_folder, update_title_folder
 from log import logger
-from plex import Plex
+from rename_journal import (
+    JOURNAL_MAX_FAILURES,
+    RenameJournal,
+    abandon,
+    iter_journals,
+    load_abandoned,
+)
+from scan_queue import enqueue_scan_request
 from scheduler import Scheduler
 from settings import (
     CREATE_STRM_FILE,
@@ -28,14 +38,47 @@ from settings import (
     TG_CHAT_ID,
 )
 from tmdb import TMDB
-from utils import dump_json, is_filename_length_gt_255, load_json, send_tg_msg
+from utils import (
+    MOUNT_READY_TIMEOUT,
+    ScanError,
+    dump_json,
+    is_filename_length_gt_255,
+    load_json,
+    send_tg_msg,
+    vfs_refresh,
+    wait_for_path_ready,
+)
 
 DEFAULT_EPISODE_REGEX = r"[ep](\d{2,4})(?!\d)"
+# handle_local_media 的文件夹指纹记录
+LOCAL_MEDIA_INDEX = Path(__file__).parent / "local_media.index"
+# handle_local_media 并发处理的文件夹数量，兼容未更新的 settings.py
+HANDLE_LOCAL_MEDIA_WORKERS = getattr(_cfg, "HANDLE_LOCAL_MEDIA_WORKERS", 1)
+# 是否在后台线程中迁移神医插件 mediainfo
+EMBY_STRM_ASSISTANT_MEDIAINFO_ASYNC = getattr(
+    _cfg, "EMBY_STRM_ASSISTANT_MEDIAINFO_ASYNC", False
+)
 
 
 def parse():
     parser = argparse.ArgumentParser(description="Media handle")
-    parser.add_argument("path", help="The path of the video")
+    parser.add_argument("path", nargs="*", help="The path(s) of the video")
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        default=None,
+        help="File containing paths to handle, one per line",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Also replay the unfinished journals of interrupted runs",
+    )
+    parser.add_argument(
+        "--no-wait",
+        action="store_true",
+        help="Exit without waiting for scan requests, leave them to the running daemon",
+    )
     parser.add_argument(
         "-d", "--dst_path", default=None, help="Move the handled video to this path"
     )
@@ -69,6 +112,16 @@ def parse():
     return parser.parse_args()
 
 
+def load_manifest(manifest) -> list:
+    """读取需要处理的路径列表, 忽略空行和 # 开头的注释"""
+    with open(manifest, "r", encoding="utf-8") as f:
+        return [
+            line.strip()
+            for line in f
+            if line.strip() and not line.strip().startswith("#")
+        ]
+
+
 def media_filename_pre_handle(parent_dir_path, filename):
     # absolute path to file
     filepath = os.path.join(parent_dir_path, filename)
@@ -318,15 +371,11 @@ def query_tmdb_id(name, media_type):
     )
 
     if cn_match:
-        # 分别用中文和英文进行查询
-        for i in range(2):
-            name = cn_match.group(i + 1)
-            tmdb_info = tmdb.get_info_from_tmdb(
-                query_dict={"query": name, "year": year}
-            )
-            tmdb_id = tmdb_info.get("tmdb_id")
-            if tmdb_id:
-                break
+        # 同时用中文和英文进行查询, 优先使用中文的结果
+        tmdb_info = tmdb.get_info_from_tmdb_by_candidates(
+            [{"query": cn_match.group(i + 1), "year": year} for i in range(2)]
+        )
+        tmdb_id = tmdb_info.get("tmdb_id")
     else:
         tmdb_info = tmdb.get_info_from_tmdb(query_dict={"query": name, "year": year})
         tmdb_id = tmdb_info.get("tmdb_id")
@@ -345,6 +394,26 @@ def add_plexmatch_file(dir, title, year, tmdb_id, season=None):
         f.write(plexmatch_format)
 
 
+def get_title_folder(media_path, dst_path, tmdb_id, tmdb_name, *date_folders):
+    """获取影视文件夹的位置
+
+    移动到媒体库时优先使用媒体库中已存在的文件夹（即使名字已经变化），
+    否则直接使用一级目录
+    """
+    if dst_path != media_path:
+        title_folder = lookup_title_folder(dst_path, tmdb_id)
+        if title_folder:
+            logger.debug(f"Found {tmdb_id} in library: {title_folder}")
+            return title_folder
+        return os.path.join(dst_path, tmdb_name)
+    # 由于 plex 对多层目录支持不好，直接使用一级目录
+    # 已有的保持之前的多层目录
+    title_folder = os.path.join(dst_path, *date_folders, tmdb_name)
+    if not os.path.exists(title_folder):
+        title_folder = os.path.join(dst_path, tmdb_name)
+    return title_folder
+
+
 def handle_tvshow(
     media_path,
     tmdb_id,
@@ -361,8 +430,10 @@ def handle_tvshow(
     scan_folders=None,
     force=False,
     replace=True,
+    journal_params=None,
 ):
-    if not os.path.isdir(media_path):
+    # 刚上传的目录可能还未出现在挂载点中, 先刷新 VFS 缓存并等待
+    if not os.path.isdir(media_path) and not wait_for_path_ready(media_path):
         raise Exception("Please specify a folder")
     if dst_path is None:
         dst_path = media_path
@@ -379,9 +450,18 @@ def handle_tvshow(
     year = details.get("year")
     month = details.get("month")
 
+    new_media_dir = get_title_folder(
+        media_path, dst_path, tmdb_id, tmdb_name, f"Aired_{year}", f"M{month}"
+    )
+
     # 用于记录处理的文件数量,如果为 0,则认为为空文件夹
     handled_files = 0
-    # workaround: 由于可能出现 os.walk 无内容的情况，暂时增加重试次数来规避下
+    # 已放弃的操作的源文件, 跳过
+    abandoned = load_abandoned()
+    abandoned_files = 0
+    # 计划执行的操作, 遍历完成后统一执行
+    ops = []
+    # 由于可能出现 os.walk 无内容的情况 (挂载点缓存未更新)，刷新 VFS 缓存后重试
     retry = 3
     while retry > 0:
         for dir, _, files in os.walk(media_path):
@@ -412,6 +492,11 @@ def handle_tvshow(
                     logger.info(f"Removed file: {filepath}")
                     continue
 
+                if filepath in abandoned:
+                    logger.warning(f"Skipped abandoned file: {filepath}")
+                    abandoned_files += 1
+                    continue
+
                 if not season:
                     season_match = re.search(r"S(eason)?\s?(\d{1,2})", dir + file)
                     if not season_match:
@@ -507,92 +592,63 @@ def handle_tvshow(
                             + " - "
                             + file
                         )
-                # 由于 plex 对多层目录支持不好，直接使用一级目录
-                # 已有的保持之前的多层目录
-                new_media_dir = os.path.join(
-                    dst_path, f"Aired_{year}", f"M{month}", tmdb_name
-                )
-                if not os.path.exists(new_media_dir):
-                    new_media_dir = os.path.join(dst_path, tmdb_name)
                 new_dir = os.path.join(new_media_dir, f"Season {_season}")
                 new_file_path = os.path.join(new_dir, new_filename)
+                op = {
+                    "src": os.path.join(dir, file),
+                    "dst": new_file_path,
+                    "mediainfo": [dir, filename_pre, new_dir, new_filename],
+                }
                 if dst_path != media_path and not dryrun:
-                    if not os.path.exists(os.path.join(new_dir, ".plexmatch")):
-                        add_plexmatch_file(
-                            new_dir,
-                            details.get("title"),
+                    op["plexmatch"] = [
+                        dict(
+                            dir=new_dir,
+                            title=details.get("title"),
                             year=year,
                             tmdb_id=tmdb_id,
                             season=int(_season),
-                        )
-                    if not os.path.exists(os.path.join(new_media_dir, ".plexmatch")):
-                        add_plexmatch_file(
-                            new_media_dir,
-                            details.get("title"),
+                        ),
+                        dict(
+                            dir=new_media_dir,
+                            title=details.get("title"),
                             year=year,
                             tmdb_id=tmdb_id,
-                        )
-                    scan_folders.append(new_dir)
-                    logger.debug(f"Added scan folder: {new_dir}")
-
-                rename_media(
-                    os.path.join(dir, file),
-                    new_file_path,
-                    dryrun=dryrun,
-                    replace=replace,
-                )
+                        ),
+                    ]
+                    op["scan"] = new_dir
+                    op["library"] = [dst_path, tmdb_id, new_media_dir]
                 # 创建 strm 文件
                 if CREATE_STRM_FILE and not dryrun:
-                    file_path = Path(re.sub(r"^/.+?/", "/Media/", new_file_path))
-                    strm_dst_file_path = (
-                        Path(STRM_FILE_PATH)
-                        / Path(dst_path).name
-                        / f"Aired_{year}"
-                        / tmdb_name
-                        / f"Season {_season}"
-                        / (new_filename + ".strm")
-                    )
-                    logger.debug(f"{strm_dst_file_path=}")
-
-                    # 使用远程 SSH 创建 STRM 文件
-                    from ssh_client import create_remote_strm_file
-
-                    retry_count = 0
-
-                    while True:
-                        logger.info(
-                            f"正在远程创建 strm 文件到 {STRM_RSYNC_DEST_SERVER}: {str(strm_dst_file_path)}"
-                        )
-
-                        if create_remote_strm_file(file_path, strm_dst_file_path):
-                            logger.info(f"成功创建远程 strm 文件：{strm_dst_file_path}")
-                            break
-                        else:
-                            retry_count += 1
-                            logger.error(
-                                f"远程 strm 文件创建失败，第 {retry_count} 次重试..."
-                            )
-                            send_tg_msg(
-                                chat_id=TG_CHAT_ID,
-                                text=f"远程 strm 文件 {strm_dst_file_path} 创建失败，第 {retry_count} 次重试...",
-                            )
-                            sleep(30)
-                # mediainfo
-                handle_strm_assistant_mediainfo(
-                    dir,
-                    filename_pre,
-                    new_dir,
-                    new_filename,
-                    dryrun=dryrun,
-                    replace=replace,
-                )
-
-        if handled_files != 0:
+                    op["strm"] = [
+                        re.sub(r"^/.+?/", "/Media/", new_file_path),
+                        str(
+                            Path(STRM_FILE_PATH)
+                            / Path(dst_path).name
+                            / f"Aired_{year}"
+                            / tmdb_name
+                            / f"Season {_season}"
+                            / (new_filename + ".strm")
+                        ),
+                    ]
+                ops.append(op)
+
+        if handled_files != 0 or abandoned_files != 0:
             break
         retry -= 1
-        sleep(30)
+        if retry and not vfs_refresh(media_path, recursive=True):
+            # 未配置 rc 或刷新失败时退回到等待挂载缓存自行过期
+            sleep(MOUNT_READY_TIMEOUT)
+
+    execute_media_ops(
+        media_path,
+        ops,
+        dryrun=dryrun,
+        replace=replace,
+        scan_folders=scan_folders,
+        journal_params=journal_params,
+    )
 
-    if handled_files == 0:
+    if handled_files == 0 and abandoned_files == 0:
         if not os.listdir(media_path):
             logger.debug(f"Empty folder: {media_path}")
         else:
@@ -613,8 +669,10 @@ def handle_movie(
     scan_folders=None,
     force=False,
     replace=True,
+    journal_params=None,
 ):
     isfile = False
+    journal_path = media_path
     media_name = os.path.basename(media_path)
     if os.path.isfile(media_path):
         media_path = os.path.dirname(media_path)
@@ -626,6 +684,10 @@ def handle_movie(
     # 初始化 tmdb
     tmdb_name = ""
     tmdb = TMDB(movie=True)
+    # 计划执行的操作, 遍历完成后统一执行
+    ops = []
+    # 已放弃的操作的源文件, 跳过
+    abandoned = load_abandoned()
 
     for dir, subdir, files in os.walk(media_path):
         removed_files = remove_hidden_files(dir, dryrun=dryrun)
@@ -656,6 +718,10 @@ def handle_movie(
                 logger.info("Removed file: " + filepath)
                 continue
 
+            if filepath in abandoned:
+                logger.warning(f"Skipped abandoned file: {filepath}")
+                continue
+
             # for collections, query for each file
             logger.info(f"Handling {filename} starts")
             _tmdb_id = tmdb_id or query_tmdb_id(filename, media_type="movie")
@@ -717,96 +783,350 @@ def handle_movie(
 
                 if is_filename_length_gt_255(new_filename):
                     new_filename = filename
-            # 由于 plex 对多层目录支持不好，直接使用一级目录
-            # 已有的保持之前的多层目录
-            new_dir = os.path.join(dst_path, f"Released_{year}", f"M{month}", tmdb_name)
-            if not os.path.exists(new_dir):
-                new_dir = os.path.join(dst_path, tmdb_name)
+            new_dir = get_title_folder(
+                media_path,
+                dst_path,
+                _tmdb_id,
+                tmdb_name,
+                f"Released_{year}",
+                f"M{month}",
+            )
             new_file_path = os.path.join(new_dir, new_filename)
+            op = {
+                "src": os.path.join(dir, filename),
+                "dst": new_file_path,
+                "mediainfo": [dir, filename_pre, new_dir, new_filename],
+            }
             if dst_path != media_path and not dryrun:
-                if not os.path.exists(os.path.join(new_dir, ".plexmatch")):
-                    add_plexmatch_file(
-                        new_dir, details.get("title"), year=year, tmdb_id=_tmdb_id
+                op["plexmatch"] = [
+                    dict(
+                        dir=new_dir,
+                        title=details.get("title"),
+                        year=year,
+                        tmdb_id=_tmdb_id,
                     )
-                scan_folders.append(new_dir)
-                logger.debug(f"Added scan folder: {new_dir}")
-            rename_media(
-                os.path.join(dir, filename),
-                new_file_path,
-                dryrun=dryrun,
-                replace=replace,
-            )
+                ]
+                op["scan"] = new_dir
+                op["library"] = [dst_path, _tmdb_id, new_dir]
             # 创建 strm 文件
             if CREATE_STRM_FILE and not dryrun:
-                file_path = Path(re.sub(r"^/.+?/", "/Media/", new_file_path))
-                strm_dst_file_path = (
-                    Path(STRM_FILE_PATH)
-                    / Path(dst_path).name
-                    / f"Released_{year}"
-                    / tmdb_name
-                    / (new_filename + ".strm")
-                )
-                logger.debug(f"{strm_dst_file_path=}")
+                op["strm"] = [
+                    re.sub(r"^/.+?/", "/Media/", new_file_path),
+                    str(
+                        Path(STRM_FILE_PATH)
+                        / Path(dst_path).name
+                        / f"Released_{year}"
+                        / tmdb_name
+                        / (new_filename + ".strm")
+                    ),
+                ]
+            ops.append(op)
+
+    execute_media_ops(
+        journal_path,
+        ops,
+        dryrun=dryrun,
+        replace=replace,
+        scan_folders=scan_folders,
+        journal_params=journal_params,
+    )
 
-                # 使用远程 SSH 创建 STRM 文件
-                from ssh_client import create_remote_strm_file
+    return scan_folders
 
-                retry_count = 0
 
-                while True:
-                    logger.info(
-                        f"正在远程创建 strm 文件到 {STRM_RSYNC_DEST_SERVER}: {str(strm_dst_file_path)}"
-                    )
+def create_strm_file(file_path, strm_dst_file_path):
+    """使用远程 SSH 创建 STRM 文件, 失败时一直重试"""
+    from ssh_client import create_remote_strm_file
 
-                    if create_remote_strm_file(file_path, strm_dst_file_path):
-                        logger.info(f"成功创建远程 strm 文件：{strm_dst_file_path}")
-                        break
-                    else:
-                        retry_count += 1
-                        logger.error(
-                            f"远程 strm 文件创建失败，第 {retry_count} 次重试..."
-                        )
-                        send_tg_msg(
-                            chat_id=TG_CHAT_ID,
-                            text=f"远程 strm 文件 {strm_dst_file_path} 创建失败，第 {retry_count} 次重试...",
-                        )
-                        sleep(30)
+    logger.debug(f"{strm_dst_file_path=}")
+    retry_count = 0
+    while True:
+        logger.info(
+            f"正在远程创建 strm 文件到 {STRM_RSYNC_DEST_SERVER}: {str(strm_dst_file_path)}"
+        )
 
-            # mediainfo
-            handle_strm_assistant_mediainfo(
-                dir, filename_pre, new_dir, new_filename, dryrun=dryrun, replace=replace
+        if create_remote_strm_file(Path(file_path), Path(strm_dst_file_path)):
+            logger.info(f"成功创建远程 strm 文件：{strm_dst_file_path}")
+            break
+        else:
+            retry_count += 1
+            logger.error(f"远程 strm 文件创建失败，第 {retry_count} 次重试...")
+            send_tg_msg(
+                chat_id=TG_CHAT_ID,
+                text=f"远程 strm 文件 {strm_dst_file_path} 创建失败，第 {retry_count} 次重试...",
             )
+            sleep(30)
 
-    return scan_folders
 
+def _execute_media_op(op, created_plexmatch, dryrun=False, replace=True):
+    if not dryrun:
+        for plexmatch in op.get("plexmatch", []):
+            if plexmatch["dir"] in created_plexmatch:
+                continue
+            if not os.path.exists(os.path.join(plexmatch["dir"], ".plexmatch")):
+                add_plexmatch_file(**plexmatch)
+            created_plexmatch.add(plexmatch["dir"])
+    if not dryrun and not os.path.exists(op["src"]) and os.path.exists(op["dst"]):
+        # 中断前已完成重命名
+        logger.info(f"{op['dst']} has been renamed, skipping")
+    else:
+        rename_media(op["src"], op["dst"], dryrun=dryrun, replace=replace)
+    if op.get("strm"):
+        create_strm_file(*op["strm"])
 
-def handle_strm_assistant_mediainfo(
-    old_dir, filename_pre, new_dir, new_filename, dryrun=False, replace=True
+
+def execute_media_ops(
+    media_path,
+    ops,
+    dryrun=False,
+    replace=True,
+    scan_folders=None,
+    done=None,
+    failures=None,
+    journal_params=None,
 ):
-    old_mediainfo_path = os.path.join(
-        EMBY_STRM_ASSISTANT_MEDIAINFO,
-        old_dir.removeprefix("/"),
-        f"{filename_pre}-mediainfo.json",
-    )
-    logger.debug(f"{old_mediainfo_path=}")
-    if os.path.exists(old_mediainfo_path):
-        logger.debug(f"Found mediainfo: {old_mediainfo_path}")
-        new_filename_pre = ".".join(new_filename.split(".")[0:-1])
-        mediainfo = load_json(old_mediainfo_path)
-        mediainfo[0]["MediaSourceInfo"]["Name"] = new_filename_pre
-        dump_json(mediainfo, old_mediainfo_path)
-        logger.info(f"Updating mediainfo: {old_mediainfo_path}")
-        new_mediainfo_path = os.path.join(
-            EMBY_STRM_ASSISTANT_MEDIAINFO,
-            str(new_dir).removeprefix("/"),
-            f"{new_filename_pre}-mediainfo.json",
+    """执行 handle_tvshow/handle_movie 计划的操作
+
+    非 dryrun 时先将全部操作写入日志并逐个记录完成情况，进程中断后由
+    resume_media_ops 重放未完成的操作。单个操作失败时记录后继续执行其余操作,
+    已完成操作的扫描目录等照常处理, 最后统一抛出异常; 失败次数达到
+    JOURNAL_MAX_FAILURES 的操作被放弃, 之后处理时跳过
+
+    Args:
+        media_path (str): 资源路径, 用于区分日志
+        ops (list): 操作列表, 每个操作包含 src/dst/mediainfo, 以及可选的
+            plexmatch/scan/library/strm
+        done (set, optional): 已完成的操作 id, 仅重放日志时使用
+        failures (Counter, optional): 各操作的失败次数, 仅重放日志时使用
+        journal_params (dict, optional): 本次处理的参数, 写入日志用于重放时比对
+    """
+    if scan_folders is None:
+        scan_folders = []
+    journal = None
+    if not dryrun and ops:
+        journal = RenameJournal(media_path)
+        if done is None:
+            journal.plan(ops, journal_params)
+    done = done or set()
+    # 反复失败的操作不再重试, 避免日志一直残留、每次处理都重放
+    abandoned = {
+        op_id
+        for op_id, count in (failures or {}).items()
+        if op_id not in done and count >= JOURNAL_MAX_FAILURES
+    }
+    for op_id in abandoned:
+        logger.error(
+            f"Giving up {ops[op_id]['src']} -> {ops[op_id]['dst']} "
+            f"after {failures[op_id]} failures"
+        )
+
+    created_plexmatch = set()
+    mediainfo_moves = []
+    title_folders = {}
+    failed = []
+    for op_id, op in enumerate(ops):
+        if op_id in abandoned:
+            continue
+        if op_id not in done:
+            try:
+                _execute_media_op(op, created_plexmatch, dryrun=dryrun, replace=replace)
+            except Exception as e:
+                logger.error(f"Failed to handle {op['src']} -> {op['dst']}: {e}")
+                logger.error(traceback.format_exc())
+                failed.append(op_id)
+                if journal:
+                    journal.fail(op_id)
+                    if (failures or {}).get(op_id, 0) + 1 >= JOURNAL_MAX_FAILURES:
+                        logger.error(
+                            f"Giving up {op['src']} -> {op['dst']} "
+                            f"after {JOURNAL_MAX_FAILURES} failures"
+                        )
+                        abandoned.add(op_id)
+                continue
+            if journal:
+                journal.done(op_id)
+        # 已完成操作的扫描、mediainfo 等仍需处理, 中断时可能未执行
+        if op.get("scan"):
+            scan_folders.append(op["scan"])
+            logger.debug(f"Added scan folder: {op['scan']}")
+        if op.get("library"):
+            root, tmdb_id, title_folder = op["library"]
+            title_folders[(root, tmdb_id)] = title_folder
+        mediainfo_moves.append(tuple(op["mediainfo"]))
+
+    handle_strm_assistant_mediainfo(mediainfo_moves, dryrun=dryrun, replace=replace)
+    for (root, tmdb_id), title_folder in title_folders.items():
+        update_title_folder(root, tmdb_id, title_folder)
+    if journal and abandoned:
+        abandon([ops[op_id] for op_id in abandoned])
+    # 仍有未放弃的失败操作时保留日志, 下次处理时重放; 有放弃的操作时源文件仍在,
+    # 日志归档而不是删除, 便于手动检查
+    if journal and all(op_id in abandoned for op_id in failed):
+        if abandoned:
+            journal.archive()
+        else:
+            journal.close()
+    if failed:
+        raise Exception(
+            f"Failed to handle {len(failed)}/{len(ops)} files of {media_path}"
         )
-        rename_media(
-            old_mediainfo_path,
-            new_mediainfo_path,
-            dryrun=dryrun,
-            replace=replace,
+    return scan_folders
+
+
+def get_journal_params(media_type, tmdb_id, dst_path, force) -> dict:
+    """影响计划操作的处理参数, 重放日志时参数一致才重放"""
+    return {
+        "media_type": media_type,
+        "tmdb_id": str(tmdb_id or ""),
+        "dst_path": os.path.normpath(dst_path) if dst_path else None,
+        "force": bool(force),
+    }
+
+
+def resume_media_ops(media_path, journal_params=None, replace=True, scan_folders=None):
+    """重放资源路径未完成的操作日志
+
+    日志记录的处理参数与本次不一致时 (如 tmdb id 或目标路径不同) 不重放, 日志移入
+    archive 目录
+
+    Returns:
+        list | None: 需要扫描的目录, 没有可重放的日志时返回 None
+    """
+    journal = RenameJournal(media_path)
+    if not journal.exists():
+        return None
+    params, ops, done, failures = journal.load()
+    if params != journal_params:
+        logger.warning(
+            f"Journal of {media_path} was planned with {params}, "
+            f"not {journal_params}, skip replaying it"
+        )
+        journal.archive()
+        return None
+    logger.info(
+        f"Resuming {media_path} from journal: {len(ops) - len(done)}/{len(ops)} left"
+    )
+    return execute_media_ops(
+        media_path,
+        ops,
+        replace=replace,
+        scan_folders=scan_folders,
+        done=done,
+        failures=failures,
+    )
+
+
+def _has_media_files(path) -> bool:
+    """路径下是否还有需要处理的媒体文件, 不包括已放弃的文件"""
+    abandoned = load_abandoned()
+    if os.path.isfile(path):
+        return path.split(".")[-1].lower() in MEDIA_SUFFIX and path not in abandoned
+    for dir, _, files in os.walk(path):
+        if any(
+            file.split(".")[-1].lower() in MEDIA_SUFFIX
+            and os.path.join(dir, file) not in abandoned
+            for file in files
+        ):
+            return True
+    return False
+
+
+def handle_strm_assistant_mediainfo(mediainfo_moves, dryrun=False, replace=True):
+    """批量迁移神医插件的 mediainfo
+
+    Args:
+        mediainfo_moves (list): [(原目录, 原文件名前缀, 新目录, 新文件名), ...]
+    """
+    if not mediainfo_moves or not os.path.isdir(EMBY_STRM_ASSISTANT_MEDIAINFO):
+        return
+    if EMBY_STRM_ASSISTANT_MEDIAINFO_ASYNC and not dryrun:
+        # 非守护线程, 进程退出前会等待迁移完成
+        threading.Thread(
+            target=_move_strm_assistant_mediainfo,
+            args=(list(mediainfo_moves), dryrun, replace),
+            name="strm-assistant-mediainfo",
+        ).start()
+    else:
+        _move_strm_assistant_mediainfo(mediainfo_moves, dryrun, replace)
+
+
+def _move_strm_assistant_mediainfo(mediainfo_moves, dryrun=False, replace=True):
+    # 按原目录分组, 每个目录只列出一次
+    old_dirs = defaultdict(list)
+    for old_dir, filename_pre, new_dir, new_filename in mediainfo_moves:
+        old_dirs[old_dir].append((filename_pre, new_dir, new_filename))
+
+    # 按新目录分组, 每个目录只创建一次
+    new_dirs = defaultdict(list)
+    for old_dir, moves in old_dirs.items():
+        old_mediainfo_dir = os.path.join(
+            EMBY_STRM_ASSISTANT_MEDIAINFO, old_dir.removeprefix("/")
         )
+        try:
+            existed = set(os.listdir(old_mediainfo_dir))
+        except FileNotFoundError:
+            continue
+        for filename_pre, new_dir, new_filename in moves:
+            if f"{filename_pre}-mediainfo.json" not in existed:
+                continue
+            new_mediainfo_dir = os.path.join(
+                EMBY_STRM_ASSISTANT_MEDIAINFO, str(new_dir).removeprefix("/")
+            )
+            new_dirs[new_mediainfo_dir].append(
+                (
+                    os.path.join(old_mediainfo_dir, f"{filename_pre}-mediainfo.json"),
+                    ".".join(new_filename.split(".")[0:-1]),
+                )
+            )
+
+    for new_mediainfo_dir, moves in new_dirs.items():
+        if not dryrun:
+            os.makedirs(new_mediainfo_dir, exist_ok=True)
+        for old_mediainfo_path, new_filename_pre in moves:
+            new_mediainfo_path = os.path.join(
+                new_mediainfo_dir, f"{new_filename_pre}-mediainfo.json"
+            )
+            try:
+                if old_mediainfo_path == new_mediainfo_path:
+                    continue
+                if not replace and os.path.exists(new_mediainfo_path):
+                    logger.warning(f"{new_mediainfo_path} exists, skipping")
+                    continue
+                if not dryrun:
+                    # 直接写入新位置并删除旧文件, 代替 写回 + 重命名
+                    mediainfo = load_json(old_mediainfo_path)
+                    mediainfo[0]["MediaSourceInfo"]["Name"] = new_filename_pre
+                    dump_json(mediainfo, new_mediainfo_path, compact=True)
+                    os.remove(old_mediainfo_path)
+                logger.info(f"{old_mediainfo_path} --> {new_mediainfo_path}")
+            except Exception as e:
+                logger.error(f"Move mediainfo {old_mediainfo_path} failed due to: {e}")
+
+
+def get_folder_fingerprint(path) -> list:
+    """获取文件夹指纹: [最新修改时间, 文件及文件夹数量, 文件总大小]"""
+    mtime = os.stat(path).st_mtime
+    count, size = 0, 0
+    dirs = [path]
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                count += 1
+                stat = entry.stat(follow_symlinks=False)
+                mtime = max(mtime, stat.st_mtime)
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                else:
+                    size += stat.st_size
+    return [mtime, count, size]
+
+
+def _prefetch_tmdb_details(tmdb_id, media_type):
+    """预先获取 TMDB 信息并写入缓存"""
+    try:
+        TMDB(movie=media_type == "movie").get_info_from_tmdb_by_id(tmdb_id=tmdb_id)
+    except Exception as e:
+        logger.error(f"Prefetching TMDB details of {tmdb_id} failed: {e}")
 
 
 def handle_local_media(
@@ -817,6 +1137,8 @@ def handle_local_media(
     query=False,
     dryrun=False,
     force=False,
+    full=False,
+    workers=HANDLE_LOCAL_MEDIA_WORKERS,
 ):
     """处理本地已有资源
 
@@ -826,9 +1148,21 @@ def handle_local_media(
         ignore_filter (str): 用于过滤忽略的文件夹, 使用正则表达式
         query (bool): 是否需要查询 TMDB
         dryrun (bool):
+        full (bool): 忽略指纹记录, 重新处理所有文件夹
+        workers (int): 并发处理的文件夹数量
 
     Returns:
     """
+    # 上次成功处理后的文件夹指纹, 未发生变化的文件夹不再处理
+    try:
+        fingerprints = load_json(LOCAL_MEDIA_INDEX)
+    except Exception:
+        fingerprints = {}
+    seen_folders = set()
+    # 本次扫描的分类目录, 只清理这些目录下的指纹
+    scanned_roots = set()
+    # 待处理的文件夹: (media_folder, media_type, dst_path, tmdb_id)
+    tasks = []
 
     for folder in folders:
         dst_base_path = folder
@@ -845,52 +1179,116 @@ def handle_local_media(
             media_type = "av"
 
         path = os.path.join(root, folder)
+        scanned_roots.add(os.path.normpath(path))
         media_folders = [
             os.path.join(path, p)
             for p in os.listdir(path)
             if os.path.isdir(os.path.join(path, p))
             and not (ignore_filter and re.search(ignore_filter, p))
         ]
+        seen_folders.update(media_folders)
         for media_folder in media_folders:
             tmdb_name = re.search(r"tmdb-(\d+)", media_folder)
+            # 若不进行 TMDB 查询
+            if not tmdb_name and not query:
+                logger.info(f"Skipping {media_folder}")
+                continue
+            if not full:
+                try:
+                    fingerprint = get_folder_fingerprint(media_folder)
+                except OSError as e:
+                    logger.error(f"Failed to get fingerprint of {media_folder}: {e}")
+                    continue
+                if fingerprints.get(media_folder) == fingerprint:
+                    logger.debug(f"{media_folder} has not changed, skipping...")
+                    continue
+            tasks.append(
+                (
+                    media_folder,
+                    media_type,
+                    os.path.join(dst_root, dst_base_path),
+                    tmdb_name.group(1) if tmdb_name else None,
+                )
+            )
+
+    # 同一目标文件夹同时只能有一个任务在处理
+    dst_locks = defaultdict(threading.Lock)
+    dst_locks_guard = threading.Lock()
+
+    def _handle(media_folder, media_type, dst_path, tmdb_id):
+        key = (dst_path, tmdb_id or os.path.basename(media_folder))
+        with dst_locks_guard:
+            lock = dst_locks[key]
+        with lock:
+            media_handle(
+                path=media_folder,
+                media_type=media_type,
+                dst_path=dst_path,
+                tmdb_id=tmdb_id,
+                keep_nfo=tmdb_id is not None,
+                keep_job_persisted=False,
+                dryrun=dryrun,
+                force=force,
+            )
+
+    with ThreadPoolExecutor(max_workers=max(int(workers), 1)) as executor:
+        if workers > 1:
+            # 并发处理前预先获取所有 TMDB 信息
+            prefetch_ids = {
+                (tmdb_id, "movie" if media_type == "movie" else "tv")
+                for _, media_type, _, tmdb_id in tasks
+                if tmdb_id and media_type != "av"
+            }
+            wait([executor.submit(_prefetch_tmdb_details, *_) for _ in prefetch_ids])
+        futures = {executor.submit(_handle, *task): task[0] for task in tasks}
+        for future in as_completed(futures):
+            media_folder = futures[future]
             try:
-                if tmdb_name:
-                    tmdb_id = tmdb_name.group(1)
-                    media_handle(
-                        path=media_folder,
-                        media_type=media_type,
-                        dst_path=os.path.join(dst_root, dst_base_path),
-                        tmdb_id=tmdb_id,
-                        keep_nfo=True,
-                        keep_job_persisted=False,
-                        dryrun=dryrun,
-                        force=force,
-                    )
-                else:
-                    # 若不进行 TMDB 查询
-                    if not query:
-                        logger.info(f"Skipping {media_folder}")
-                        continue
-                    else:
-                        media_handle(
-                            path=media_folder,
-                            media_type=media_type,
-                            dst_path=os.path.join(dst_root, dst_base_path),
-                            keep_job_persisted=False,
-                            dryrun=dryrun,
-                            force=force,
-                        )
+                future.result()
             except Exception as e:
                 logger.error(e)
                 logger.error(f"Failed to process {media_folder}")
+                fingerprints.pop(media_folder, None)
                 continue
             else:
                 logger.info(f"Processed {media_folder}")
+                # 记录处理后的指纹
+                if not dryrun:
+                    try:
+                        fingerprints[media_folder] = get_folder_fingerprint(
+                            media_folder
+                        )
+                    except OSError:
+                        fingerprints.pop(media_folder, None)
+
+    if not dryrun:
+        # 清理本次扫描的分类目录下已不存在的文件夹, 其他分类的指纹保持不变
+        dump_json(
+            {
+                k: v
+                for k, v in fingerprints.items()
+                if k in seen_folders or os.path.dirname(k) not in scanned_roots
+            },
+            LOCAL_MEDIA_INDEX,
+        )
 
 
 def send_scan_request(
-    scan_folders: Union[str, list, tuple], plex=PLEX_AUTO_SCAN, emby=EMBY_AUTO_SCAN
+    scan_folders: Union[str, list, tuple],
+    plex=PLEX_AUTO_SCAN,
+    emby=EMBY_AUTO_SCAN,
+    max_attempts: Optional[int] = None,
 ):
+    """发送扫描请求, 失败时每 60s 重试, 部分路径失败时只重试这些路径
+
+    Args:
+        max_attempts (int, optional): 每个服务器最多尝试的次数, 仍失败时抛出异常
+            (部分路径失败时为 ScanError, paths 为失败的路径); 默认一直重试
+    """
+    # 按需导入, 避免没有扫描请求时加载 plexapi
+    from emby import Emby
+    from plex import Plex
+
     # handle scan request
     if not isinstance(scan_folders, (list, tuple)):
         scan_folders = [scan_folders]
@@ -902,12 +1300,19 @@ def send_scan_request(
         _emby = Emby()
         media_servers.append(_emby)
     for server in media_servers:
+        folders = set(scan_folders)
+        attempt = 0
         while True:
+            attempt += 1
             try:
-                server.scan(path=set(scan_folders))
+                server.scan(path=folders)
             except Exception as e:
                 logger.error(f"Send scan request failed due to: {e}")
                 logger.error(traceback.format_exc())
+                if isinstance(e, ScanError):
+                    folders = set(e.paths)
+                if max_attempts and attempt >= max_attempts:
+                    raise
                 sleep(60)
                 continue
             else:
@@ -930,6 +1335,7 @@ def media_handle(
     keep_job_persisted=True,
     force=False,
     replace=True,
+    scan_notification=None,
 ):
     """Media handler
 
@@ -948,6 +1354,7 @@ def media_handle(
         keep_job_persisted (bool, optional): scheduler jobstore
         force: handle whether tmdb id exists or not
         replace: replace existed file if True
+        scan_notification (str, optional): TG notification sent once the media is in the library
 
     Returns:
         bool: True if the media was handled, False otherwise
@@ -959,7 +1366,24 @@ def media_handle(
     # folder to send scan request
     scan_folders = []
 
-    if media_type == "movie":
+    # 上次以相同参数处理时中断, 先重放未完成的操作, 之后仍有媒体文件 (如中断后新加入
+    # 的文件) 时继续正常处理
+    journal_params = get_journal_params(media_type, tmdb_id, dst_path, force)
+    try:
+        resumed = (
+            resume_media_ops(
+                root, journal_params, replace=replace, scan_folders=scan_folders
+            )
+            if not dryrun
+            else None
+        )
+    except Exception:
+        # 已完成的操作仍需扫描
+        _enqueue_partial_scan(scan_folders, keep_job_persisted)
+        raise
+    if resumed is not None and not _has_media_files(root):
+        logger.info(f"No media files left in {root} after resuming")
+    elif media_type == "movie":
         try:
             scan_folders = handle_movie(
                 media_path=root,
@@ -972,10 +1396,12 @@ def media_handle(
                 scan_folders=scan_folders,
                 force=force,
                 replace=replace,
+                journal_params=journal_params,
             )
         except Exception as e:
             logger.error(f"Process {root} failed dut to {e}")
             logger.error(traceback.format_exc())
+            _enqueue_partial_scan(scan_folders, keep_job_persisted)
             raise e
     elif media_type in ["tv", "anime"]:
         # handle media folder
@@ -996,10 +1422,12 @@ def media_handle(
                 scan_folders=scan_folders,
                 force=force,
                 replace=replace,
+                journal_params=journal_params,
             )
         except Exception as e:
             logger.error(f"Process {root} failed dut to {e}")
             logger.error(traceback.format_exc())
+            _enqueue_partial_scan(scan_folders, keep_job_persisted)
             raise e
     elif media_type == "av":
         for dir, _, _ in os.walk(root):
@@ -1015,49 +1443,78 @@ def media_handle(
         logger.warning("Unkown media type, skip……")
 
     if (PLEX_AUTO_SCAN or EMBY_AUTO_SCAN) and scan_folders:
-        # 120s 后执行, 尽量避免 rclone 未更新导致路径找不到
-        run_date = datetime.datetime.now() + datetime.timedelta(minutes=3)
+        _enqueue_scan(scan_folders, keep_job_persisted, notification=scan_notification)
+    elif scan_notification:
+        send_tg_msg(chat_id=TG_CHAT_ID, text=scan_notification)
+
+
+def _enqueue_scan(scan_folders, keep_job_persisted=True, notification=None):
+    """加入扫描队列, 由队列按媒体库合并、防抖后再发送扫描请求"""
+    jobstore = "default"
+    if keep_job_persisted:
+        jobstore = "sqlite"
         scheduler = Scheduler()
-        if keep_job_persisted and not scheduler.jobstores.get("sqlite"):
+        if not scheduler.jobstores.get("sqlite"):
             scheduler.add_jobstore(
                 SQLAlchemyJobStore(url="sqlite:///jobs.sql"), alias="sqlite"
             )
-        scheduler.add_job(
-            send_scan_request,
-            args=(scan_folders,),
-            trigger="date",
-            run_date=run_date,
-            misfire_grace_time=60,
-            jobstore="sqlite" if keep_job_persisted else "default",
-            replace_existing=True,
-            id=f"scan_task_at_{run_date}",
-        )
-        logger.debug(f"Added scheduler job: next run at {str(run_date)}")
+    enqueue_scan_request(scan_folders, jobstore=jobstore, notification=notification)
+
+
+def _enqueue_partial_scan(scan_folders, keep_job_persisted=True):
+    """处理失败时, 已完成的操作仍需扫描; 不发送入库通知"""
+    if (PLEX_AUTO_SCAN or EMBY_AUTO_SCAN) and scan_folders:
+        _enqueue_scan(scan_folders, keep_job_persisted)
 
 
 if __name__ == "__main__":
     args = parse()
-    media_handle(
-        args.path,
-        media_type=args.media_type,
-        dst_path=args.dst_path,
-        regex=args.regex,
-        group=args.group,
-        nogroup=args.nogroup,
-        season=args.season,
-        episode_bit=args.episode_bit,
-        tmdb_id=args.tmdb_id,
-        dryrun=args.dryrun,
-        offset=args.offset,
-        keep_nfo=args.keep_nfo,
-        keep_job_persisted=args.keep_job_persisted,
-        force=args.force,
-        replace=not args.not_replace,
-    )
+    paths = list(args.path)
+    if args.manifest:
+        paths.extend(load_manifest(args.manifest))
+    # 重放的日志使用中断时的处理参数, 参数不一致时日志不会被重放
+    journal_params = {}
+    if args.resume:
+        for journal in iter_journals():
+            paths.append(journal.media_path)
+            journal_params[journal.media_path] = journal.params or {}
+    if not paths:
+        raise SystemExit("Please specify the path of media or a manifest file")
+
+    failed = []
+    for path in paths:
+        params = journal_params.get(path, {})
+        try:
+            media_handle(
+                path,
+                media_type=params.get("media_type", args.media_type),
+                dst_path=params.get("dst_path", args.dst_path),
+                regex=args.regex,
+                group=args.group,
+                nogroup=args.nogroup,
+                season=args.season,
+                episode_bit=args.episode_bit,
+                tmdb_id=params.get("tmdb_id", args.tmdb_id),
+                dryrun=args.dryrun,
+                offset=args.offset,
+                keep_nfo=args.keep_nfo,
+                keep_job_persisted=args.keep_job_persisted,
+                force=params.get("force", args.force),
+                replace=not args.not_replace,
+            )
+        except Exception:
+            logger.exception(f"Failed to process {path}")
+            failed.append(path)
+            continue
+    if failed:
+        logger.error(f"Failed to process {len(failed)}/{len(paths)} paths: {failed}")
+
+    # 扫描请求已持久化在队列中, 交由运行中的守护进程发送
+    if not args.no_wait:
+        # 所有路径共享一次防抖后的扫描请求
+        scheduler = Scheduler()
+        while scheduler.scheduler.get_jobs():
+            sleep(5)
+        scheduler.shutdown()
 
-    scheduler = Scheduler()
-    while True:
-        if not scheduler.scheduler.get_jobs():
-            break
-        sleep(30)
-    sleep(30)
+    raise SystemExit(1 if failed else 0)
@@ -1,16 +1,16 @@
 import argparse
-import datetime
 import json
 import os
-import pickle
 import re
 import traceback
 from pathlib import Path
 from time import sleep
 
 from autorclone import auto_rclone
+from library_index import remove_title_folder, update_title_folder
 from log import logger
-from media_handle import add_plexmatch_file, rename_media, send_scan_request
+from media_handle import add_plexmatch_file, rename_media
+from scan_queue import enqueue_scan_request, get_library_root
 from scheduler import Scheduler
 from settings import EMBY_STRM_ASSISTANT_MEDIAINFO
 from tmdb import TMDB
@@ -32,12 +32,6 @@ def main(root_folder, media_type="movie", ignore_filter=None):
     t = TMDB(movie=is_movie)
     scheduler = Scheduler()
     fails = {}
-    cache_path = Path("tmdb_info.cache")
-    if cache_path.exists():
-        with open(cache_path, "rb") as f:
-            cache = pickle.load(f)
-    else:
-        cache = {}
     try:
         for root_path, _, files in os.walk(root_folder):
             if ignore_filter and re.search(rf"{ignore_filter}", root_path):
@@ -54,20 +48,17 @@ def main(root_folder, media_type="movie", ignore_filter=None):
                     continue
                 try:
                     tmdbid = tmdbid_match.group(1)
-                    if cache.get(tmdbid):
-                        details = cache.get(tmdbid)
-                    else:
-                        details = t.get_info_from_tmdb_by_id(tmdb_id=tmdbid)
-                        cache.update({tmdbid: details})
+                    details = t.get_info_from_tmdb_by_id(tmdb_id=tmdbid)
                     tmdb_name = details.get("tmdb_name")
                     year = details.get("year")
                     month = details.get("month")
                     title = details.get("title")
                     season = None
 
-                    new_folder = Path(
+                    title_folder = Path(
                         root_folder, f"{prefix}_{year}", f"M{month}", tmdb_name
                     )
+                    new_folder = title_folder
                     if not is_movie:
                         season_match = re.search(
                             r"S(eason)?\s?(\d{1,2})", str(filepath)
@@ -82,6 +73,7 @@ def main(root_folder, media_type="movie", ignore_filter=None):
                             logger.info(f"{new_filepath} exists, skipping")
                             continue
                         rename_media(str(filepath), str(new_filepath))
+                        update_title_folder(root_folder, tmdbid, str(title_folder))
                 except Exception as e:
                     logger.error(e)
                     logger.error(traceback.format_exc())
@@ -98,29 +90,11 @@ def main(root_folder, media_type="movie", ignore_filter=None):
                             season=season,
                         )
             if scan_folders:
-                run_date = datetime.datetime.now() + datetime.timedelta(minutes=3)
-                scheduler.add_job(
-                    send_scan_request,
-                    args=(
-                        scan_folders,
-                        True,
-                        False,
-                    ),
-                    trigger="date",
-                    run_date=run_date,
-                    misfire_grace_time=60,
-                    jobstore="default",
-                    replace_existing=True,
-                    id=f"scan_task_at_{run_date}",
-                )
-                logger.debug(f"Added scheduler job: next run at {str(run_date)}")
+                enqueue_scan_request(scan_folders, plex=True, emby=False)
     except Exception as e:
         logger.error(e)
         logger.error(traceback.format_exc())
     finally:
-        with open(cache_path, "wb") as f:
-            pickle.dump(cache, f)
-
         with open("mv_failed.json", "a+") as f:
             json.dump(fails, f)
 
@@ -138,20 +112,8 @@ def scan_folder():
         if re.search(r"Aired_(19\d{2}|20[01]\d)", dir.name):
             for _dir in dir.absolute().iterdir():
                 for __dir in _dir.absolute().iterdir():
-                    run_date = datetime.datetime.now() + datetime.timedelta(minutes=3)
-                    scheduler.add_job(
-                        send_scan_request,
-                        args=(str(__dir.absolute()),),
-                        trigger="date",
-                        run_date=run_date,
-                        misfire_grace_time=60,
-                        jobstore="default",
-                        replace_existing=True,
-                        id=f"scan_task_at_{run_date}",
-                    )
-                    logger.debug(
-                        f"Added scheduler job: next run at {str(run_date)}, folder: {str(__dir.absolute())}"
-                    )
+                    enqueue_scan_request(str(__dir.absolute()))
+                    logger.debug(f"Added scan folder: {str(__dir.absolute())}")
 
     while True:
         if not scheduler.scheduler.get_jobs():
@@ -210,6 +172,12 @@ def mv_lib(
                     dest_path=f"{dst_mount}:{str(new_folder)}",
                     action="move",
                 )
+                update_title_folder(
+                    f"{dst_mount_prefix}{lib}",
+                    tmdbid,
+                    f"{dst_mount_prefix}{new_folder}",
+                )
+                remove_title_folder(get_library_root(root_path), tmdbid)
             except Exception as e:
                 logger.error(e)
                 logger.error(traceback.format_exc())
@@ -235,22 +203,7 @@ def mv_lib(
                         str(Path(EMBY_STRM_ASSISTANT_MEDIAINFO, new_mediainfo_folder)),
                     )
             if scan_folders:
-                run_date = datetime.datetime.now() + datetime.timedelta(minutes=3)
-                scheduler.add_job(
-                    send_scan_request,
-                    args=(
-                        scan_folders,
-                        False,
-                        False,
-                    ),
-                    trigger="date",
-                    run_date=run_date,
-                    misfire_grace_time=60,
-                    jobstore="default",
-                    replace_existing=True,
-                    id=f"scan_task_at_{run_date}",
-                )
-                logger.debug(f"Added scheduler job: next run at {str(run_date)}")
+                enqueue_scan_request(scan_folders, plex=False, emby=False)
 
     except Exception as e:
         logger.error(e)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""按路径组件建立的前缀树，查找路径所属的最长前缀 (媒体库目录)
+
+按组件而不是字符串匹配，/Media/TV 不会匹配 /Media/TVShows/...；查找耗时只与路径
+深度有关，与媒体库目录的数量无关。
+"""
+
+from typing import Any, Optional
+
+# 节点中保存值的键, 不会与路径组件冲突
+_VALUE = "\0"
+
+
+def _split(path: str) -> list:
+    return [part for part in path.split("/") if part]
+
+
+class PathPrefixIndex:
+    def __init__(self):
+        self._root = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, path: str, value: Any):
+        node = self._root
+        for part in _split(path):
+            node = node.setdefault(part, {})
+        if _VALUE not in node:
+            self._size += 1
+        node[_VALUE] = value
+
+    def lookup(self, path: str) -> Optional[Any]:
+        """返回 path 的最长前缀对应的值, 没有时返回 None"""
+        node = self._root
+        value = node.get(_VALUE)
+        for part in _split(path):
+            node = node.get(part)
+            if node is None:
+                break
+            value = node.get(_VALUE, value)
+        return value
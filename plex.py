@@ -1,28 +1,74 @@
 #!/user/bin/env python3
 
 import re
+import threading
+import time
 from time import sleep
-from typing import Optional, Sequence, Union
+from typing import Dict, Optional, Sequence, Union
 
+import settings as _cfg
 from log import logger
+from path_index import PathPrefixIndex
 from plexapi.myplex import Section
 from plexapi.server import PlexServer
 from settings import PLEX_API_TOKEN, PLEX_BASE_URL
+from utils import ScanError
+
+# 新增配置项，兼容未更新的 settings.py
+PLEX_SECTION_CACHE_TTL = getattr(_cfg, "PLEX_SECTION_CACHE_TTL", 3600)
+# 路径未命中时重新获取媒体库的最短间隔 (s)
+SECTION_REFRESH_MIN_INTERVAL = 30
+# 扫描请求失败时的重试次数
+SCAN_RETRIES = 3
 
 
 class Plex:
     """class Plex"""
 
+    # 各服务器共用的连接和媒体库目录索引, 创建 PlexServer 时会请求服务器
+    _servers: Dict[tuple, PlexServer] = {}
+    _section_indexes: Dict[tuple, tuple] = {}
+    _lock = threading.Lock()
+
     def __init__(self, base_url: str = PLEX_BASE_URL, token: str = PLEX_API_TOKEN):
-        self.plex_server = PlexServer(baseurl=base_url, token=token)
+        self._key = (base_url, token)
 
-    def get_section_by_location(self, location: str) -> Optional[Section]:
+    @property
+    def plex_server(self) -> PlexServer:
+        """首次使用时连接服务器, 之后复用"""
+        with self._lock:
+            server = self._servers.get(self._key)
+            if server is None:
+                base_url, token = self._key
+                server = PlexServer(baseurl=base_url, token=token)
+                self._servers[self._key] = server
+        return server
+
+    def _build_section_index(self) -> PathPrefixIndex:
+        index = PathPrefixIndex()
         for section in self.plex_server.library.sections():
             for loc in section.locations:
-                if re.search(rf"{loc}", location):
-                    return section
+                index.insert(loc, section)
+        logger.debug(f"Built section location index with {len(index)} locations")
+        return index
 
-        return None
+    def get_section_by_location(self, location: str) -> Optional[Section]:
+        """按媒体库目录的路径前缀 (按路径组件字面匹配) 查找所属的媒体库"""
+        with self._lock:
+            index, built_at = self._section_indexes.get(self._key, (None, 0))
+        age = time.time() - built_at
+        if index is None or age > PLEX_SECTION_CACHE_TTL:
+            index, age = self._build_section_index(), 0
+            with self._lock:
+                self._section_indexes[self._key] = (index, time.time())
+        section = index.lookup(location)
+        # 可能是新添加的媒体库
+        if section is None and age > SECTION_REFRESH_MIN_INTERVAL:
+            index = self._build_section_index()
+            with self._lock:
+                self._section_indexes[self._key] = (index, time.time())
+            section = index.lookup(location)
+        return section
 
     def _get_lastest_added_item(self, section: Section):
         return section.recentlyAdded(1)[0]
@@ -39,26 +85,36 @@ class Plex:
         """发送扫描请求"""
         if isinstance(path, str):
             path = [path]
-        _path = set(path)
+        sections = {}
         for p in set(path):
             section = self.get_section_by_location(p)
             if not section:
-                logger.error("Section Not found")
-                _path.remove(p)
-        if not _path:
+                logger.error(f"Section not found for {p}")
+                continue
+            sections[p] = section
+        if not sections:
             return False
 
-        for p in _path:
-            while True:
+        # 每个路径只扫描其所属的媒体库, 失败时有限次退避重试, 仍失败的路径不影响
+        # 其他路径, 最后通过 ScanError 交由调用方只重试这些路径
+        failed = []
+        for p, section in sections.items():
+            for attempt in range(SCAN_RETRIES + 1):
                 try:
                     section.update(p)
                 except Exception as e:
                     logger.error(e)
-                    sleep(10)
-                    continue
+                    if attempt >= SCAN_RETRIES:
+                        failed.append(p)
+                        break
+                    sleep(2**attempt)
                 else:
-                    logger.info(f"Sent scan request successfully: {path}")
+                    logger.info(
+                        f"Sent scan request successfully: {p} ({section.title})"
+                    )
                     break
+        if failed:
+            raise ScanError(failed)
 
     def refresh_recently_added(self, path: str, max: int = 10):
         section = self.get_section_by_location(path)
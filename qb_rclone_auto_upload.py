@@ -19,6 +19,7 @@ import qbittorrentapi
 from autorclone import auto_rclone
 from log import logger
 from media_handle import handle_local_media, media_handle
+from scan_queue import EMBY_SCAN_CONFIRM, retry_unconfirmed_scans, schedule_flush
 from settings import (
     CATEGORY_SETTINGS_MAPPING,
     HANDLE_LOCAL_MEDIA,
@@ -77,6 +78,10 @@ def main(src_dir=""):
 
     # current uuid
     uuid = os.urandom(16).hex()
+    # 各种子上次处理时的 T/Y 标签
+    torrent_fix_tags = {}
+    # 在调度器线程中提前刷新即将过期的 TMDB 缓存
+    TMDB.schedule_revalidate_cache()
 
     # retrieve torrents filtered by tag
     while True:
@@ -103,6 +108,12 @@ def main(src_dir=""):
                         if "" in tags:
                             tags.remove("")
                         category = torrent.category
+                        # T/Y 标签变化说明手动修正了查询条件, 之前查询无结果的缓存失效
+                        fix_tags = sorted(t for t in tags if re.match(r"[TY]\d+$", t))
+                        if torrent_fix_tags.get(torrent.hash, []) != fix_tags:
+                            if fix_tags or torrent.hash in torrent_fix_tags:
+                                TMDB.invalidate_negative_cache()
+                            torrent_fix_tags[torrent.hash] = fix_tags
                         if re.search(r"NSFW", category):
                             tags.append("no_seed")
 
@@ -394,51 +405,38 @@ def main(src_dir=""):
                                         if cn_match:
                                             if query_flag:
                                                 if not local_record:
-                                                    # query tmdb with chinese or other language
-                                                    for i in range(2):
-                                                        _g = i + 1
-                                                        if is_movie:
-                                                            tmdb_info = tmdb.get_info_from_tmdb(
-                                                                {
-                                                                    "query": cn_match.group(
-                                                                        _g
-                                                                    ),
-                                                                    "year": int(year),
-                                                                },
-                                                                year_deviation=movie_year_deviation,
-                                                            )
-                                                        else:
-                                                            tmdb_info = tmdb.get_info_from_tmdb(
-                                                                {
-                                                                    "query": cn_match.group(
-                                                                        _g
-                                                                    ),
-                                                                    "first_air_date_year": int(
-                                                                        year
-                                                                    ),
-                                                                },
-                                                                year_deviation=tv_year_deviation,
-                                                            )
-                                                        tmdb_name = tmdb_info.get(
-                                                            "tmdb_name"
-                                                        )
-                                                        tmdb_id = tmdb_info.get(
-                                                            "tmdb_id"
-                                                        )
-                                                        is_anime = tmdb_info.get(
-                                                            "is_anime"
-                                                        )
-                                                        is_documentary = tmdb_info.get(
-                                                            "is_documentary"
-                                                        )
-                                                        is_variety = tmdb_info.get(
-                                                            "is_variety"
-                                                        )
-                                                        is_nc17 = tmdb_info.get(
-                                                            "is_nc17"
-                                                        )
-                                                        if tmdb_name:
-                                                            break
+                                                    # query tmdb with chinese and other language concurrently
+                                                    year_key = (
+                                                        "year"
+                                                        if is_movie
+                                                        else "first_air_date_year"
+                                                    )
+                                                    tmdb_info = tmdb.get_info_from_tmdb_by_candidates(
+                                                        [
+                                                            {
+                                                                "query": cn_match.group(
+                                                                    _g
+                                                                ),
+                                                                year_key: int(year),
+                                                            }
+                                                            for _g in (1, 2)
+                                                        ],
+                                                        year_deviation=movie_year_deviation
+                                                        if is_movie
+                                                        else tv_year_deviation,
+                                                    )
+                                                    tmdb_name = tmdb_info.get(
+                                                        "tmdb_name"
+                                                    )
+                                                    tmdb_id = tmdb_info.get("tmdb_id")
+                                                    is_anime = tmdb_info.get("is_anime")
+                                                    is_documentary = tmdb_info.get(
+                                                        "is_documentary"
+                                                    )
+                                                    is_variety = tmdb_info.get(
+                                                        "is_variety"
+                                                    )
+                                                    is_nc17 = tmdb_info.get("is_nc17")
                                             save_name = (
                                                 f"[{cn_match.group(1)}] {cn_match.group(2)} ({year})"
                                                 if not tmdb_name
@@ -639,6 +637,8 @@ def main(src_dir=""):
                             logger.info(f"{torrent.name} is completed, copying")
 
                             # rslt = subprocess.run(["rclone", "copy", torrent.content_path, f"{google_drive_save_path}"])
+                            # 开启入库确认时, 由 Emby webhook 确认入库后再发送通知
+                            scan_notification = None
                             try:
                                 auto_rclone(
                                     src_path=src_path,
@@ -713,10 +713,11 @@ def main(src_dir=""):
                                     qbt_client.torrents_delete(
                                         delete_files=True, torrent_hashes=torrent.hash
                                     )
-                                send_tg_msg(
-                                    chat_id=TG_CHAT_ID,
-                                    text=f"`{save_name if save_name else torrent.name}` 已入库",
-                                )
+                                inbound_msg = f"`{save_name if save_name else torrent.name}` 已入库"
+                                if EMBY_SCAN_CONFIRM:
+                                    scan_notification = inbound_msg
+                                else:
+                                    send_tg_msg(chat_id=TG_CHAT_ID, text=inbound_msg)
 
                             handle_flag = True
                             dst_base_path = configs.get("local")
@@ -742,6 +743,9 @@ def main(src_dir=""):
                             else:
                                 handle_flag = False
 
+                            if scan_notification and not handle_flag:
+                                send_tg_msg(chat_id=TG_CHAT_ID, text=scan_notification)
+
                             if handle_flag:
                                 try:
                                     logger.info(f"Processing {torrent.name} starts")
@@ -752,6 +756,7 @@ def main(src_dir=""):
                                         offset=offset,
                                         tmdb_id=tmdb_id,
                                         keep_nfo=False,
+                                        scan_notification=scan_notification,
                                     )
                                 # tmdb resource deleted
                                 except TMDbException as e:
@@ -879,6 +884,18 @@ def main(src_dir=""):
         if HANDLE_LOCAL_MEDIA:
             handle_local_media()
 
+        # 安排发送扫描请求，包括其他进程加入队列但尚未发送的，在调度器线程中执行
+        try:
+            schedule_flush()
+        except Exception as e:
+            logger.error(f"Scheduling scan queue flush failed: {e}")
+
+        # 重新扫描超时未确认入库的目录
+        try:
+            retry_unconfirmed_scans()
+        except Exception as e:
+            logger.error(f"Retrying unconfirmed scans failed: {e}")
+
         # check interval
         time.sleep(60)
 
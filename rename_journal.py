@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""重命名操作日志
+
+处理一个资源目录时先把全部计划的操作写入日志 (plan)，每完成一个操作追加一条
+done 记录，全部完成后删除日志。进程中途退出后，再次处理同一目录时只需要重放
+未完成的操作，不需要重新遍历目录或查询 TMDB。
+
+begin 记录中保存本次处理的参数 (媒体类型、tmdb id、目标路径等)，参数不一致时不重放，
+日志移入 archive 目录。失败次数达到 JOURNAL_MAX_FAILURES 的操作被放弃，其源文件记录
+在 abandoned.json 中，之后处理时跳过，日志同样移入 archive 目录；删除对应条目后才会
+重新处理。
+
+日志为 JSON Lines 格式，每次写入后 fsync，最后一行可能因中断而不完整，读取时忽略。
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Iterator, Optional
+
+import filelock
+from log import logger
+
+JOURNAL_DIR = Path(__file__).parent / "journal"
+JOURNAL_ARCHIVE_DIR = JOURNAL_DIR / "archive"
+# 已放弃的操作, {源文件: 目标文件}
+ABANDONED_FILE = JOURNAL_DIR / "abandoned.json"
+
+abandoned_lock = filelock.FileLock("/tmp/rename_journal.abandoned.lock")
+
+# 单个操作最多失败的次数, 之后重放时放弃该操作
+JOURNAL_MAX_FAILURES = 3
+
+
+class RenameJournal:
+    def __init__(self, media_path: str):
+        self.media_path = os.path.normpath(media_path)
+        name = hashlib.md5(self.media_path.encode()).hexdigest()
+        self.path = JOURNAL_DIR / f"{name}.jsonl"
+        # 处理参数, 由 iter_journals 从 begin 记录中读取
+        self.params: Optional[dict] = None
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def _append(self, records: list):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def plan(self, ops: list, params: Optional[dict] = None):
+        """写入本次处理的参数和计划执行的全部操作"""
+        JOURNAL_DIR.mkdir(exist_ok=True)
+        # 残留的旧日志已无意义，重新开始
+        self.path.unlink(missing_ok=True)
+        self._append(
+            [{"type": "begin", "media_path": self.media_path, "params": params}]
+            + [{"type": "plan", "id": i, "op": op} for i, op in enumerate(ops)]
+        )
+
+    def done(self, op_id: int):
+        self._append([{"type": "done", "id": op_id}])
+
+    def fail(self, op_id: int):
+        self._append([{"type": "fail", "id": op_id}])
+
+    def load(self) -> tuple[Optional[dict], list, set, Counter]:
+        """读取日志, 返回 (处理参数, 全部操作, 已完成的操作 id, 各操作的失败次数)"""
+        params, ops, done, failures = None, [], set(), Counter()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 写入时中断的最后一行
+                    logger.warning(f"Ignored broken journal record: {line!r}")
+                    continue
+                if record["type"] == "begin":
+                    params = record.get("params")
+                elif record["type"] == "plan":
+                    ops.append(record["op"])
+                elif record["type"] == "done":
+                    done.add(record["id"])
+                elif record["type"] == "fail":
+                    failures[record["id"]] += 1
+        return params, ops, done, failures
+
+    def close(self):
+        """全部操作完成，删除日志"""
+        self.path.unlink(missing_ok=True)
+
+    def archive(self):
+        """不再重放的日志移入 archive 目录, 便于手动检查"""
+        JOURNAL_ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+        dst = JOURNAL_ARCHIVE_DIR / f"{self.path.stem}.{int(time.time())}.jsonl"
+        os.replace(self.path, dst)
+        logger.info(f"Archived journal of {self.media_path} to {dst}")
+
+
+def load_abandoned() -> dict:
+    """读取已放弃的操作, 返回 {源文件: 目标文件}"""
+    try:
+        with open(ABANDONED_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def abandon(ops: list):
+    """记录放弃的操作, 之后处理时跳过其源文件"""
+    if not ops:
+        return
+    with abandoned_lock:
+        abandoned = load_abandoned()
+        abandoned.update({op["src"]: op["dst"] for op in ops})
+        JOURNAL_DIR.mkdir(exist_ok=True)
+        tmp = ABANDONED_FILE.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(abandoned, f, ensure_ascii=False, indent=4)
+        os.replace(tmp, ABANDONED_FILE)
+    for op in ops:
+        logger.warning(f"Abandoned {op['src']}, recorded in {ABANDONED_FILE}")
+
+
+def iter_journals() -> Iterator[RenameJournal]:
+    """遍历所有未完成的日志"""
+    if not JOURNAL_DIR.exists():
+        return
+    for path in JOURNAL_DIR.glob("*.jsonl"):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                begin = json.loads(f.readline())
+                media_path = begin["media_path"]
+        except (json.JSONDecodeError, KeyError):
+            logger.warning(f"Invalid journal: {path}")
+            continue
+        journal = RenameJournal(media_path)
+        journal.params = begin.get("params")
+        yield journal
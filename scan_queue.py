@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+"""跨进程的媒体库扫描请求聚合队列
+
+各处理流程只负责把需要扫描的目录写入持久化队列，由 flush_scan_queue 按媒体库
+进行防抖：同一媒体库在 SCAN_DEBOUNCE_SECONDS 内没有新目录加入（或最早的目录已等待
+超过 SCAN_MAX_WAIT_SECONDS）时，合并路径后统一发送一次扫描请求。
+"""
+
+import datetime
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+import filelock
+import settings as _cfg
+from log import logger
+from scheduler import Scheduler
+from settings import (
+    CATEGORY_SETTINGS_MAPPING,
+    EMBY_AUTO_SCAN,
+    PLEX_AUTO_SCAN,
+    TG_CHAT_ID,
+)
+from utils import ScanError, send_tg_msg
+
+# 新增配置项，兼容未更新的 settings.py
+SCAN_DEBOUNCE_SECONDS = getattr(_cfg, "SCAN_DEBOUNCE_SECONDS", 180)
+SCAN_MAX_WAIT_SECONDS = getattr(_cfg, "SCAN_MAX_WAIT_SECONDS", 900)
+EMBY_SCAN_CONFIRM = getattr(_cfg, "EMBY_SCAN_CONFIRM", False)
+SCAN_CONFIRM_TIMEOUT = getattr(_cfg, "SCAN_CONFIRM_TIMEOUT", 1800)
+SCAN_CONFIRM_MAX_ATTEMPTS = getattr(_cfg, "SCAN_CONFIRM_MAX_ATTEMPTS", 3)
+SCAN_RETRY_BACKOFF = getattr(_cfg, "SCAN_RETRY_BACKOFF", 60)
+
+# 发送失败后退避的上限 (s)
+SCAN_RETRY_BACKOFF_MAX = 3600
+
+SCAN_QUEUE_DB = Path(__file__).parent / "scan_queue.db"
+FLUSH_JOB_ID = "scan_queue_flush"
+
+flush_lock = filelock.FileLock("/tmp/scan_queue.flush.lock")
+
+# 影视目录，如 "[火线] The Wire (2002) {tmdb-1438}"
+TITLE_FOLDER_RE = re.compile(r"\{tmdb-\d+\}$")
+
+
+def _library_roots() -> set[str]:
+    roots = set()
+    for ranges in CATEGORY_SETTINGS_MAPPING.values():
+        for _, configs in ranges:
+            roots.add(os.path.join(configs.get("mount_point"), configs.get("local")))
+    return roots
+
+
+LIBRARY_ROOTS = _library_roots()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(SCAN_QUEUE_DB, timeout=30)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS scan_queue (
+            path TEXT PRIMARY KEY,
+            library TEXT NOT NULL,
+            plex INTEGER NOT NULL,
+            emby INTEGER NOT NULL,
+            added_at REAL NOT NULL,
+            first_added_at REAL NOT NULL
+        )
+        """
+    )
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(scan_queue)")]
+    # notification: 入库后需要发送的通知; attempts/retry_at: 发送失败的次数和退避到期时间
+    for column, definition in (
+        ("notification", "TEXT"),
+        ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+        ("retry_at", "REAL NOT NULL DEFAULT 0"),
+    ):
+        if column not in columns:
+            with conn:
+                conn.execute(f"ALTER TABLE scan_queue ADD COLUMN {column} {definition}")
+    # 已发送给 Emby、等待 webhook 确认入库的扫描请求
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pending_scans (
+            path TEXT PRIMARY KEY,
+            notification TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL,
+            sent_at REAL NOT NULL,
+            confirmed_at REAL
+        )
+        """
+    )
+    return conn
+
+
+def get_library_root(path: str) -> str:
+    """获取路径所属的媒体库根目录"""
+    matched = [
+        root for root in LIBRARY_ROOTS if path == root or path.startswith(root + "/")
+    ]
+    if matched:
+        return max(matched, key=len)
+    # 未配置的目录，以挂载点下的第一级目录作为媒体库，如 /Media/Music
+    parts = Path(path).parts
+    return str(Path(*parts[:3])) if len(parts) > 3 else os.path.dirname(path)
+
+
+def collapse_scan_folders(paths: Sequence[str]) -> list[str]:
+    """合并扫描路径
+
+    1. 同一影视目录下的多个子目录（如多季）合并为该影视目录
+    2. 去除已被其他路径包含的子路径
+    """
+    groups: dict[str, set] = {}
+    for path in {os.path.normpath(p) for p in paths}:
+        parts = Path(path).parts
+        title_index = next(
+            (i for i, part in enumerate(parts) if TITLE_FOLDER_RE.search(part)), None
+        )
+        key = str(Path(*parts[: title_index + 1])) if title_index is not None else path
+        groups.setdefault(key, set()).add(path)
+    collapsed = {
+        next(iter(_paths)) if len(_paths) == 1 else key
+        for key, _paths in groups.items()
+    }
+    return sorted(
+        path
+        for path in collapsed
+        if not any(str(parent) in collapsed for parent in Path(path).parents)
+    )
+
+
+def _is_covered(path: str, folders: Sequence[str]) -> bool:
+    """path 是否为 folders 中的某个目录或位于其中"""
+    path = Path(os.path.normpath(path))
+    folders = {os.path.normpath(folder) for folder in folders}
+    return str(path) in folders or any(str(p) in folders for p in path.parents)
+
+
+def _schedule_flush(run_date: datetime.datetime, jobstore: str = "default"):
+    scheduler = Scheduler()
+    scheduler.add_job(
+        flush_scan_queue,
+        kwargs={"jobstore": jobstore},
+        trigger="date",
+        run_date=run_date,
+        misfire_grace_time=60,
+        jobstore=jobstore,
+        replace_existing=True,
+        id=FLUSH_JOB_ID,
+    )
+    logger.debug(f"Scheduled scan queue flush: next run at {str(run_date)}")
+
+
+def _next_flush_date(conn: sqlite3.Connection) -> datetime.datetime | None:
+    """根据队列内容计算最早可以发送扫描请求的时间"""
+    rows = conn.execute(
+        """
+        SELECT max(added_at), min(first_added_at), max(retry_at)
+        FROM scan_queue GROUP BY library
+        """
+    ).fetchall()
+    if not rows:
+        return None
+    ready_at = min(
+        max(
+            min(
+                added_at + SCAN_DEBOUNCE_SECONDS,
+                first_added_at + SCAN_MAX_WAIT_SECONDS,
+            ),
+            retry_at,
+        )
+        for added_at, first_added_at, retry_at in rows
+    )
+    # 留出 1s 余量，避免因时间精度导致刚好未到期
+    return datetime.datetime.fromtimestamp(max(ready_at, time.time()) + 1)
+
+
+def enqueue_scan_request(
+    scan_folders: Union[str, Sequence],
+    plex: bool = PLEX_AUTO_SCAN,
+    emby: bool = EMBY_AUTO_SCAN,
+    jobstore: str = "default",
+    schedule: bool = True,
+    notification: Optional[str] = None,
+):
+    """将扫描目录加入队列，并在当前进程中安排一次防抖后的发送
+
+    Args:
+        notification (str): 入库后发送的 TG 通知, 开启 EMBY_SCAN_CONFIRM 时在 Emby
+            确认入库后发送, 否则在发送扫描请求后发送
+    """
+    if not (plex or emby):
+        return
+    if isinstance(scan_folders, str):
+        scan_folders = [scan_folders]
+    now = time.time()
+    conn = _connect()
+    try:
+        with conn:
+            conn.executemany(
+                """
+                INSERT INTO scan_queue
+                    (path, library, plex, emby, added_at, first_added_at, notification)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    plex = max(plex, excluded.plex),
+                    emby = max(emby, excluded.emby),
+                    added_at = excluded.added_at,
+                    notification = coalesce(excluded.notification, notification)
+                """,
+                [
+                    (
+                        path,
+                        get_library_root(path),
+                        int(plex),
+                        int(emby),
+                        now,
+                        now,
+                        notification,
+                    )
+                    for path in {os.path.normpath(p) for p in scan_folders}
+                ],
+            )
+        logger.debug(f"Added scan folders to queue: {scan_folders}")
+        run_date = _next_flush_date(conn)
+    finally:
+        conn.close()
+    if schedule and run_date:
+        _schedule_flush(run_date, jobstore=jobstore)
+
+
+def _track_pending_scans(conn: sqlite3.Connection, paths: Sequence[tuple]):
+    """记录已发送的扫描请求, 等待 Emby webhook 确认"""
+    now = time.time()
+    with conn:
+        conn.executemany(
+            """
+            INSERT INTO pending_scans (path, notification, status, sent_at)
+            VALUES (?, ?, 'pending', ?)
+            ON CONFLICT(path) DO UPDATE SET
+                notification = coalesce(excluded.notification, notification),
+                attempts = CASE WHEN status = 'pending' THEN attempts ELSE 0 END,
+                status = 'pending',
+                sent_at = excluded.sent_at,
+                confirmed_at = NULL
+            """,
+            [(path, notification, now) for path, notification in paths],
+        )
+
+
+def _confirm(conn: sqlite3.Connection, rows: Sequence[tuple]):
+    # 同一次处理的多个目录共用一条通知, 只发送一次
+    notifications = {notification for _, notification in rows if notification}
+    with conn:
+        conn.executemany(
+            "UPDATE pending_scans SET status = 'done', confirmed_at = ? WHERE path = ?",
+            [(time.time(), path) for path, _ in rows],
+        )
+        conn.executemany(
+            "UPDATE pending_scans SET notification = NULL WHERE notification = ?",
+            [(notification,) for notification in notifications],
+        )
+    for path, _ in rows:
+        logger.info(f"Confirmed scan of {path}")
+    for notification in notifications:
+        send_tg_msg(chat_id=TG_CHAT_ID, text=notification)
+
+
+def confirm_scans(item_path: str) -> int:
+    """Emby 新增项目后, 确认该路径相关的扫描请求并发送入库通知, 返回确认的数量
+
+    项目位于扫描目录下, 或扫描目录位于项目 (如剧集目录) 下时都视为匹配
+    """
+    item_path = os.path.normpath(item_path)
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            """
+            SELECT path, notification FROM pending_scans
+            WHERE status = 'pending' AND (
+                path = :path
+                OR substr(:path, 1, length(path) + 1) = path || '/'
+                OR substr(path, 1, length(:path) + 1) = :path || '/'
+            )
+            """,
+            {"path": item_path},
+        ).fetchall()
+        if rows:
+            _confirm(conn, rows)
+    finally:
+        conn.close()
+    return len(rows)
+
+
+def retry_unconfirmed_scans() -> int:
+    """处理超时未确认的扫描请求, 返回重新发送的数量
+
+    先通过 Emby 镜像确认 (可能错过了 webhook), 仍未入库的重新加入扫描队列, 超过
+    最大次数后标记为失败并通知
+    """
+    if not EMBY_SCAN_CONFIRM:
+        return 0
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            """
+            SELECT path, notification, attempts FROM pending_scans
+            WHERE status = 'pending' AND sent_at < ?
+            """,
+            (time.time() - SCAN_CONFIRM_TIMEOUT,),
+        ).fetchall()
+        if not rows:
+            return 0
+        # 按需导入, 避免循环引用
+        from emby_mirror import EmbyMirror
+
+        mirror = EmbyMirror()
+        if mirror.is_synced():
+            try:
+                mirror.sync()
+                confirmed = [
+                    (path, notification)
+                    for path, notification, _ in rows
+                    if mirror.exists(path)
+                ]
+                _confirm(conn, confirmed)
+                rows = [row for row in rows if (row[0], row[1]) not in confirmed]
+            except Exception as e:
+                logger.error(f"Syncing Emby mirror failed: {e}")
+
+        retry = [row for row in rows if row[2] + 1 < SCAN_CONFIRM_MAX_ATTEMPTS]
+        failed = [row for row in rows if row[2] + 1 >= SCAN_CONFIRM_MAX_ATTEMPTS]
+        with conn:
+            conn.executemany(
+                "UPDATE pending_scans SET attempts = attempts + 1 WHERE path = ?",
+                [(row[0],) for row in retry],
+            )
+            conn.executemany(
+                "UPDATE pending_scans SET status = 'failed' WHERE path = ?",
+                [(row[0],) for row in failed],
+            )
+    finally:
+        conn.close()
+    for path, notification, attempts in failed:
+        logger.error(f"Scan of {path} not confirmed after {attempts + 1} attempts")
+        if notification:
+            send_tg_msg(
+                chat_id=TG_CHAT_ID,
+                text=f"`{path}` 扫描后未入库，请检查……",
+            )
+    if retry:
+        logger.warning(f"Retrying unconfirmed scans: {[row[0] for row in retry]}")
+        enqueue_scan_request([row[0] for row in retry], plex=False, emby=True)
+    return len(retry)
+
+
+def pending_scan_count() -> int:
+    conn = _connect()
+    try:
+        return conn.execute("SELECT count(*) FROM scan_queue").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def schedule_flush(jobstore: str = "default"):
+    """按队列内容安排发送, 包括其他进程加入队列但尚未发送的扫描请求
+
+    发送在调度器线程中执行, 不阻塞调用方
+    """
+    conn = _connect()
+    try:
+        run_date = _next_flush_date(conn)
+    finally:
+        conn.close()
+    if run_date:
+        _schedule_flush(run_date, jobstore=jobstore)
+
+
+def _flush_library(
+    conn: sqlite3.Connection, library: str, send_scan_request, force: bool
+) -> int:
+    """发送一个媒体库已到期的扫描请求, 返回发送的路径数量"""
+    rows = conn.execute(
+        """
+        SELECT path, plex, emby, added_at, first_added_at, notification, retry_at
+        FROM scan_queue WHERE library = ?
+        """,
+        (library,),
+    ).fetchall()
+    if not rows:
+        return 0
+    now = time.time()
+    if not force:
+        if now < max(row[6] for row in rows):
+            # 上次发送失败, 退避中
+            return 0
+        last_added_at = max(row[3] for row in rows)
+        first_added_at = min(row[4] for row in rows)
+        if not (
+            now - last_added_at >= SCAN_DEBOUNCE_SECONDS
+            or now - first_added_at >= SCAN_MAX_WAIT_SECONDS
+        ):
+            return 0
+
+    sent = 0
+    # 按需要扫描的服务器分组，每组发送一次
+    targets: dict[tuple, list] = {}
+    for path, plex, emby, added_at, _, notification, _ in rows:
+        targets.setdefault((bool(plex), bool(emby)), []).append(
+            (path, added_at, notification)
+        )
+    for (plex, emby), paths in targets.items():
+        # 发送期间重新加入的路径 (added_at 已变化) 保留在队列中
+        failed = []
+        for server, enabled in (("plex", plex), ("emby", emby)):
+            if not enabled or not paths:
+                continue
+            scan_folders = collapse_scan_folders([path for path, _, _ in paths])
+            logger.info(f"Flushing scan requests of {library}: {scan_folders}")
+            try:
+                # 不在此处等待重试, 失败的请求留在队列中退避后由下次发送
+                send_scan_request(
+                    scan_folders,
+                    plex=server == "plex",
+                    emby=server == "emby",
+                    max_attempts=1,
+                )
+            except ScanError as e:
+                # 只有部分路径失败, 其余路径照常处理
+                _failed = [p for p in paths if _is_covered(p[0], e.paths)]
+                logger.error(
+                    f"Flushing scan requests of {library} failed, retry later: {e}"
+                )
+            except Exception as e:
+                _failed = paths
+                logger.error(
+                    f"Flushing scan requests of {library} failed, retry later: {e}"
+                )
+            else:
+                _failed = []
+            failed += _failed
+            paths = [p for p in paths if p not in _failed]
+            # 已成功的服务器不再重复扫描
+            with conn:
+                conn.executemany(
+                    f"UPDATE scan_queue SET {server} = 0 "
+                    "WHERE path = ? AND added_at = ?",
+                    [(path, added_at) for path, added_at, _ in paths],
+                )
+        if failed:
+            with conn:
+                conn.executemany(
+                    """
+                    UPDATE scan_queue SET
+                        attempts = attempts + 1,
+                        retry_at = :now + min(
+                            :backoff * (1 << min(attempts, 16)), :backoff_max
+                        )
+                    WHERE path = :path AND added_at = :added_at
+                    """,
+                    [
+                        {
+                            "now": time.time(),
+                            "backoff": SCAN_RETRY_BACKOFF,
+                            "backoff_max": SCAN_RETRY_BACKOFF_MAX,
+                            "path": path,
+                            "added_at": added_at,
+                        }
+                        for path, added_at, _ in failed
+                    ],
+                )
+        if not paths:
+            continue
+        sent += len(paths)
+        if emby and EMBY_SCAN_CONFIRM:
+            _track_pending_scans(
+                conn, [(path, notification) for path, _, notification in paths]
+            )
+        with conn:
+            conn.executemany(
+                "DELETE FROM scan_queue WHERE path = ? AND added_at = ?",
+                [(path, added_at) for path, added_at, _ in paths],
+            )
+        if not (emby and EMBY_SCAN_CONFIRM):
+            # 同一次处理的多个目录共用一条通知, 所有目录都已发送扫描请求后只发送一次
+            for notification in {n for _, _, n in paths if n}:
+                if not conn.execute(
+                    "SELECT 1 FROM scan_queue WHERE notification = ? LIMIT 1",
+                    (notification,),
+                ).fetchone():
+                    send_tg_msg(chat_id=TG_CHAT_ID, text=notification)
+    return sent
+
+
+def flush_scan_queue(force: bool = False, jobstore: str = "default") -> int:
+    """发送已到期的扫描请求，返回发送的路径数量
+
+    每个媒体库单独加锁发送, 发送失败的请求留在队列中按指数退避重试, 不影响其他
+    媒体库
+
+    Args:
+        force (bool): 忽略防抖和退避，立即发送队列中所有的扫描请求
+    """
+    # 避免循环引用
+    from media_handle import send_scan_request
+
+    sent = 0
+    conn = _connect()
+    try:
+        libraries = [
+            row[0] for row in conn.execute("SELECT DISTINCT library FROM scan_queue")
+        ]
+        for library in libraries:
+            with flush_lock:
+                sent += _flush_library(conn, library, send_scan_request, force)
+        run_date = None if force else _next_flush_date(conn)
+    finally:
+        conn.close()
+    if run_date:
+        _schedule_flush(run_date, jobstore=jobstore)
+    return sent
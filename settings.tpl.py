@@ -6,6 +6,18 @@ LOG_LEVEL = "INFO"
 
 # TMDB API Key
 TMDB_API_KEY = "xxxxxxxxxxxxxx"
+# TMDB 缓存有效期 (s)，过期后先返回缓存并在后台刷新
+TMDB_CACHE_TTL = 7 * 24 * 3600
+# 近期访问过的缓存在过期前多久由后台任务提前刷新 (s)
+TMDB_CACHE_REFRESH_AHEAD = 24 * 3600
+# TMDB 查询无结果的缓存有效期 (s)，修改种子的 T/Y 标签后立即失效
+TMDB_NEGATIVE_CACHE_TTL = 1800
+# TMDB 每秒请求数上限、并发查询数和请求超时 (s)
+TMDB_RATE_LIMIT = 20
+TMDB_MAX_CONCURRENCY = 4
+TMDB_TIMEOUT = 10
+# 标题模糊匹配的相似度阈值 (0-1)，用于本地缓存匹配和选择搜索结果
+TMDB_FUZZY_MATCH_THRESHOLD = 0.8
 
 # rclone 相关设置
 # 如果重命名失败, 是否需要上传至 GD
@@ -15,6 +27,14 @@ TMDB_API_KEY = "xxxxxxxxxxxxxx"
 RCLONE_ALWAYS_UPLOAD = False
 # rclone rc address
 RC_ADDR = ""
+# rclone mount 的 rc 地址（需以 --rc 启动 mount），用于强制刷新 VFS 目录缓存
+# 挂载点: rc 地址
+RCLONE_MOUNT_RC = {
+    # "/Media": "localhost:5572",
+    # "/Media2": "localhost:5573",
+}
+# 等待挂载点出现新上传目录的最长时间 (s)
+MOUNT_READY_TIMEOUT = 30
 
 
 # qBittorrent 设置
@@ -37,6 +57,8 @@ TG_CHAT_ID = [
 # GD 相关设置
 REMOVE_EMPTY_FOLDER = False
 HANDLE_LOCAL_MEDIA = False
+# 并发处理本地资源的文件夹数量
+HANDLE_LOCAL_MEDIA_WORKERS = 1
 
 # 分类设置
 CATEGORY_SETTINGS_MAPPING = {
@@ -149,9 +171,36 @@ MEDIA_SUFFIX = [
 PLEX_BASE_URL = "https://xxxxxxxxxx"
 PLEX_API_TOKEN = "xxxx"
 PLEX_AUTO_SCAN = True
+# Plex 媒体库目录的缓存时间 (s)，用于确定扫描路径所属的媒体库
+PLEX_SECTION_CACHE_TTL = 3600
 # emby 设置
 EMBY_BASE_URL = "https://xxxxxxxxxx"
 EMBY_API_TOKEN = "xxxx"
 EMBY_AUTO_SCAN = True
+# Emby 请求超时 (s) 和失败重试次数
+EMBY_TIMEOUT = 10
+EMBY_MAX_RETRIES = 3
+# Emby 连续失败多少次后熔断，以及熔断的冷却时间 (s)
+EMBY_CIRCUIT_BREAKER_THRESHOLD = 5
+EMBY_CIRCUIT_BREAKER_COOLDOWN = 60
+# Emby 媒体库目录的缓存时间 (s)，用于确定扫描路径所属的媒体库
+EMBY_LIBRARY_CACHE_TTL = 3600
+# 分页获取 Emby 媒体项目时每页的数量
+EMBY_ITEMS_PAGE_SIZE = 1000
+# 扫描请求防抖: 同一媒体库在该时间 (s) 内没有新目录加入时才发送扫描请求
+SCAN_DEBOUNCE_SECONDS = 180
+# 扫描请求最长等待时间 (s)
+SCAN_MAX_WAIT_SECONDS = 900
+# 扫描请求发送失败后留在队列中，按指数退避重试的初始间隔 (s)
+SCAN_RETRY_BACKOFF = 60
+# 通过 Emby webhook (library.new) 确认扫描结果，确认入库后才发送“已入库”通知
+# 需要在 tg_service 中设置环境变量 EMBY_WEBHOOK_TOKEN，并在 Emby 中添加 webhook:
+#   {tg_service 地址}/emby/webhook?token={EMBY_WEBHOOK_TOKEN}
+EMBY_SCAN_CONFIRM = False
+# 发送扫描请求后多久 (s) 未确认入库则重新扫描，以及最多扫描次数
+SCAN_CONFIRM_TIMEOUT = 1800
+SCAN_CONFIRM_MAX_ATTEMPTS = 3
 # 神医插件 mediainfo 持久化
 EMBY_STRM_ASSISTANT_MEDIAINFO = "/opt/PMS/emby/config/StrmAssistant/MediaInfo"
+# 在后台线程中批量迁移 mediainfo，不阻塞重命名流程
+EMBY_STRM_ASSISTANT_MEDIAINFO_ASYNC = False
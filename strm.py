@@ -67,6 +67,14 @@ def create_strm_file(
             (strm_path / strm_file_name) if not strm_file_path else strm_file_path
         )
 
+        # 内容相同时不再写入
+        try:
+            if strm_file_full_path.read_text(encoding="utf-8") == strm_content:
+                logger.debug(f"{strm_file_full_path} 已存在且内容相同，跳过")
+                return True
+        except (FileNotFoundError, UnicodeDecodeError):
+            pass
+
         # 写入 .strm 文件
         strm_file_full_path.write_text(strm_content, encoding="utf-8")
 
@@ -27,6 +27,8 @@ TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN") or ""
 WEBHOOK_PATH = "/tg/webhook"
 EXTERNAL_BASE_URL = os.environ.get("EXTERNAL_BASE_URL") or ""
 ADMIN_BEARER_TOKEN = os.environ.get("EMBY_ADMIN_TOKEN") or os.environ.get("ADMIN_BEARER_TOKEN") or ""
+# Emby webhook 令牌（通过 ?token= 或 X-Webhook-Token 传递），未配置时不接收 Emby 通知
+EMBY_WEBHOOK_TOKEN = os.environ.get("EMBY_WEBHOOK_TOKEN") or ""
 # 可提供多条可选线路（以英文逗号分隔），例如：AVAILABLE_ROUTES="a.domain.com:emby,b.domain.com:emby"
 AVAILABLE_ROUTES = [s.strip() for s in (os.environ.get("AVAILABLE_ROUTES") or "").split(",") if s.strip()]
 
@@ -423,6 +425,94 @@ async def tg_setup():
     return {"ok": True, "webhook_url": webhook_url}
 
 
+# ---- Emby webhook：确认扫描结果 ----
+EMBY_WEBHOOK_PATH = "/emby/webhook"
+EMBY_WEBHOOK_EVENTS = {"library.new", "item.added"}
+_emby_events: asyncio.Queue | None = None
+
+
+def _handle_emby_item(item: dict):
+    """确认新增项目对应的扫描请求，并写入 Emby 镜像"""
+    from emby_mirror import EmbyMirror
+    from scan_queue import confirm_scans
+
+    path = item.get("Path")
+    if path:
+        confirmed = confirm_scans(path)
+        logger.info("Emby item added: %s, confirmed %s scans", path, confirmed)
+    try:
+        EmbyMirror().upsert_item(item)
+    except Exception as e:
+        logger.warning("update emby mirror failed: %s", e)
+
+
+async def _emby_event_worker():
+    while True:
+        item = await _emby_events.get()
+        try:
+            await asyncio.to_thread(_handle_emby_item, item)
+        except Exception as e:
+            logger.error("handle emby event failed: %s", e)
+        finally:
+            _emby_events.task_done()
+
+
+@app.on_event("startup")
+async def _startup_emby_webhook_worker():
+    global _emby_events
+    if not EMBY_WEBHOOK_TOKEN:
+        return
+    _emby_events = asyncio.Queue(maxsize=1000)
+    # 保留任务引用, 避免被垃圾回收; 任务异常退出时记录日志
+    task = asyncio.create_task(_emby_event_worker(), name="emby-webhook-worker")
+    task.add_done_callback(_on_emby_event_worker_done)
+    app.state.emby_event_worker = task
+
+
+def _on_emby_event_worker_done(task: asyncio.Task):
+    if task.cancelled():
+        return
+    if task.exception():
+        logger.error("emby webhook worker exited: %r", task.exception())
+
+
+@app.on_event("shutdown")
+async def _shutdown_emby_webhook_worker():
+    task = getattr(app.state, "emby_event_worker", None)
+    if task is None:
+        return
+    task.cancel()
+    # 已异常退出的任务由 done callback 记录, 这里不再抛出
+    await asyncio.gather(task, return_exceptions=True)
+
+
+@app.post(EMBY_WEBHOOK_PATH)
+async def emby_webhook(request: Request):
+    if not EMBY_WEBHOOK_TOKEN or _emby_events is None:
+        raise HTTPException(404, "Emby webhook 未启用")
+    token = request.query_params.get("token") or request.headers.get("X-Webhook-Token") or ""
+    if not hmac.compare_digest(token, EMBY_WEBHOOK_TOKEN):
+        raise HTTPException(401, "Unauthorized")
+    # Emby 按设置发送 JSON 或 multipart 表单（data 字段为 JSON）
+    try:
+        if (request.headers.get("content-type") or "").startswith("application/json"):
+            data = await request.json()
+        else:
+            form = await request.form()
+            data = json.loads(form.get("data") or "{}")
+    except Exception as e:
+        raise HTTPException(400, f"Invalid payload: {e}")
+    event = data.get("Event") or ""
+    if event not in EMBY_WEBHOOK_EVENTS:
+        return {"ok": True, "ignored": event}
+    item = data.get("Item") or {}
+    try:
+        _emby_events.put_nowait(item)
+    except asyncio.QueueFull:
+        raise HTTPException(503, "Emby 事件队列已满")
+    return {"ok": True}
+
+
 def verify_webapp_initdata(init_data: str) -> dict:
     # 解析查询字符串，提取 hash
     params = dict(parse_qsl(init_data, keep_blank_values=True))
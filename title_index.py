@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""由 TMDB 每日 ID 导出文件建立的本地标题索引
+
+导出文件 (https://files.tmdb.org/p/exports/movie_ids_MM_DD_YYYY.json.gz、
+tv_series_ids_MM_DD_YYYY.json.gz) 每行为一个 JSON，包含 id、原始标题和热度，
+没有年份和翻译标题。查询时按规范化后的原始标题匹配，年份需要通过详情确认。
+
+用法:
+    python title_index.py movie_ids_05_01_2024.json.gz tv_series_ids_05_01_2024.json.gz
+"""
+
+import gzip
+import json
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from pathlib import Path
+
+from log import logger
+
+TITLE_INDEX_DB = Path(__file__).parent / "tmdb_title_index.db"
+
+# 导出文件名前缀对应的媒体类型
+EXPORT_MEDIA_TYPES = {"movie_ids": "movie", "tv_series_ids": "tv"}
+
+
+def normalize_title(title: str) -> str:
+    """规范化标题: 统一全半角和大小写, 去除标点, 合并空白"""
+    title = unicodedata.normalize("NFKC", title).casefold()
+    title = re.sub(r"[^\w]+", " ", title)
+    return " ".join(title.split())
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(TITLE_INDEX_DB, timeout=30)
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS title_index (
+            media_type TEXT NOT NULL,
+            tmdb_id INTEGER NOT NULL,
+            original_title TEXT NOT NULL,
+            normalized_title TEXT NOT NULL,
+            popularity REAL NOT NULL,
+            PRIMARY KEY (media_type, tmdb_id)
+        );
+        CREATE INDEX IF NOT EXISTS title_index_normalized_title
+            ON title_index (media_type, normalized_title);
+        CREATE TABLE IF NOT EXISTS title_index_imports (
+            media_type TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            imported_at REAL NOT NULL
+        );
+        """
+    )
+    return conn
+
+
+def get_export_media_type(path: str) -> str:
+    name = os.path.basename(path)
+    for prefix, media_type in EXPORT_MEDIA_TYPES.items():
+        if name.startswith(prefix):
+            return media_type
+    raise ValueError(f"Unknown TMDB export file: {name}")
+
+
+def _iter_export(path: str, media_type: str):
+    title_key = "original_title" if media_type == "movie" else "original_name"
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # 成人内容不参与匹配
+            if item.get("adult"):
+                continue
+            title = item.get(title_key)
+            normalized_title = normalize_title(title or "")
+            if not normalized_title:
+                continue
+            yield (
+                media_type,
+                item["id"],
+                title,
+                normalized_title,
+                item.get("popularity") or 0,
+            )
+
+
+def import_export(path: str, media_type: str = None) -> int:
+    """导入导出文件, 替换该媒体类型已有的索引, 返回导入的条目数量"""
+    media_type = media_type or get_export_media_type(path)
+    logger.info(f"Importing {path} into title index ({media_type})")
+    count = 0
+    batch = []
+    conn = _connect()
+    try:
+        # 在同一个事务中替换, 导入期间查询仍使用旧的索引
+        with conn:
+            conn.execute("DELETE FROM title_index WHERE media_type = ?", (media_type,))
+            for row in _iter_export(path, media_type):
+                batch.append(row)
+                if len(batch) >= 10000:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO title_index VALUES (?, ?, ?, ?, ?)",
+                        batch,
+                    )
+                    count += len(batch)
+                    batch = []
+            conn.executemany(
+                "INSERT OR REPLACE INTO title_index VALUES (?, ?, ?, ?, ?)", batch
+            )
+            count += len(batch)
+            conn.execute(
+                "INSERT OR REPLACE INTO title_index_imports VALUES (?, ?, ?)",
+                (media_type, os.path.basename(path), time.time()),
+            )
+    finally:
+        conn.close()
+    logger.info(f"Imported {count} titles from {path}")
+    return count
+
+
+def lookup_title(media_type: str, title: str, limit: int = 10) -> list:
+    """按原始标题查找, 返回按热度排序的 [(tmdb_id, original_title, popularity), ...]"""
+    if not TITLE_INDEX_DB.exists():
+        return []
+    conn = _connect()
+    try:
+        return conn.execute(
+            """
+            SELECT tmdb_id, original_title, popularity FROM title_index
+            WHERE media_type = ? AND normalized_title = ?
+            ORDER BY popularity DESC LIMIT ?
+            """,
+            (media_type, normalize_title(title), limit),
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import TMDB daily ID exports")
+    parser.add_argument("path", nargs="+", help="Gzipped TMDB ID export files")
+    parser.add_argument(
+        "-t",
+        "--media_type",
+        choices=["movie", "tv"],
+        default=None,
+        help="Media type, detected from the file name by default",
+    )
+    args = parser.parse_args()
+    for _path in args.path:
+        import_export(_path, media_type=args.media_type)
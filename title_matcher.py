@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""基于三元组 (trigram) 的本地模糊标题匹配
+
+索引 TMDB 缓存中所有条目的标题和别名 (tmdb_name 中的 `[中文] Original (Year)`、
+title)，在内存中按三元组建立倒排索引，近似查询可在本地亚毫秒级完成并返回相似度。
+"""
+
+import re
+import threading
+from collections import Counter, defaultdict
+
+from title_index import normalize_title
+
+# tmdb_name 格式: [中文标题] 原始标题 (年份) {tmdb-id}, 中文标题可能不存在
+TMDB_NAME_PATTERN = re.compile(
+    r"^(?:\[(?P<title>.+?)\] )?(?P<original_title>.+) \((?P<year>\d{4})\) "
+    r"\{tmdb-(?P<tmdb_id>\d+)\}$"
+)
+
+
+def trigrams(title: str) -> set:
+    """规范化后的标题两端补空格再切分, 短标题 (如两个汉字) 也有三元组"""
+    title = normalize_title(title)
+    if not title:
+        return set()
+    padded = f"  {title} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a: str, b: str) -> float:
+    """两个标题三元组集合的 Dice 系数, 范围 [0, 1]"""
+    a, b = trigrams(a), trigrams(b)
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def parse_tmdb_name(tmdb_name: str) -> dict:
+    """解析 tmdb_name, 不符合格式时返回空字典"""
+    # 写入缓存时 "/" 被替换为全角
+    match = TMDB_NAME_PATTERN.match(tmdb_name.replace("／", "/"))
+    return match.groupdict() if match else {}
+
+
+class TitleMatcher:
+    """标题三元组倒排索引, 线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (media_type, tmdb_id) -> year
+        self._years = {}
+        # 别名列表: (media_type, tmdb_id, 三元组数量)
+        self._aliases = []
+        # 已索引的别名, 避免重复
+        self._alias_ids = {}
+        # 三元组 -> 别名序号列表
+        self._postings = defaultdict(list)
+
+    def __len__(self):
+        return len(self._years)
+
+    def add(self, media_type: str, tmdb_id: str, info: dict):
+        """索引缓存条目的 title 和 tmdb_name 中的中文标题、原始标题"""
+        parsed = parse_tmdb_name(info.get("tmdb_name", ""))
+        titles = {info.get("title"), parsed.get("title"), parsed.get("original_title")}
+        entry = (media_type, str(tmdb_id))
+        with self._lock:
+            self._years[entry] = info.get("year") or parsed.get("year")
+            for title in titles:
+                grams = trigrams(title or "")
+                if not grams or (entry, frozenset(grams)) in self._alias_ids:
+                    continue
+                alias_id = len(self._aliases)
+                self._alias_ids[(entry, frozenset(grams))] = alias_id
+                self._aliases.append((media_type, str(tmdb_id), len(grams)))
+                for gram in grams:
+                    self._postings[gram].append(alias_id)
+
+    def match(
+        self,
+        media_type: str,
+        query: str,
+        year=None,
+        year_deviation: int = 0,
+        threshold: float = 0.5,
+        limit: int = 5,
+    ) -> list:
+        """近似查询, 返回按相似度排序的 [(tmdb_id, score), ...]
+
+        指定 year 时只返回年份在 [year - year_deviation, year] 内的条目
+        """
+        grams = trigrams(query)
+        if not grams:
+            return []
+        with self._lock:
+            shared = Counter()
+            for gram in grams:
+                shared.update(self._postings.get(gram, ()))
+            scores = {}
+            for alias_id, count in shared.items():
+                alias_media_type, tmdb_id, size = self._aliases[alias_id]
+                if alias_media_type != media_type:
+                    continue
+                score = 2 * count / (len(grams) + size)
+                if score < threshold or score <= scores.get(tmdb_id, 0):
+                    continue
+                if year is not None:
+                    entry_year = self._years.get((media_type, tmdb_id))
+                    if not str(entry_year).isdigit() or not (
+                        int(year) - year_deviation <= int(entry_year) <= int(year)
+                    ):
+                        continue
+                scores[tmdb_id] = score
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
@@ -1,19 +1,57 @@
 #!/usr/local/bin/env python
 
 import datetime
+import json
 import pickle
+import sqlite3
+import threading
+import time
+from functools import partial
 from pathlib import Path
 
 import filelock
+import settings as _cfg
 from log import logger
+from scheduler import Scheduler
 from settings import LOG_LEVEL, TMDB_API_KEY
+from title_index import lookup_title
+from title_matcher import TitleMatcher, similarity
+from tmdb_client import first_match, session, singleflight
 from tmdbv3api import TV, Movie, Search, TMDb
 from utils import is_filename_length_gt_255
 
+# 新增配置项，兼容未更新的 settings.py
+TMDB_CACHE_TTL = getattr(_cfg, "TMDB_CACHE_TTL", 7 * 24 * 3600)
+TMDB_CACHE_REFRESH_AHEAD = getattr(_cfg, "TMDB_CACHE_REFRESH_AHEAD", 24 * 3600)
+TMDB_NEGATIVE_CACHE_TTL = getattr(_cfg, "TMDB_NEGATIVE_CACHE_TTL", 1800)
+TMDB_FUZZY_MATCH_THRESHOLD = getattr(_cfg, "TMDB_FUZZY_MATCH_THRESHOLD", 0.8)
+
+# 本地标题索引中同名条目超过该数量时不使用索引
+TITLE_INDEX_MAX_CANDIDATES = 3
+# 无法通过年份和标题区分时, 最热门的候选至少要比次热门的高出该倍数才采用
+TITLE_INDEX_POPULARITY_RATIO = 5
+# 本地模糊匹配时, 最佳候选的相似度至少要比次佳候选高出该值
+FUZZY_MATCH_MARGIN = 0.1
+# 模糊匹配索引从缓存数据库同步其他进程写入的条目的间隔 (s)
+FUZZY_MATCH_SYNC_INTERVAL = 60
+# 后台刷新即将过期的缓存的间隔 (s)
+REVALIDATE_INTERVAL = 600
+REVALIDATE_JOB_ID = "tmdb_revalidate_cache"
+
 
 class TMDB:
+    # 旧的 pickle 缓存, 仅用于迁移
     cache: Path = Path(__file__).parent / "tmdb_info.cache"
+    cache_db: Path = Path(__file__).parent / "tmdb_info.db"
     cache_lock = filelock.FileLock("/tmp/tmdb_info.cache.lock")
+    _cache_ready = False
+    # 正在后台刷新的缓存
+    _refreshing: set = set()
+    _refreshing_lock = threading.Lock()
+    # 缓存条目的模糊匹配索引, 首次使用时建立
+    _title_matcher = None
+    _title_matcher_lock = threading.Lock()
+    _title_matcher_synced = (0, 0)
 
     def __init__(
         self,
@@ -22,69 +60,443 @@ class TMDB:
         movie: bool = False,
         log_level: str = LOG_LEVEL,
     ) -> None:
-        self.tmdb = TMDb()
+        self.tmdb = TMDb(session=session)
         self.tmdb.api_key = api_key
         self.tmdb.language = language
+        # 使用共享的连接池发送请求, 结果由 tmdb_info.db 缓存
+        self.tmdb.cache = False
+        self.language = language
         if log_level == "DEBUG":
             self.tmdb.debug = True
         self.is_movie = movie
-        self.tmdb_search = Search()
+        self.tmdb_search = Search(session=session)
         if self.is_movie:
-            self.tmdb_media = Movie()
+            self.tmdb_media = Movie(session=session)
         else:
-            self.tmdb_media = TV()
+            self.tmdb_media = TV(session=session)
         self.tmdb_id = None
 
     @classmethod
-    def _read_cache(cls):
-        """Read cache from file"""
-        with cls.cache_lock:
-            if cls.cache.exists():
-                with open(cls.cache, "rb") as f:
-                    return pickle.load(f)
+    def _connect(cls) -> sqlite3.Connection:
+        """连接缓存数据库, WAL 模式下多个进程可以同时读取"""
+        conn = sqlite3.connect(cls.cache_db, timeout=30)
+        if not cls._cache_ready:
+            with cls.cache_lock:
+                cls._init_cache(conn)
+            cls._cache_ready = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @classmethod
+    def _init_cache(cls, conn: sqlite3.Connection):
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tmdb_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                accessed_at REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(tmdb_cache)")]
+        if "accessed_at" not in columns:
+            with conn:
+                conn.execute(
+                    "ALTER TABLE tmdb_cache ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0"
+                )
+        cls._migrate_pickle_cache(conn)
+        cls._migrate_legacy_keys(conn)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS tmdb_cache_updated_at ON tmdb_cache (updated_at)"
+        )
+        # 查询无结果的缓存
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tmdb_negative_cache (
+                media_type TEXT NOT NULL,
+                query TEXT NOT NULL,
+                year TEXT NOT NULL,
+                language TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (media_type, query, year, language)
+            )
+            """
+        )
+
+    @classmethod
+    def _migrate_pickle_cache(cls, conn: sqlite3.Connection):
+        """将旧的 pickle 缓存导入数据库, 完成后重命名旧文件"""
+        if not cls.cache.exists():
+            return
+        with open(cls.cache, "rb") as f:
+            cache = pickle.load(f)
+        updated_at = cls.cache.stat().st_mtime
+        with conn:
+            # 不覆盖数据库中已有的条目
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO tmdb_cache (key, value, updated_at)
+                VALUES (?, ?, ?)
+                """,
+                [
+                    (str(key), json.dumps(value, ensure_ascii=False), updated_at)
+                    for key, value in cache.items()
+                ],
+            )
+        cls.cache.rename(cls.cache.with_suffix(".cache.migrated"))
+        logger.info(f"Migrated {len(cache)} entries from {cls.cache}")
+
+    @classmethod
+    def _migrate_legacy_keys(cls, conn: sqlite3.Connection):
+        """将只以 tmdb id 为键的旧缓存改写为 {movie|tv}:{tmdb_id}:zh
+
+        旧缓存均为默认语言 zh。能从内容判断类型的 (电影才有 NC17, 剧集才有动漫、
+        纪录片、综艺分类) 保留更新时间; 无法判断的直接丢弃, 下次查询时按对应类型
+        重新获取, 避免电影查询读到同 id 剧集的信息
+        """
+        rows = conn.execute(
+            "SELECT key, value, updated_at FROM tmdb_cache WHERE key NOT LIKE '%:%'"
+        ).fetchall()
+        if not rows:
+            return
+        migrated = []
+        for key, value, updated_at in rows:
+            info = json.loads(value)
+            if not isinstance(info, dict):
+                continue
+            if info.get("is_nc17"):
+                media_type = "movie"
+            elif any(
+                info.get(flag) for flag in ("is_anime", "is_documentary", "is_variety")
+            ):
+                media_type = "tv"
             else:
-                return {}
+                continue
+            migrated.append((f"{media_type}:{key}:zh", value, updated_at))
+        with conn:
+            # 不覆盖已有的新格式条目
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO tmdb_cache (key, value, updated_at)
+                VALUES (?, ?, ?)
+                """,
+                migrated,
+            )
+            conn.execute("DELETE FROM tmdb_cache WHERE key NOT LIKE '%:%'")
+        logger.info(
+            f"Migrated {len(migrated)} of {len(rows)} cache entries keyed by tmdb id "
+            "only, dropped the rest whose media type is unknown"
+        )
+
+    def cache_key(self, tmdb_id) -> str:
+        """缓存键: {movie|tv}:{tmdb_id}:{language}, 电影和剧集的 id 会重复"""
+        return f"{'movie' if self.is_movie else 'tv'}:{tmdb_id}:{self.language}"
 
     @classmethod
-    def _write_cache(cls, cache: dict):
-        """Write cache to file"""
-        with cls.cache_lock:
-            with open(cls.cache, "wb") as f:
-                pickle.dump(cache, f)
+    def get_cache_entry(cls, key, touch: bool = True) -> tuple:
+        """Get cache and its update time by key
+
+        touch 为 False 时不更新访问时间, 用于不代表实际使用的读取
+        """
+        now = time.time()
+        conn = cls._connect()
+        try:
+            row = conn.execute(
+                "SELECT value, updated_at, accessed_at FROM tmdb_cache WHERE key = ?",
+                (str(key),),
+            ).fetchone()
+            # 记录访问时间, 用于判断是否需要提前刷新; 降低精度以减少写入
+            if touch and row and now - row[2] > 3600:
+                with conn:
+                    conn.execute(
+                        "UPDATE tmdb_cache SET accessed_at = ? WHERE key = ?",
+                        (now, str(key)),
+                    )
+        finally:
+            conn.close()
+        if row:
+            logger.info(f"Cache hit for {key}")
+            return json.loads(row[0]), row[1]
+        logger.info(f"No cache found for {key}")
+        return None, None
 
     @classmethod
     def get_cache_by_key(cls, key):
         """Get cache by key"""
-        cache = cls._read_cache()
-        if key in cache:
-            logger.info(f"Cache hit for {key}")
-            return cache[key]
-        logger.info(f"No cache found for {key}")
+        return cls.get_cache_entry(key)[0]
+
+    @classmethod
+    def peek_cache_by_key(cls, key):
+        """Get cache by key without updating its access time"""
+        return cls.get_cache_entry(key, touch=False)[0]
 
     @classmethod
     def write_cache_by_key(cls, key, value):
         """Write cache by key"""
-        cache = cls._read_cache()
-        if key in cache:
-            logger.info(f"Cache updated for {key}")
-        else:
-            logger.info(f"Cache added for {key}")
-        cache[key] = value
-        cls._write_cache(cache)
+        now = time.time()
+        conn = cls._connect()
+        try:
+            with conn:
+                conn.execute(
+                    """
+                    INSERT INTO tmdb_cache (key, value, updated_at, accessed_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        value = excluded.value, updated_at = excluded.updated_at
+                    """,
+                    (str(key), json.dumps(value, ensure_ascii=False), now, now),
+                )
+        finally:
+            conn.close()
+        logger.info(f"Cache written for {key}")
+        if cls._title_matcher is not None:
+            cls._add_to_title_matcher(cls._title_matcher, key, value)
+
+    @classmethod
+    def get_cached_keys(cls, prefix: str = "") -> set:
+        """获取以 prefix 开头的缓存键"""
+        conn = cls._connect()
+        try:
+            rows = conn.execute(
+                "SELECT key FROM tmdb_cache WHERE substr(key, 1, ?) = ?",
+                (len(prefix), prefix),
+            ).fetchall()
+        finally:
+            conn.close()
+        return {row[0] for row in rows}
 
     @classmethod
     def delete_cache_by_key(cls, key):
         """Delete cache by key"""
-        cache = cls._read_cache()
-        if key in cache:
-            del cache[key]
-            cls._write_cache(cache)
+        conn = cls._connect()
+        try:
+            with conn:
+                deleted = conn.execute(
+                    "DELETE FROM tmdb_cache WHERE key = ?", (str(key),)
+                ).rowcount
+        finally:
+            conn.close()
+        if deleted:
             logger.info(f"Cache deleted for {key}")
         else:
             logger.info(f"No cache found for {key}")
 
-    def get_info_from_tmdb(self, query_dict: dict, year_deviation: int = 0) -> tuple:
-        """Get TV/Movie name from tmdb"""
+    @staticmethod
+    def _add_to_title_matcher(matcher: TitleMatcher, key, value):
+        media_type, tmdb_id = str(key).split(":")[:2]
+        if isinstance(value, dict):
+            matcher.add(media_type, tmdb_id, value)
+
+    @classmethod
+    def get_title_matcher(cls) -> TitleMatcher:
+        """获取缓存条目的模糊匹配索引, 定期同步其他进程写入的条目"""
+        with cls._title_matcher_lock:
+            synced_at, checked_at = cls._title_matcher_synced
+            if cls._title_matcher is not None and (
+                time.time() - checked_at < FUZZY_MATCH_SYNC_INTERVAL
+            ):
+                return cls._title_matcher
+            matcher = cls._title_matcher or TitleMatcher()
+            checked_at = time.time()
+            conn = cls._connect()
+            try:
+                rows = conn.execute(
+                    "SELECT key, value, updated_at FROM tmdb_cache WHERE updated_at > ?",
+                    (synced_at,),
+                ).fetchall()
+            finally:
+                conn.close()
+            for key, value, updated_at in rows:
+                cls._add_to_title_matcher(matcher, key, json.loads(value))
+                synced_at = max(synced_at, updated_at)
+            if cls._title_matcher is None:
+                logger.info(f"Built title matcher with {len(matcher)} entries")
+            cls._title_matcher = matcher
+            cls._title_matcher_synced = (synced_at, checked_at)
+            return matcher
+
+    def _negative_cache_key(self, query, year, year_deviation=0) -> tuple:
+        # 允许年份偏差时搜索的是一个年份范围, 如 2019-2021
+        if year_deviation and str(year).isdigit():
+            year = f"{int(year) - year_deviation}-{year}"
+        return ("movie" if self.is_movie else "tv", query, year, self.language)
+
+    def is_negative_cached(self, query, year, year_deviation=0) -> bool:
+        """查询是否在有效期内无结果, 命中时增加命中次数"""
+        key = self._negative_cache_key(query, year, year_deviation)
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                """
+                SELECT hits FROM tmdb_negative_cache
+                WHERE media_type = ? AND query = ? AND year = ? AND language = ?
+                    AND created_at > ?
+                """,
+                (*key, time.time() - TMDB_NEGATIVE_CACHE_TTL),
+            ).fetchone()
+            if row:
+                with conn:
+                    conn.execute(
+                        """
+                        UPDATE tmdb_negative_cache SET hits = hits + 1
+                        WHERE media_type = ? AND query = ? AND year = ? AND language = ?
+                        """,
+                        key,
+                    )
+        finally:
+            conn.close()
+        if row:
+            logger.info(f"Negative cache hit for {key} ({row[0] + 1} hits)")
+        return bool(row)
+
+    def write_negative_cache(self, query, year, year_deviation=0):
+        """记录无结果的查询"""
+        key = self._negative_cache_key(query, year, year_deviation)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    """
+                    INSERT INTO tmdb_negative_cache VALUES (?, ?, ?, ?, ?, 0)
+                    ON CONFLICT DO UPDATE SET created_at = excluded.created_at
+                    """,
+                    (*key, time.time()),
+                )
+        finally:
+            conn.close()
+        logger.info(f"Negative cache written for {key}")
+
+    @classmethod
+    def invalidate_negative_cache(cls, query: str = None) -> int:
+        """删除无结果查询的缓存, 不指定 query 时全部删除"""
+        conn = cls._connect()
+        try:
+            with conn:
+                if query is None:
+                    deleted = conn.execute("DELETE FROM tmdb_negative_cache").rowcount
+                else:
+                    deleted = conn.execute(
+                        "DELETE FROM tmdb_negative_cache WHERE query = ?", (query,)
+                    ).rowcount
+        finally:
+            conn.close()
+        if deleted:
+            logger.info(f"Negative cache invalidated: {deleted} entries")
+        return deleted
+
+    @classmethod
+    def get_negative_cache_stats(cls) -> list:
+        """获取有效期内的无结果查询及其命中次数"""
+        conn = cls._connect()
+        try:
+            rows = conn.execute(
+                """
+                SELECT media_type, query, year, language, created_at, hits
+                FROM tmdb_negative_cache WHERE created_at > ?
+                ORDER BY hits DESC
+                """,
+                (time.time() - TMDB_NEGATIVE_CACHE_TTL,),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            dict(
+                zip(
+                    ("media_type", "query", "year", "language", "created_at", "hits"),
+                    row,
+                )
+            )
+            for row in rows
+        ]
+
+    @classmethod
+    def refresh_cache(cls, is_movie: bool, language: str, tmdb_id: str) -> dict:
+        """从 TMDB 重新获取并更新缓存"""
+        tmdb = cls(movie=is_movie, language=language)
+        tmdb.tmdb_id = str(tmdb_id)
+        key = tmdb.cache_key(tmdb_id)
+        with singleflight(key):
+            # 可能已由其他进程刷新
+            info, updated_at = cls.get_cache_entry(key)
+            if info and time.time() - updated_at < (
+                TMDB_CACHE_TTL - TMDB_CACHE_REFRESH_AHEAD
+            ):
+                return info
+            info = tmdb._get_info_from_tmdb_by_id()
+            cls.write_cache_by_key(key, info)
+        return info
+
+    def refresh_in_background(self, tmdb_id: str):
+        """在后台线程中刷新缓存, 同一条缓存同时只刷新一次"""
+        key = self.cache_key(tmdb_id)
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def _refresh():
+            try:
+                self.refresh_cache(self.is_movie, self.language, tmdb_id)
+            except Exception as e:
+                logger.error(f"Refreshing cache for {key} failed: {e}")
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(key)
+
+        logger.info(f"Cache expired for {key}, refreshing in background")
+        threading.Thread(target=_refresh, daemon=True).start()
+
+    @classmethod
+    def revalidate_cache(cls, limit: int = 50) -> int:
+        """刷新即将过期且近期被访问过的缓存, 返回刷新的数量"""
+        now = time.time()
+        conn = cls._connect()
+        try:
+            rows = conn.execute(
+                """
+                SELECT key FROM tmdb_cache
+                WHERE updated_at < ? AND accessed_at > ?
+                ORDER BY updated_at LIMIT ?
+                """,
+                (
+                    now - TMDB_CACHE_TTL + TMDB_CACHE_REFRESH_AHEAD,
+                    now - TMDB_CACHE_TTL,
+                    limit,
+                ),
+            ).fetchall()
+        finally:
+            conn.close()
+        refreshed = 0
+        for (key,) in rows:
+            media_type, tmdb_id, language = key.split(":", 2)
+            try:
+                cls.refresh_cache(media_type == "movie", language, tmdb_id)
+            except Exception as e:
+                logger.error(f"Revalidating cache for {key} failed: {e}")
+                continue
+            refreshed += 1
+        return refreshed
+
+    @classmethod
+    def schedule_revalidate_cache(cls, jobstore: str = "default"):
+        """在调度器线程中定期刷新即将过期的缓存, 同时只运行一个, 不阻塞调用方"""
+        Scheduler().add_job(
+            cls.revalidate_cache,
+            trigger="interval",
+            seconds=REVALIDATE_INTERVAL,
+            max_instances=1,
+            coalesce=True,
+            jobstore=jobstore,
+            replace_existing=True,
+            id=REVALIDATE_JOB_ID,
+        )
+        logger.debug(f"Scheduled TMDB cache revalidation every {REVALIDATE_INTERVAL}s")
+
+    def search_tmdb_id(self, query_dict: dict, year_deviation: int = 0):
+        """Search tmdb id of TV/Movie"""
 
         search_func = (
             self.tmdb_search.movies if self.is_movie else self.tmdb_search.tv_shows
@@ -96,6 +508,16 @@ class TMDB:
             if self.is_movie
             else query_dict.get("first_air_date_year", datetime.date.today().year)
         )
+        # 优先使用本地标题索引和已缓存的条目, 确认后不再搜索
+        tmdb_id = self._search_title_index(
+            query_title, query_year, year_deviation
+        ) or self._match_cached_title(query_title, query_year, year_deviation)
+        if tmdb_id:
+            return tmdb_id
+        # 下面的搜索会修改年份和偏差, 无结果缓存使用原始参数
+        negative_cache_key = (query_title, query_year, year_deviation)
+        if self.is_negative_cached(*negative_cache_key):
+            return None
         retry = 0
         while retry < 3:
             try:
@@ -123,37 +545,185 @@ class TMDB:
                             )
                             logger.debug(f"{rslt=}")
                             if query_title in [title, original_title] or len(res) == 1:
-                                self.tmdb_id = str(rslt.id)
+                                tmdb_id = str(rslt.id)
 
-                                logger.info(
-                                    f"Got tmdb_id for {query_title}: {self.tmdb_id}"
-                                )
+                                logger.info(f"Got tmdb_id for {query_title}: {tmdb_id}")
                                 break
+                        else:
+                            # 没有完全一致的结果时, 采用相似度最高且达到阈值的结果
+                            tmdb_id = self._best_fuzzy_result(query_title, res)
                         break
                 break
             except Exception as e:
                 logger.exception(e)
                 retry += 1
                 continue
-        if self.tmdb_id is None:
+        if tmdb_id is None:
             logger.error(f"Failed to get tmdb_id for {query_title}")
+            # 请求出错时不记录, 下次重新查询
+            if retry < 3:
+                self.write_negative_cache(*negative_cache_key)
+        return tmdb_id
+
+    def _search_title_index(self, query_title, query_year, year_deviation=0):
+        """从本地标题索引中查找, 在本地选出唯一的候选后再通过详情确认年份
+
+        导出文件中没有年份, 候选的年份只使用已缓存的详情; 没有缓存年份时按热度选择,
+        只有明显比其他候选更热门时才采用。最多只为选出的候选请求一次详情
+        """
+        if not str(query_year).isdigit():
+            return None
+        candidates = lookup_title(
+            "movie" if self.is_movie else "tv",
+            query_title,
+            limit=TITLE_INDEX_MAX_CANDIDATES + 1,
+        )
+        # 同名条目过多时交由 TMDB 搜索
+        if not candidates or len(candidates) > TITLE_INDEX_MAX_CANDIDATES:
+            return None
+
+        def year_matches(year) -> bool:
+            return str(year).isdigit() and (
+                int(query_year) - year_deviation <= int(year) <= int(query_year)
+            )
+
+        # (tmdb_id, 缓存中的年份, 原始标题是否完全一致, 热度)
+        scored = []
+        for tmdb_id, original_title, popularity in candidates:
+            # 只是比较候选, 不更新访问时间, 避免后台刷新未被使用的条目
+            cached = self.peek_cache_by_key(self.cache_key(tmdb_id)) or {}
+            year = cached.get("year")
+            if year and not year_matches(year):
+                continue
+            scored.append(
+                (str(tmdb_id), year, original_title == query_title, popularity)
+            )
+        if not scored:
+            return None
+
+        # 年份已确认的优先, 其次是原始标题完全一致的, 最后按热度
+        def tier(c):
+            return (c[1] is not None, c[2])
+
+        scored.sort(key=lambda c: (*tier(c), c[3]), reverse=True)
+        winner = scored[0]
+        if (
+            len(scored) > 1
+            and tier(winner) == tier(scored[1])
+            and winner[3] < scored[1][3] * TITLE_INDEX_POPULARITY_RATIO
+        ):
+            # 无法通过年份和标题区分, 热度也相近
+            return None
+        tmdb_id = winner[0]
+        if winner[1] is None:
+            try:
+                year = self.get_info_from_tmdb_by_id(tmdb_id).get("year")
+            except Exception as e:
+                logger.warning(f"Failed to get details of {tmdb_id}: {e}")
+                return None
+            if not year_matches(year):
+                return None
+        logger.info(f"Got tmdb_id for {query_title} from title index: {tmdb_id}")
+        return tmdb_id
+
+    def _match_cached_title(self, query_title, query_year, year_deviation=0):
+        """在已缓存的条目中模糊匹配, 最佳候选明显优于其他候选时才采用"""
+        if not str(query_year).isdigit():
+            return None
+        matches = self.get_title_matcher().match(
+            "movie" if self.is_movie else "tv",
+            query_title,
+            year=query_year,
+            year_deviation=year_deviation,
+            threshold=TMDB_FUZZY_MATCH_THRESHOLD,
+            limit=2,
+        )
+        if not matches or (
+            len(matches) > 1 and matches[0][1] - matches[1][1] < FUZZY_MATCH_MARGIN
+        ):
+            return None
+        tmdb_id, score = matches[0]
+        logger.info(
+            f"Got tmdb_id for {query_title} from cached titles: {tmdb_id} ({score:.2f})"
+        )
+        return tmdb_id
+
+    def _best_fuzzy_result(self, query_title, res):
+        """返回搜索结果中与查询标题最相似且达到阈值的 tmdb_id"""
+        best_score, tmdb_id = 0, None
+        for rslt in res:
+            titles = (
+                [rslt.title, rslt.original_title]
+                if self.is_movie
+                else [rslt.name, rslt.original_name]
+            )
+            score = max(similarity(query_title, title or "") for title in titles)
+            if score > best_score:
+                best_score, tmdb_id = score, str(rslt.id)
+        if best_score < TMDB_FUZZY_MATCH_THRESHOLD:
+            return None
+        logger.info(
+            f"Got tmdb_id for {query_title} by similarity: {tmdb_id} ({best_score:.2f})"
+        )
+        return tmdb_id
+
+    def get_info_from_tmdb(self, query_dict: dict, year_deviation: int = 0) -> dict:
+        """Get TV/Movie name from tmdb"""
+        return self.get_info_from_tmdb_by_candidates([query_dict], year_deviation)
+
+    def get_info_from_tmdb_by_candidates(
+        self, query_dicts: list, year_deviation: int = 0
+    ) -> dict:
+        """并发查询多个候选 (如中文名和英文名), 使用排在最前的有结果的候选"""
+        # 每个候选使用独立的实例, 避免并发修改 self.tmdb_id
+        tmdb_id = first_match(
+            [
+                partial(
+                    TMDB(movie=self.is_movie, language=self.language).search_tmdb_id,
+                    query_dict,
+                    year_deviation,
+                )
+                for query_dict in query_dicts
+            ]
+        )
+        if not tmdb_id:
             return {}
-        tmdb_info = self.get_info_from_tmdb_by_id(self.tmdb_id)
+        tmdb_info = self.get_info_from_tmdb_by_id(tmdb_id)
         tmdb_info.update({"tmdb_id": self.tmdb_id})
 
         return tmdb_info
 
     def get_info_from_tmdb_by_id(self, tmdb_id: str) -> dict:
         """Get movies/shows' details using tmdb_id"""
-        tmdb_name = ""
         self.tmdb_id = str(tmdb_id)
-        # 先从缓存中读取
-        info = self.get_cache_by_key(self.tmdb_id)
+        key = self.cache_key(self.tmdb_id)
+        # 先从缓存中读取, 过期的缓存直接返回并在后台刷新
+        info, updated_at = self.get_cache_entry(key)
         if info:
-            logger.info(f"Cache hit for {self.tmdb_id}")
+            if time.time() - updated_at > TMDB_CACHE_TTL:
+                self.refresh_in_background(self.tmdb_id)
             return info
 
-        details = self.tmdb_media.details(self.tmdb_id)
+        # 同一条目只由一个进程/线程请求, 其余的等待后读取缓存
+        with singleflight(key):
+            info, _ = self.get_cache_entry(key)
+            if info:
+                return info
+            info = self._get_info_from_tmdb_by_id()
+            self.write_cache_by_key(key, info)
+        return info
+
+    def _get_info_from_tmdb_by_id(self) -> dict:
+        """Get details of self.tmdb_id from tmdb"""
+        tmdb_name = ""
+        tmdb_id = self.tmdb_id
+        # 只附带需要的内容, 一次请求获取详情、翻译和分级
+        details = self.tmdb_media.details(
+            self.tmdb_id,
+            append_to_response="translations,release_dates"
+            if self.is_movie
+            else "translations",
+        )
         date = details.release_date if self.is_movie else details.first_air_date
         date_list = date.split("-")
         if len(date_list) > 1:
@@ -216,7 +786,7 @@ class TMDB:
                     break
         # 判断是否为 nc17
         else:
-            is_nc17 = self.get_movie_certification()
+            is_nc17 = self.get_movie_certification(details.get("release_dates"))
 
         info = {
             "tmdb_name": tmdb_name.replace("/", "／"),
@@ -229,11 +799,14 @@ class TMDB:
             "is_variety": is_variety,
             "is_nc17": is_nc17,
         }
-        self.write_cache_by_key(self.tmdb_id, info)
         return info
 
-    def get_movie_certification(self) -> bool:
-        """Get movie's certifacation"""
+    def get_movie_certification(self, release_dates=None) -> bool:
+        """Get movie's certifacation
+
+        Args:
+            release_dates: details 中附带的 release_dates, 没有时单独请求
+        """
         is_nc17 = False
         _ = {
             "US": "NC-17",
@@ -241,7 +814,9 @@ class TMDB:
             "JP": "R18+",
         }
         try:
-            rslts = self.tmdb_media.release_dates(self.tmdb_id).get("results")
+            if release_dates is None:
+                release_dates = self.tmdb_media.release_dates(self.tmdb_id)
+            rslts = release_dates.get("results")
         except Exception as e:
             logger.exception(f"Getting certifacation of {self.tmdb_id} failed")
             logger.exception(e)
@@ -269,8 +844,31 @@ class TMDB:
 
 
 if __name__ == "__main__":
-    tmdb = TMDB(movie=True)
-    print(tmdb.get_info_from_tmdb_by_id(tmdb_id=27205))
+    import argparse
+
+    parser = argparse.ArgumentParser(description="TMDB")
+    parser.add_argument(
+        "--negative-cache",
+        action="store_true",
+        help="Show searches cached as not found and their hits",
+    )
+    parser.add_argument(
+        "--clear-negative-cache",
+        action="store_true",
+        help="Clear searches cached as not found",
+    )
+    args = parser.parse_args()
+    if args.negative_cache:
+        for entry in TMDB.get_negative_cache_stats():
+            print(
+                f"{entry['hits']:>6}  {entry['media_type']:<5} "
+                f"{entry['query']} ({entry['year']}) [{entry['language']}]"
+            )
+    elif args.clear_negative_cache:
+        print(f"Cleared {TMDB.invalidate_negative_cache()} entries")
+    else:
+        tmdb = TMDB(movie=True)
+        print(tmdb.get_info_from_tmdb_by_id(tmdb_id=27205))
 
-    tmdb_tv = TMDB(movie=False)
-    print(tmdb_tv.get_info_from_tmdb_by_id(tmdb_id=64197))
+        tmdb_tv = TMDB(movie=False)
+        print(tmdb_tv.get_info_from_tmdb_by_id(tmdb_id=64197))
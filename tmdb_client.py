@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""TMDB 请求的共享连接池、限速和并发查询
+
+所有 TMDB 实例共用一个保持连接的 requests.Session，请求前从跨进程共享的令牌桶中
+获取令牌，避免 qB 循环、handle_local_media、手动运行的脚本等同时请求时触发 TMDB
+的限速；相同条目的请求通过 singleflight 合并；多个候选查询 (中文名、英文名等)
+可以并发执行。
+
+并发使用线程池而不是 asyncio：调用方 (qB 循环、media_handle、tg_service 中的同步
+处理函数) 都是同步代码，tmdbv3api 基于 requests，项目也没有异步 HTTP 依赖；线程池
+配合共享连接池即可并发执行候选查询，不需要再提供异步客户端的同步封装。
+"""
+
+import hashlib
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Sequence
+
+import filelock
+import requests
+import settings as _cfg
+from log import logger
+from requests.adapters import HTTPAdapter
+
+# 新增配置项，兼容未更新的 settings.py
+TMDB_RATE_LIMIT = getattr(_cfg, "TMDB_RATE_LIMIT", 20)
+TMDB_MAX_CONCURRENCY = getattr(_cfg, "TMDB_MAX_CONCURRENCY", 4)
+TMDB_TIMEOUT = getattr(_cfg, "TMDB_TIMEOUT", 10)
+
+RATE_LIMIT_DB = "/tmp/tmdb_rate_limit.db"
+SINGLEFLIGHT_STRIPES = 64
+# 连接失败、限速和服务端错误时的重试次数、退避基数 (s) 和需要重试的状态码
+MAX_RETRIES = 2
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """跨进程共享的令牌桶, 每秒补充 rate 个令牌, 最多积累 capacity 个
+
+    令牌数量保存在 SQLite 中, 同一台机器上的所有进程共用一个限额
+    """
+
+    def __init__(
+        self, rate: float, capacity: Optional[float] = None, path=RATE_LIMIT_DB
+    ):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        # 手动控制事务, 使用 BEGIN IMMEDIATE 在读取前获取写锁
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS token_bucket (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        return conn
+
+    def _take(self, conn: sqlite3.Connection) -> float:
+        """尝试取出一个令牌, 返回需要等待的时间"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM token_bucket WHERE id = 1"
+            ).fetchone()
+            now = time.time()
+            tokens = (
+                self.capacity
+                if row is None
+                else min(self.capacity, row[0] + max(now - row[1], 0) * self.rate)
+            )
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+            conn.execute(
+                "INSERT OR REPLACE INTO token_bucket VALUES (1, ?, ?)", (tokens, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def acquire(self):
+        conn = self._connect()
+        try:
+            while wait := self._take(conn):
+                time.sleep(wait)
+        finally:
+            conn.close()
+
+
+def singleflight(key: str) -> filelock.FileLock:
+    """同一个 key 的请求跨进程串行执行
+
+    后到的请求在锁释放后应先读取缓存, 复用先到请求的结果。锁按 key 的哈希分片,
+    避免产生大量锁文件
+    """
+    stripe = int(hashlib.md5(key.encode()).hexdigest(), 16) % SINGLEFLIGHT_STRIPES
+    return filelock.FileLock(f"/tmp/tmdb_singleflight.{stripe}.lock")
+
+
+class TMDBSession(requests.Session):
+    """带连接池、默认超时和限速的 Session
+
+    重试在这里而不是 urllib3 中进行, 每次重试都重新获取令牌, 限速或服务端错误
+    集中出现时也不会超过共享的限额
+    """
+
+    def __init__(self, limiter: TokenBucket, timeout: float = TMDB_TIMEOUT):
+        super().__init__()
+        self.limiter = limiter
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=TMDB_MAX_CONCURRENCY)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(MAX_RETRIES + 1):
+            self.limiter.acquire()
+            try:
+                res = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= MAX_RETRIES:
+                    raise
+                reason, delay = str(e), BACKOFF_FACTOR * 2**attempt
+            else:
+                if res.status_code not in RETRY_STATUSES or attempt >= MAX_RETRIES:
+                    return res
+                # 限速时按 Retry-After 等待
+                retry_after = res.headers.get("Retry-After", "")
+                reason = f"HTTP {res.status_code}"
+                delay = max(
+                    BACKOFF_FACTOR * 2**attempt,
+                    int(retry_after) if retry_after.isdigit() else 0,
+                )
+            logger.warning(f"TMDB request failed: {reason}, retry in {delay}s")
+            time.sleep(delay)
+
+
+rate_limiter = TokenBucket(TMDB_RATE_LIMIT)
+session = TMDBSession(rate_limiter)
+executor = ThreadPoolExecutor(TMDB_MAX_CONCURRENCY, thread_name_prefix="tmdb")
+
+
+def first_match(funcs: Sequence[Callable[[], Any]]) -> Any:
+    """并发执行候选查询, 按候选顺序返回第一个有结果的查询
+
+    排在前面的候选优先: 后面的候选即使先返回, 也要等前面的候选都没有结果才会采用
+    """
+    if len(funcs) <= 1:
+        return funcs[0]() if funcs else None
+    futures = [executor.submit(func) for func in funcs]
+    try:
+        for future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Candidate query failed: {e}")
+                continue
+            if result:
+                return result
+    finally:
+        for future in futures:
+            future.cancel()
+    return None
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""根据媒体库中已有的影视文件夹预热 TMDB 缓存
+
+遍历媒体库 (本地挂载点或 rclone lsjson)，从 `{tmdb-NNN}` 文件夹名中提取 tmdb id，
+按媒体库推断电影/剧集，并发获取缓存中缺失的条目，请求受 tmdb_client 的限速控制。
+已缓存的条目和记录为失败的条目会被跳过，中断后重新运行即可继续。
+
+用法:
+    python tmdb_warmup.py /Media/Movies /Media/TVShows
+    python tmdb_warmup.py --rclone GD-Movies:Movies GD-TVShows:TVShows -w 8
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Iterator, Optional
+
+from library_index import (
+    DATE_FOLDER_RE,
+    MONTH_FOLDER_RE,
+    TMDB_ID_RE,
+    iter_title_folders,
+)
+from log import logger
+from tmdb import TMDB
+from tmdb_client import TMDB_MAX_CONCURRENCY
+
+WARMUP_DB = Path(__file__).parent / "tmdb_warmup.db"
+
+# 每处理多少个条目输出一次进度
+PROGRESS_INTERVAL = 100
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(WARMUP_DB, timeout=30)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS warmup_failed (
+            key TEXT PRIMARY KEY,
+            error TEXT NOT NULL,
+            failed_at REAL NOT NULL
+        )
+        """
+    )
+    return conn
+
+
+def infer_media_type(library: str) -> Optional[str]:
+    """按媒体库名称推断类型, 与 qBittorrent 分类的规则一致"""
+    name = os.path.basename(library.rstrip("/")).split(":")[-1]
+    if name in ("Movies", "NC17-Movies", "Concerts"):
+        return "movie"
+    if name in ("TVShows", "Anime"):
+        return "tv"
+    return None
+
+
+def iter_rclone_title_folders(remote: str) -> Iterator[tuple[str, str]]:
+    """通过 rclone lsjson 流式遍历远端媒体库, 返回 (tmdb_id, path)"""
+    proc = subprocess.Popen(
+        ["rclone", "lsjson", "--dirs-only", "-R", "--max-depth", "3", remote],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        # lsjson 每行输出一个条目: "[", "{...},", "{...}", "]"
+        for line in proc.stdout:
+            line = line.strip().rstrip(",")
+            if not line.startswith("{"):
+                continue
+            parts = json.loads(line)["Path"].split("/")
+            tmdb_match = TMDB_ID_RE.search(parts[-1])
+            if not tmdb_match:
+                continue
+            if len(parts) == 1 or (
+                len(parts) == 3
+                and DATE_FOLDER_RE.match(parts[0])
+                and MONTH_FOLDER_RE.match(parts[1])
+            ):
+                yield tmdb_match.group(1), f"{remote.rstrip('/')}/{'/'.join(parts)}"
+    finally:
+        proc.stdout.close()
+        if proc.wait():
+            logger.error(f"rclone lsjson {remote} exited with {proc.returncode}")
+
+
+def get_failed_keys() -> set:
+    conn = _connect()
+    try:
+        return {row[0] for row in conn.execute("SELECT key FROM warmup_failed")}
+    finally:
+        conn.close()
+
+
+def record_failure(key: str, error: str):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO warmup_failed VALUES (?, ?, ?)",
+                (key, error, time.time()),
+            )
+    finally:
+        conn.close()
+
+
+def clear_failures():
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM warmup_failed")
+    finally:
+        conn.close()
+
+
+def _fetch(is_movie: bool, language: str, tmdb_id: str):
+    TMDB(movie=is_movie, language=language).get_info_from_tmdb_by_id(tmdb_id)
+
+
+def warmup(
+    libraries: list,
+    media_type: Optional[str] = None,
+    rclone: bool = False,
+    language: str = "zh",
+    workers: int = TMDB_MAX_CONCURRENCY,
+) -> dict:
+    """预热缓存, 返回各状态的条目数量"""
+    cached = TMDB.get_cached_keys()
+    failed = get_failed_keys()
+    stats = {"found": 0, "cached": 0, "failed_before": 0, "fetched": 0, "failed": 0}
+    missing = {}
+    for library in libraries:
+        library_type = media_type or infer_media_type(library)
+        if not library_type:
+            logger.error(f"Can not infer media type of {library}, use -t to set it")
+            continue
+        tmdb = TMDB(movie=library_type == "movie", language=language)
+        folders = (
+            iter_rclone_title_folders(library)
+            if rclone
+            else iter_title_folders(library)
+        )
+        logger.info(f"Listing {library} ({library_type})")
+        for tmdb_id, _ in folders:
+            key = tmdb.cache_key(tmdb_id)
+            stats["found"] += 1
+            if key in cached:
+                stats["cached"] += 1
+            elif key in failed:
+                stats["failed_before"] += 1
+            else:
+                missing[key] = (library_type == "movie", tmdb_id)
+    logger.info(
+        f"Found {stats['found']} folders, {stats['cached']} cached, "
+        f"{stats['failed_before']} failed before, {len(missing)} to fetch"
+    )
+
+    start = time.time()
+    with ThreadPoolExecutor(workers, thread_name_prefix="tmdb_warmup") as executor:
+        futures = {
+            executor.submit(_fetch, is_movie, language, tmdb_id): key
+            for key, (is_movie, tmdb_id) in missing.items()
+        }
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                key = futures[future]
+                try:
+                    future.result()
+                    stats["fetched"] += 1
+                except Exception as e:
+                    logger.error(f"Failed to fetch {key}: {e}")
+                    record_failure(key, str(e))
+                    stats["failed"] += 1
+                if done % PROGRESS_INTERVAL == 0 or done == len(futures):
+                    elapsed = time.time() - start
+                    eta = elapsed / done * (len(futures) - done)
+                    logger.info(
+                        f"Progress: {done}/{len(futures)}, "
+                        f"{done / elapsed:.1f}/s, ETA {eta:.0f}s"
+                    )
+        except KeyboardInterrupt:
+            # 已获取的条目都已写入缓存, 重新运行即可继续
+            logger.warning("Interrupted, rerun to resume")
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+    logger.info(f"Warm-up finished: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Warm up TMDB cache from libraries")
+    parser.add_argument(
+        "library", nargs="+", help="Library folders, or rclone remotes with --rclone"
+    )
+    parser.add_argument(
+        "--rclone", action="store_true", help="List libraries with rclone lsjson"
+    )
+    parser.add_argument(
+        "-t",
+        "--media_type",
+        choices=["movie", "tv"],
+        default=None,
+        help="Media type, inferred from the library name by default",
+    )
+    parser.add_argument("-l", "--language", default="zh", help="TMDB language")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=TMDB_MAX_CONCURRENCY,
+        help="Concurrent requests, still limited by TMDB_RATE_LIMIT",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Retry entries that failed in previous runs",
+    )
+    args = parser.parse_args()
+    if args.retry_failed:
+        clear_failures()
+    warmup(
+        args.library,
+        media_type=args.media_type,
+        rclone=args.rclone,
+        language=args.language,
+        workers=args.workers,
+    )
@@ -6,23 +6,40 @@ import re
 import shutil
 import subprocess
 import threading
+import time
 from copy import deepcopy
 from pathlib import Path
 from typing import Union
 
 import requests
+import settings as _cfg
 from log import logger
 from settings import MEDIA_SUFFIX, TG_API_KEY
 
+# 新增配置项，兼容未更新的 settings.py
+RCLONE_MOUNT_RC = getattr(_cfg, "RCLONE_MOUNT_RC", {})
+MOUNT_READY_TIMEOUT = getattr(_cfg, "MOUNT_READY_TIMEOUT", 30)
+
 
 def load_json(path):
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
 
-def dump_json(obj, path):
+def dump_json(obj, path, compact=False):
     with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=4, separators=(",", ": "))
+        if compact:
+            json.dump(obj, f, ensure_ascii=False, separators=(",", ":"))
+        else:
+            json.dump(obj, f, ensure_ascii=False, indent=4, separators=(",", ": "))
+
+
+class ScanError(Exception):
+    """扫描请求部分失败, paths 为发送失败的路径"""
+
+    def __init__(self, paths):
+        self.paths = sorted(paths)
+        super().__init__(f"Failed to send scan request: {self.paths}")
 
 
 # BOT
@@ -187,6 +204,71 @@ def get_file_list(path):
         return False, f"Failed to check {path} due to: {e}"
 
 
+def vfs_refresh(
+    path: Union[str, Path], recursive: bool = False, timeout: int = MOUNT_READY_TIMEOUT
+) -> bool:
+    """通过挂载的 rc 接口强制刷新 path 及其父目录的 VFS 缓存"""
+    path = str(path).rstrip("/")
+    mount_points = [
+        mp
+        for mp in RCLONE_MOUNT_RC
+        if path == mp or path.startswith(mp.rstrip("/") + "/")
+    ]
+    if not mount_points:
+        logger.debug(f"No rclone mount rc configured for {path}")
+        return False
+    mount_point = max(mount_points, key=len)
+    rc_addr = RCLONE_MOUNT_RC[mount_point]
+    rel_path = path.removeprefix(mount_point.rstrip("/")).strip("/")
+    # 父目录刷新后新目录才会出现, 只刷新一层; recursive 只作用于目录本身,
+    # rc 的 recursive 参数对同一次调用中的所有 dir 生效, 因此分两次调用
+    calls = [(os.path.dirname(rel_path), False)] if rel_path else []
+    calls.append((rel_path, recursive))
+    deadline = time.monotonic() + timeout
+    for rel_dir, rel_recursive in calls:
+        cmd = ["rclone", "rc", "vfs/refresh", "--url", f"http://{rc_addr}"]
+        cmd.append(f"dir={rel_dir}")
+        if rel_recursive:
+            cmd.append("recursive=true")
+        remaining = max(deadline - time.monotonic(), 1)
+        try:
+            rslt = subprocess.run(
+                cmd, encoding="utf-8", capture_output=True, timeout=remaining
+            )
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Refreshing vfs cache of {path} timed out")
+            return False
+        if rslt.returncode:
+            logger.warning(f"Refreshing vfs cache of {path} failed: {rslt.stderr}")
+            return False
+        logger.debug(f"Refreshed vfs cache of {rel_dir or '/'}: {rslt.stdout.strip()}")
+    return True
+
+
+def wait_for_path_ready(
+    path: Union[str, Path], timeout: int = MOUNT_READY_TIMEOUT, interval: float = 1
+) -> bool:
+    """等待挂载点上的目录可见且非空, 超时返回 False"""
+    deadline = time.monotonic() + timeout
+    refreshed = False
+    while True:
+        try:
+            if os.listdir(path):
+                return True
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(f"{path} is not ready after {timeout}s")
+            return False
+        # 只需刷新一次, 之后轮询等待结果
+        if not refreshed:
+            refreshed = True
+            vfs_refresh(path, timeout=max(int(remaining), 1))
+            continue
+        time.sleep(min(interval, remaining))
+
+
 class Singleton(type):
     _instance_lock = threading.Lock()
 